@@ -27,6 +27,19 @@ export function formatI256(low: string, high: string, sign: string): Number {
     return formatU256(low, high);
   }
 
+// exact decimal strings of the amounts, prices and liquidity the fee growth is computed from
+export function formatU256String(low: string, high: string): string {
+  return uint256.uint256ToBN({ low: low, high: high }).toString();
+}
+
+export function formatI256String(low: string, high: string, sign: string): string {
+  const value = formatU256String(low, high);
+  if(Number(sign) == 1 && value != "0") {
+    return "-" + value;
+  }
+  return value;
+}
+
 export function formatI32(mag: string, sign: string): Number {
   if(Number(sign) == 1) {
     return -Number(mag);
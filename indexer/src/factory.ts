@@ -13,7 +13,7 @@ import {
   EVENTS,
 } from "../common/constants.ts";
 import {
-  formatFelt, formatI256, formatU256, formatI32, senderAddress
+  formatFelt, formatI256String, formatU256, formatU256String, formatI32, hexToString, senderAddress
 } from "../common/utils.ts";
 
 const filter = {
@@ -92,6 +92,8 @@ export default function transform({ header, events }: Block) {
       poolAddress: formatFelt(event.fromAddress),
       timestamp: Date.parse(header?.timestamp),
       block: Number(header?.blockNumber),
+      txIndex: Number(transaction.meta.transactionIndex),
+      eventIndex: Number(event.index),
       tx_hash: formatFelt(transaction.meta.hash),
       tx_sender: senderAddress(transaction)
     };
@@ -100,7 +102,7 @@ export default function transform({ header, events }: Block) {
       case SELECTOR_KEYS.INITIALIZE: {
         const data = {
           event: EVENTS.INITIALIZE,
-          sqrtPriceX96: formatU256(event.data[0], event.data[1]),
+          sqrtPriceX96: formatU256String(event.data[0], event.data[1]),
           tick: formatI32(event.data[2], event.data[3]),
           ...txMeta,
         }
@@ -116,7 +118,7 @@ export default function transform({ header, events }: Block) {
           owner: formatFelt(event.data[1]),
           tickLower: formatI32(event.data[2], event.data[3]),
           tickUpper: formatI32(event.data[4], event.data[5]),
-          amount: Number(event.data[6]),
+          amount: hexToString(event.data[6]),
           amount0: formatU256(event.data[7], event.data[8]),
           amount1: formatU256(event.data[9], event.data[10]),
           ...txMeta,
@@ -132,7 +134,7 @@ export default function transform({ header, events }: Block) {
           owner: formatFelt(event.data[0]),
           tickLower: formatI32(event.data[1], event.data[2]),
           tickUpper: formatI32(event.data[3], event.data[4]),
-          amount: Number(event.data[5]),
+          amount: hexToString(event.data[5]),
           amount0: formatU256(event.data[6], event.data[7]),
           amount1: formatU256(event.data[8], event.data[9]),
           ...txMeta,
@@ -147,10 +149,10 @@ export default function transform({ header, events }: Block) {
           event: EVENTS.SWAP,
           sender: formatFelt(event.data[0]),
           recipient: formatFelt(event.data[1]),
-          amount0: formatI256(event.data[2], event.data[3], event.data[4]),
-          amount1: formatI256(event.data[5], event.data[6], event.data[7]),
-          sqrtPriceX96: formatU256(event.data[8], event.data[9]),
-          liquidity: Number(event.data[10]),
+          amount0: formatI256String(event.data[2], event.data[3], event.data[4]),
+          amount1: formatI256String(event.data[5], event.data[6], event.data[7]),
+          sqrtPriceX96: formatU256String(event.data[8], event.data[9]),
+          liquidity: hexToString(event.data[10]),
           tick: formatI32(event.data[11], event.data[12]),
           ...txMeta,
         }
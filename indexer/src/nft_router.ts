@@ -48,6 +48,8 @@ export default async function transform({ header, events }: Block) {
     const txMeta = {
       timestamp: Date.parse(header?.timestamp),
       block: Number(header?.blockNumber),
+      txIndex: Number(transaction.meta.transactionIndex),
+      eventIndex: Number(event.index),
       tx_hash: formatFelt(transaction.meta.hash),
       tx_sender: senderAddress(transaction),
     };
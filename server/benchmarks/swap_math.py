@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import random
+import time
+from decimal import Decimal
+
+from bson import Decimal128
+from dotenv import load_dotenv
+
+from server.cli import ENV_FILE
+
+load_dotenv(ENV_FILE)
+
+from server.transform.pricing import sqrt_price_x96_to_token_prices
+from server.transform.state_store import apply_update_data
+from server.utils import amount_after_decimals
+
+
+# CPU time of the numeric part of a swap: scaling the amounts, pricing the pool and applying the pool update,
+# with the Decimal128 conversions and the powers of ten computed on every event as before, and with the
+# Decimal state and the precomputed tables:
+#   poetry run python benchmarks/swap_math.py
+
+POOL_FIELDS = ('totalValueLockedToken0', 'totalValueLockedToken1', 'token0Price', 'token1Price',
+               'volumeToken0', 'volumeToken1', 'volumeUSD', 'feesUSD')
+
+
+async def get_swap_records(count: int, rnd: random.Random) -> list[dict]:
+    return [
+        {
+            'sqrtPriceX96': str(rnd.randint(2 ** 90, 2 ** 100)),
+            'amount0': -rnd.randint(1, 10 ** 20),
+            'amount1': rnd.randint(1, 10 ** 9),
+        }
+        for _ in range(count)
+    ]
+
+
+async def reference_swap(pool: dict, record: dict):
+    amount0 = Decimal(record['amount0']) / Decimal(10) ** Decimal(18)
+    amount1 = Decimal(record['amount1']) / Decimal(10) ** Decimal(6)
+    num = Decimal(record['sqrtPriceX96']) ** 2
+    price1 = num / Decimal(2 ** 192) * Decimal(10) ** Decimal(18) / Decimal(10) ** Decimal(6)
+    price0 = Decimal(0) if price1 == Decimal(0) else Decimal('1') / price1
+    pool['totalValueLockedToken0'] = Decimal128(pool['totalValueLockedToken0'].to_decimal() + amount0)
+    pool['totalValueLockedToken1'] = Decimal128(pool['totalValueLockedToken1'].to_decimal() + amount1)
+    pool['token0Price'] = Decimal128(price0)
+    pool['token1Price'] = Decimal128(price1)
+    pool['volumeToken0'] = Decimal128(pool['volumeToken0'].to_decimal() + abs(amount0))
+    pool['volumeToken1'] = Decimal128(pool['volumeToken1'].to_decimal() + abs(amount1))
+    pool['volumeUSD'] = Decimal128(pool['volumeUSD'].to_decimal() + abs(amount1))
+    pool['feesUSD'] = Decimal128(pool['feesUSD'].to_decimal() + abs(amount1) * Decimal('0.003'))
+
+
+async def swap(pool: dict, record: dict):
+    amount0 = await amount_after_decimals(record['amount0'], 18)
+    amount1 = await amount_after_decimals(record['amount1'], 6)
+    price0, price1 = await sqrt_price_x96_to_token_prices(record['sqrtPriceX96'], 18, 6)
+    await apply_update_data(pool, {
+        '$set': {
+            'token0Price': price0,
+            'token1Price': price1,
+        },
+        '$inc': {
+            'totalValueLockedToken0': amount0,
+            'totalValueLockedToken1': amount1,
+            'volumeToken0': abs(amount0),
+            'volumeToken1': abs(amount1),
+            'volumeUSD': abs(amount1),
+            'feesUSD': abs(amount1) * Decimal('0.003'),
+        },
+    })
+
+
+async def run_benchmark(count: int):
+    records = await get_swap_records(count, random.Random(1))
+    reference_pool = {field: Decimal128('123.456') for field in POOL_FIELDS}
+    pool = {field: Decimal('123.456') for field in POOL_FIELDS}
+
+    started = time.perf_counter()
+    for record in records:
+        await reference_swap(reference_pool, record)
+    reference_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for record in records:
+        await swap(pool, record)
+    current_time = time.perf_counter() - started
+
+    print(f'{count} swaps: Decimal128 and computed powers {reference_time / count * 1e6:.2f}us per swap, '
+          f'Decimal and precomputed tables {current_time / count * 1e6:.2f}us per swap')
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=100000)
+    args = parser.parse_args()
+    asyncio.run(run_benchmark(args.count))
+
+
+if __name__ == '__main__':
+    run()
@@ -25,6 +25,10 @@ async def run():
     parser.add_argument('action', choices=['events', 'positions', 'leaderboard', 'graphql', 'strk-calculation'], 
                         help='Choose an action')
     parser.add_argument('--env-file', help='Run with mainnet config')
+    parser.add_argument('--follow', action='store_true',
+                        help='Process new events as they arrive using a MongoDB change stream (events and positions)')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Replay the pools events into new collections and swap them in (events)')
 
     args = parser.parse_args()
     
@@ -37,6 +41,7 @@ async def run():
     from server.transform.leaderboard_transformer import run_leaderboard_transformer
     from server.transform.positions_transformer import run_positions_transformer
     from server.scripts.strk_rewards import strk_rewards_calculation
+    from server.rpc_client import RpcClients
 
     mongo_url = os.environ.get('MONGODB_CONNECTION_STRING', None)
     if mongo_url is None:
@@ -50,13 +55,17 @@ async def run():
     rpc_url = os.environ.get('RPC_URL', None)
     if rpc_url is None:
         sys.exit('RPC_URL not set')
-    elif args.action == 'events':
-        await run_events_transformer(mongo_url, mongo_database, rpc_url)
-    elif args.action == 'positions':
-        await run_positions_transformer(mongo_url, mongo_database, rpc_url)
-    elif args.action == 'leaderboard':
-        await run_leaderboard_transformer(mongo_url, mongo_database, rpc_url)
-    elif args.action == 'graphql':
-        await run_graphql_server(mongo_url, mongo_database)
-    elif args.action == 'strk-calculation':
-        await strk_rewards_calculation(mongo_url, mongo_database)
+
+    try:
+        if args.action == 'events':
+            await run_events_transformer(mongo_url, mongo_database, rpc_url, args.follow, args.rebuild)
+        elif args.action == 'positions':
+            await run_positions_transformer(mongo_url, mongo_database, rpc_url, args.follow)
+        elif args.action == 'leaderboard':
+            await run_leaderboard_transformer(mongo_url, mongo_database, rpc_url)
+        elif args.action == 'graphql':
+            await run_graphql_server(mongo_url, mongo_database)
+        elif args.action == 'strk-calculation':
+            await strk_rewards_calculation(mongo_url, mongo_database)
+    finally:
+        await RpcClients.close()
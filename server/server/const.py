@@ -21,10 +21,20 @@ class Collection:
     POOLS_HOUR_DATA = 'pools_hour_data'
     TOKENS_DAY_DATA = 'tokens_day_data'
     TOKENS_HOUR_DATA = 'tokens_hour_data'
+    TICKS = 'ticks'
     LP_LEADERBOARD = 'lp_leaderboard'
     LP_LEADERBOARD_SNAPSHOT = 'lp_leaderboard_snapshot'
     VOLUME_LEADERBOARD = 'volume_leaderboard'
     VOLUME_LEADERBOARD_SNAPSHOT = 'volume_leaderboard_snapshot'
+    TRANSFORMER_PROGRESS = 'transformer_progress'
+    LEADERBOARD_RUNS = 'leaderboard_runs'
+
+
+class Transformer:
+    EVENTS = 'events'
+    POSITIONS = 'positions'
+    TEAHOUSE_POSITIONS = 'teahouse_positions'
+    LEADERBOARD = 'leaderboard'
 
 
 class Event:
@@ -77,3 +87,26 @@ ZERO_DECIMAL = Decimal(0)
 DEFAULT_DECIMALS = 18
 MAX_UINT128 = 2 ** 128 - 1
 TIME_INTERVAL = 60  # in seconds
+EVENTS_BATCH_SIZE = int(os.environ.get('EVENTS_BATCH_SIZE', 1000))
+EVENTS_PIPELINE_SIZE = int(os.environ.get('EVENTS_PIPELINE_SIZE', 2))  # batches read ahead and waiting to be written
+POSITIONS_PREFETCH_SIZE = int(os.environ.get('POSITIONS_PREFETCH_SIZE', 1000))  # records read ahead
+REBUILD_CURSOR_BATCH_SIZE = int(os.environ.get('REBUILD_CURSOR_BATCH_SIZE', 10000))
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 50))
+FOLLOW_BATCH_SIZE = int(os.environ.get('FOLLOW_BATCH_SIZE', 100))
+FOLLOW_MAX_AWAIT_MS = 500
+RPC_MAX_CONCURRENCY = int(os.environ.get('RPC_MAX_CONCURRENCY', 20))
+RPC_MAX_RETRIES = int(os.environ.get('RPC_MAX_RETRIES', 3))
+RPC_RETRY_BACKOFF = 0.5  # in seconds, doubled on every retry
+RPC_REQUEST_TIMEOUT = 30  # in seconds
+RPC_CACHE_PATH = os.environ.get('RPC_CACHE_PATH')
+RPC_CACHE_MAX_SIZE = int(os.environ.get('RPC_CACHE_MAX_SIZE_MB', 512)) * 1024 * 1024
+TOKEN_REGISTRY_SIZE = int(os.environ.get('TOKEN_REGISTRY_SIZE', 10000))
+BLOCK_TIMES_INDEX_SIZE = int(os.environ.get('BLOCK_TIMES_INDEX_SIZE', 5000000))  # latest blocks kept in memory
+PRICE_HISTORY_REFRESH_INTERVAL = int(os.environ.get('PRICE_HISTORY_REFRESH_INTERVAL', 60))  # in seconds
+ETH_PRICE_HISTORY_SIZE = int(os.environ.get('ETH_PRICE_HISTORY_SIZE', 100000))
+FEE_GROWTH_RECONCILE_INTERVAL = int(os.environ.get('FEE_GROWTH_RECONCILE_INTERVAL', 3600))  # in seconds
+POSITIONS_VALUATION_INTERVAL = int(os.environ.get('POSITIONS_VALUATION_INTERVAL', 300))  # in seconds
+LEADERBOARD_CONCURRENCY = int(os.environ.get('LEADERBOARD_CONCURRENCY', 20))  # positions calculated at once
+LEADERBOARD_BULK_WRITE_SIZE = int(os.environ.get('LEADERBOARD_BULK_WRITE_SIZE', 500))  # records written at once
+LEADERBOARD_LEASE_TTL = int(os.environ.get('LEADERBOARD_LEASE_TTL', 600))  # in seconds
+FEES_VERIFICATION_RATE = float(os.environ.get('FEES_VERIFICATION_RATE', 0))  # share of offline fees checked by RPC
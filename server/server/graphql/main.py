@@ -5,25 +5,27 @@ import strawberry
 from typing import List
 
 from aiohttp import web
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient
 from strawberry.aiohttp.views import GraphQLView
 from strawberry.dataloader import DataLoader
 # import simplejson as json
 
+from server.const import MONGO_MAX_POOL_SIZE
 from server.graphql.query import Query
 
 from server.graphql.resolvers.pools import Pool, get_pool
 from server.graphql.resolvers.tokens import Token, get_token
 from server.query_utils import get_transaction_value_data
+from server.transform.price_history import create_price_history_indexes
 
 async def load_pools(db, keys) -> List[Pool]:
-    return [await get_pool(db, key) for key in keys]
+    return await asyncio.gather(*[get_pool(db, key) for key in keys])
 
 async def load_tokens(db, keys) -> List[Token]:
-    return [await get_token(db, key) for key in keys]
+    return await asyncio.gather(*[get_token(db, key) for key in keys])
 
 async def load_transaction_value(db, keys) -> List[dict]:
-    return [await get_transaction_value_data(db, key) for key in keys]
+    return await asyncio.gather(*[get_transaction_value_data(db, key) for key in keys])
 
 
 class IndexerGraphQLView(GraphQLView):
@@ -39,9 +41,10 @@ class IndexerGraphQLView(GraphQLView):
 
 
 async def run_graphql_server(mongo_url, mongo_database):
-    mongo = MongoClient(mongo_url)
+    mongo = AsyncMongoClient(mongo_url, maxPoolSize=MONGO_MAX_POOL_SIZE)
     db_name = mongo_database.replace('-', '_')
     db = mongo[db_name]
+    await create_price_history_indexes(db)
 
     schema = strawberry.Schema(query=Query)
     view = IndexerGraphQLView(db, schema=schema)
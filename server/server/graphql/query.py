@@ -15,6 +15,7 @@ from server.graphql.resolvers.pools_data import PoolData, get_pools_data
 from server.graphql.resolvers.factories_day_data import FactoryDayData, get_factories_day_data
 from server.graphql.resolvers.factories_data import FactoriesData, get_factories_data
 from server.graphql.resolvers.transactions import Transaction, get_transactions
+from server.graphql.resolvers.ticks import LiquidityDistributionTick, Tick, get_liquidity_distribution, get_ticks
 from server.graphql.resolvers.lp_leaderboard import LpLeaderboard, get_lp_leaderboard_points
 from server.graphql.resolvers.lp_leaderboard_snapshot import LpLeaderboardSnapshot, get_lp_leaderboard_snapshot
 from server.graphql.resolvers.volume_leaderboard import VolumeLeaderboard, get_volume_leaderboard_points
@@ -37,6 +38,8 @@ class Query:
     factories_day_data: List[FactoryDayData] = strawberry.field(resolver=get_factories_day_data)
     factories_data: List[FactoriesData] = strawberry.field(resolver=get_factories_data)
     transactions: List[Transaction] = strawberry.field(resolver=get_transactions)
+    ticks: List[Tick] = strawberry.field(resolver=get_ticks)
+    liquidity_distribution: List[LiquidityDistributionTick] = strawberry.field(resolver=get_liquidity_distribution)
     lp_leaderboard: List[LpLeaderboard] = strawberry.field(resolver=get_lp_leaderboard_points)
     lp_leaderboard_snapshot: List[LpLeaderboardSnapshot] = strawberry.field(resolver=get_lp_leaderboard_snapshot)
     volume_leaderboard: List[VolumeLeaderboard] = strawberry.field(resolver=get_volume_leaderboard_points)
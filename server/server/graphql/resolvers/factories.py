@@ -2,7 +2,7 @@ from decimal import Decimal
 from typing import List, Optional
 
 import strawberry
-from pymongo.database import Database
+from pymongo.asynchronous.database import AsyncDatabase
 
 from server.graphql.resolvers.helpers import BlockFilter, add_block_constraint
 from server.const import Collection, ZERO_DECIMAL128
@@ -42,7 +42,7 @@ class FactoryFilter:
 
 
 async def get_factories(info, block: Optional[BlockFilter] = None, where: Optional[FactoryFilter] = None) -> List[Factory]:
-    db: Database = info.context['db']
+    db: AsyncDatabase = info.context['db']
     query = {}
 
     if where is not None:
@@ -52,4 +52,4 @@ async def get_factories(info, block: Optional[BlockFilter] = None, where: Option
     await add_block_constraint(query, block)
 
     cursor = db[Collection.FACTORIES].find(query)
-    return [Factory.from_mongo(d) for d in cursor]
+    return [Factory.from_mongo(d) async for d in cursor]
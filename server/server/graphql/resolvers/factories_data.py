@@ -1,7 +1,7 @@
 from typing import List
 
 import strawberry
-from pymongo.database import Database
+from pymongo.asynchronous.database import AsyncDatabase
 from strawberry.types import Info
 
 from server.graphql.resolvers.helpers import (
@@ -29,7 +29,7 @@ class FactoriesData:
 
 
 async def get_factories_data(info: Info) -> List[FactoriesData]:
-    db: Database = info.context['db']
+    db: AsyncDatabase = info.context['db']
 
     total_value_locked_usd = None
     factories_period_data = {}
@@ -52,10 +52,10 @@ async def get_factories_data(info: Info) -> List[FactoriesData]:
                 }
             }
         ]
-        cursor = db[Collection.FACTORIES_HOUR_DATA].aggregate(pipeline)
+        cursor = await db[Collection.FACTORIES_HOUR_DATA].aggregate(pipeline)
         
         try:
-            record = next(cursor)
+            record = await cursor.next()
             total_value_locked_usd = str(record['totalValueLockedUSD'].to_decimal())
             factories_period_data[period_name] = {
                 'feesUSD': str(record['feesUSD'].to_decimal()),
@@ -65,9 +65,9 @@ async def get_factories_data(info: Info) -> List[FactoriesData]:
                 'volumeUSD': str(record['volumeUSD'].to_decimal()),
                 'txCount': str(record['txCount']),
             }
-        except StopIteration:
+        except StopAsyncIteration:
             if total_value_locked_usd is None:
-                factory_record = next(db[Collection.FACTORIES].find({}))
+                factory_record = await db[Collection.FACTORIES].find_one({})
                 total_value_locked_usd = str(factory_record['totalValueLockedUSD'].to_decimal())
 
             factories_period_data[period_name] = {
@@ -3,7 +3,7 @@ from decimal import Decimal
 from typing import List, Optional
 
 import strawberry
-from pymongo.database import Database
+from pymongo.asynchronous.database import AsyncDatabase
 from strawberry.types import Info
 
 from server.graphql.resolvers.helpers import (
@@ -43,10 +43,10 @@ class FactoryDayData:
 async def get_factories_day_data(
     info: Info, first: Optional[int] = 100, skip: Optional[int] = 0, orderBy: Optional[str] = None, 
     orderByDirection: Optional[str] = 'asc') -> List[FactoryDayData]:
-    db: Database = info.context['db']
+    db: AsyncDatabase = info.context['db']
     query = {}
 
     cursor = db[Collection.FACTORIES_DAY_DATA].find(query, skip=skip, limit=first)
     cursor = await add_order_by_constraint(cursor, orderBy, orderByDirection)
 
-    return [FactoryDayData.from_mongo(d) for d in cursor]
+    return [FactoryDayData.from_mongo(d) async for d in cursor]
@@ -4,7 +4,7 @@ from typing import Optional, List
 
 from pymongo import ASCENDING, DESCENDING
 from pymongo.cursor import CursorType
-from pymongo.database import Database
+from pymongo.asynchronous.database import AsyncDatabase
 
 import strawberry
 
@@ -113,12 +113,12 @@ async def filter_by_pool_address(where: WhereFilterForPoolData, query: dict):
         query['poolAddress'] = {'$in': pool_in}
 
 
-async def filter_pools_by_token_addresses(where: WhereFilterForPoolData, query: dict, db: Database):
+async def filter_pools_by_token_addresses(where: WhereFilterForPoolData, query: dict, db: AsyncDatabase):
     if where.both_token_address_in:
         tokens_in = [format_address(token) for token in where.both_token_address_in]
         pool_query = {"$and": [{"token0": {"$in": tokens_in}}, {"token1": {"$in": tokens_in}}]}
         cursor = db[Collection.POOLS].find(pool_query)
-        pool_addresses = [d["poolAddress"] for d in cursor]
+        pool_addresses = [d["poolAddress"] async for d in cursor]
         if where.pool_address_in:
             where.pool_address_in = [pool_address for pool_address in pool_addresses if pool_address in where.pool_address_in]
         else:
@@ -3,7 +3,7 @@ from decimal import Decimal
 from typing import List, Optional
 
 import strawberry
-from pymongo.database import Database
+from pymongo.asynchronous.database import AsyncDatabase
 from strawberry.types import Info
 import pytz
 
@@ -75,7 +75,7 @@ async def get_lp_leaderboard_snapshot(
     info: Info, first: Optional[int] = 100, skip: Optional[int] = 0, orderBy: Optional[str] = None, 
     orderByDirection: Optional[str] = 'asc', where: Optional[WhereFilterForNftPosition] = None
 ) -> List[LpLeaderboardSnapshot]:
-    db: Database = info.context['db']
+    db: AsyncDatabase = info.context['db']
     query = {}
     if where is not None:
         if where.position_id is not None:
@@ -87,4 +87,4 @@ async def get_lp_leaderboard_snapshot(
 
     cursor = db[Collection.LP_LEADERBOARD_SNAPSHOT].find(query, skip=skip, limit=first)
     cursor = await add_order_by_constraint(cursor, orderBy, orderByDirection)
-    return [LpLeaderboardSnapshot.from_mongo(d) for d in cursor]
+    return [LpLeaderboardSnapshot.from_mongo(d) async for d in cursor]
@@ -2,7 +2,7 @@ from decimal import Decimal
 from typing import List, Optional
 
 import strawberry
-from pymongo.database import Database
+from pymongo.asynchronous.database import AsyncDatabase
 from strawberry.types import Info
 
 from server.graphql.resolvers.helpers import add_order_by_constraint, WhereFilterForNftPosition
@@ -25,6 +25,10 @@ class NftPosition:
     withdrawnToken1: Decimal
     collectedFeesToken0: Decimal
     collectedFeesToken1: Decimal
+    # valued at the current pool price by the positions transformer
+    amount0Current: Decimal
+    amount1Current: Decimal
+    valueUSD: Decimal
 
     token0Address: strawberry.Private[str]
     token1Address: strawberry.Private[str]
@@ -52,6 +56,9 @@ class NftPosition:
             liquidity=data.get('liquidity', ZERO_DECIMAL128).to_decimal(),
             collectedFeesToken0=data['collectedFeesToken0'].to_decimal(),
             collectedFeesToken1=data['collectedFeesToken1'].to_decimal(),
+            amount0Current=data.get('amount0Current', ZERO_DECIMAL128).to_decimal(),
+            amount1Current=data.get('amount1Current', ZERO_DECIMAL128).to_decimal(),
+            valueUSD=data.get('valueUSD', ZERO_DECIMAL128).to_decimal(),
         )
 
 
@@ -59,7 +66,7 @@ async def get_nft_positions(
     info: Info, first: Optional[int] = 100, skip: Optional[int] = 0, orderBy: Optional[str] = None, 
     orderByDirection: Optional[str] = 'asc', where: Optional[WhereFilterForNftPosition] = None
 ) -> List[NftPosition]:
-    db: Database = info.context['db']
+    db: AsyncDatabase = info.context['db']
 
     query = {}
     if where is not None:
@@ -73,4 +80,4 @@ async def get_nft_positions(
     cursor = db[Collection.POSITIONS].find(query, skip=skip, limit=first)
     cursor = await add_order_by_constraint(cursor, orderBy, orderByDirection)
 
-    return [NftPosition.from_mongo(d) for d in cursor]
+    return [NftPosition.from_mongo(d) async for d in cursor]
@@ -4,7 +4,7 @@ from typing import List, Optional
 
 import strawberry
 from strawberry.types import Info
-from pymongo.database import Database
+from pymongo.asynchronous.database import AsyncDatabase
 
 from server.graphql.resolvers.helpers import (
     BlockFilter,
@@ -74,7 +74,7 @@ class Pool:
             feeGrowthGlobal1X128=Decimal(int(data.get('feeGrowthGlobal1X128', '0x0'), 16)),
             liquidity=data.get('liquidity', ZERO_DECIMAL128).to_decimal(),
             tick=data.get('tick', 0),
-            sqrtPriceX96=data.get('sqrtPriceX96', 0),
+            sqrtPriceX96=float(data.get('sqrtPriceX96', 0)),
             token0Price=data.get('token0Price', ZERO_DECIMAL128).to_decimal(),
             token1Price=data.get('token1Price', ZERO_DECIMAL128).to_decimal(),
             totalValueLockedToken0=data.get('totalValueLockedToken0', ZERO_DECIMAL128).to_decimal(),
@@ -96,7 +96,7 @@ async def get_pools(
     info: Info, first: Optional[int] = 100, skip: Optional[int] = 0, orderBy: Optional[str] = None, 
     orderByDirection: Optional[str] = "asc", block: Optional[BlockFilter] = None, where: Optional[WhereFilterForPool] = None
 ) -> List[Pool]:
-    db: Database = info.context['db']
+    db: AsyncDatabase = info.context['db']
     query = {}
     await filter_by_the_latest_value(query)
     await add_block_constraint(query, block)
@@ -106,9 +106,9 @@ async def get_pools(
 
     cursor = db[Collection.POOLS].find(query, skip=skip, limit=first)
     cursor = await add_order_by_constraint(cursor, orderBy, orderByDirection)
-    return [Pool.from_mongo(d) for d in cursor]
+    return [Pool.from_mongo(d) async for d in cursor]
 
-async def get_pool(db: Database, id: str) -> Pool:
+async def get_pool(db: AsyncDatabase, id: str) -> Pool:
     query = {'poolAddress': id}
-    pool = db['pools'].find_one(query)
+    pool = await db['pools'].find_one(query)
     return Pool.from_mongo(pool)
\ No newline at end of file
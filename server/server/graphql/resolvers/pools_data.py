@@ -2,7 +2,7 @@ from dataclasses import field
 from typing import List, Optional
 
 import strawberry
-from pymongo.database import Database
+from pymongo.asynchronous.database import AsyncDatabase
 from strawberry.types import Info
 
 from server.graphql.resolvers.helpers import (
@@ -52,7 +52,7 @@ async def get_pools_data(
     info: Info, first: Optional[int] = 100, skip: Optional[int] = 0, orderBy: Optional[str] = None, 
     orderByDirection: Optional[str] = 'asc', where: Optional[WhereFilterForPoolAndPeriodAndTokens] = None
 ) -> List[PoolData]:
-    db: Database = info.context['db']
+    db: AsyncDatabase = info.context['db']
 
     periods = await validate_period_input(where)
 
@@ -66,7 +66,7 @@ async def get_pools_data(
 
     pools = {}
     pools_addresses = []
-    for record in cursor:
+    async for record in cursor:
         pool_address = record['poolAddress']
         add_empty_pool_data(pools, pool_address, periods)
         pools_addresses.append(pool_address)
@@ -94,8 +94,8 @@ async def get_pools_data(
             }
         ]
 
-        cursor = db[Collection.POOLS_HOUR_DATA ].aggregate(pipeline)
-        for record in cursor:
+        cursor = await db[Collection.POOLS_HOUR_DATA ].aggregate(pipeline)
+        async for record in cursor:
             pool_address = record['_id']
             pools[pool_address]['period'][period_name] = {
                 'feesUSD': str(record['feesUSD'].to_decimal()),
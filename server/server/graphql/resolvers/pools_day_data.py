@@ -3,7 +3,7 @@ from decimal import Decimal
 from typing import List, Optional
 
 import strawberry
-from pymongo.database import Database
+from pymongo.asynchronous.database import AsyncDatabase
 from strawberry.types import Info
 
 from server.graphql.resolvers.helpers import (
@@ -64,7 +64,7 @@ class PoolDayData:
             liquidity=data['liquidity'].to_decimal(),
             feeGrowthGlobal0X128=Decimal(int(data['feeGrowthGlobal0X128'], 16)),
             feeGrowthGlobal1X128=Decimal(int(data['feeGrowthGlobal1X128'], 16)),
-            sqrtPriceX96=data['sqrtPriceX96'],
+            sqrtPriceX96=float(data['sqrtPriceX96']),
             tick=data['tick'],
             dayId=data['dayId'],
             datetime=data['date'],
@@ -82,7 +82,7 @@ async def get_pools_day_data(
     info: Info, first: Optional[int] = 100, skip: Optional[int] = 0, orderBy: Optional[str] = None, 
     orderByDirection: Optional[str] = 'asc', where: Optional[WhereFilterForPoolData] = None
 ) -> List[PoolDayData]:
-    db: Database = info.context['db']
+    db: AsyncDatabase = info.context['db']
     query = {}
 
     if where is not None:
@@ -92,4 +92,4 @@ async def get_pools_day_data(
     cursor = db[Collection.POOLS_DAY_DATA].find(query, skip=skip, limit=first)
     cursor = await add_order_by_constraint(cursor, orderBy, orderByDirection)
 
-    return [PoolDayData.from_mongo(d) for d in cursor]
+    return [PoolDayData.from_mongo(d) async for d in cursor]
@@ -0,0 +1,92 @@
+from decimal import Decimal
+from typing import List, Optional
+
+import strawberry
+from pymongo import ASCENDING
+from pymongo.asynchronous.database import AsyncDatabase
+from strawberry.types import Info
+
+from server.graphql.resolvers.helpers import WhereFilterForPoolData, add_order_by_constraint, filter_by_pool_address
+from server.const import Collection, ZERO_DECIMAL
+from server.graphql.resolvers.pools import Pool
+from server.utils import format_address
+
+
+TICK_BASE = Decimal('1.0001')
+
+
+@strawberry.type
+class Tick:
+    tickIdx: int
+    liquidityGross: Decimal
+    liquidityNet: Decimal
+    feeGrowthOutside0X128: Decimal
+    feeGrowthOutside1X128: Decimal
+
+    poolAddress: strawberry.Private[str]
+    @strawberry.field
+    def pool(self, info: Info) -> Pool:
+        return info.context["pool_loader"].load(self.poolAddress)
+
+    @classmethod
+    def from_mongo(cls, data):
+        return cls(
+            poolAddress=data['poolAddress'],
+            tickIdx=data['tickIdx'],
+            liquidityGross=data['liquidityGross'].to_decimal(),
+            liquidityNet=data['liquidityNet'].to_decimal(),
+            feeGrowthOutside0X128=Decimal(int(data['feeGrowthOutside0X128'], 16)),
+            feeGrowthOutside1X128=Decimal(int(data['feeGrowthOutside1X128'], 16)),
+        )
+
+
+@strawberry.type
+class LiquidityDistributionTick:
+    tickIdx: int
+    liquidityNet: Decimal
+    # liquidity in range from this tick up to the next initialized one
+    liquidityActive: Decimal
+    # raw prices at the tick, not adjusted for the tokens decimals
+    price0: Decimal
+    price1: Decimal
+
+
+async def get_ticks(
+    info: Info, first: Optional[int] = 100, skip: Optional[int] = 0, orderBy: Optional[str] = 'tickIdx',
+    orderByDirection: Optional[str] = 'asc', where: Optional[WhereFilterForPoolData] = None
+) -> List[Tick]:
+    db: AsyncDatabase = info.context['db']
+    query = {}
+    if where is not None:
+        await filter_by_pool_address(where, query)
+
+    cursor = db[Collection.TICKS].find(query, skip=skip, limit=first)
+    cursor = await add_order_by_constraint(cursor, orderBy, orderByDirection)
+    return [Tick.from_mongo(d) async for d in cursor]
+
+
+async def get_liquidity_distribution(
+    info: Info, poolAddress: str, tickLower: Optional[int] = None, tickUpper: Optional[int] = None
+) -> List[LiquidityDistributionTick]:
+    db: AsyncDatabase = info.context['db']
+    query = {'poolAddress': format_address(poolAddress)}
+
+    # the active liquidity is summed from the lowest tick, so every tick of the pool is read
+    liquidity_active = ZERO_DECIMAL
+    distribution = []
+    async for tick in db[Collection.TICKS].find(query).sort('tickIdx', ASCENDING):
+        liquidity_net = tick['liquidityNet'].to_decimal()
+        liquidity_active += liquidity_net
+        if tickLower is not None and tick['tickIdx'] < tickLower:
+            continue
+        if tickUpper is not None and tick['tickIdx'] > tickUpper:
+            break
+        price0 = TICK_BASE ** tick['tickIdx']
+        distribution.append(LiquidityDistributionTick(
+            tickIdx=tick['tickIdx'],
+            liquidityNet=liquidity_net,
+            liquidityActive=liquidity_active,
+            price0=price0,
+            price1=1 / price0,
+        ))
+    return distribution
@@ -2,7 +2,7 @@ from decimal import Decimal
 from typing import List, Optional
 
 import strawberry
-from pymongo.database import Database
+from pymongo.asynchronous.database import AsyncDatabase
 from strawberry.types import Info
 
 from server.graphql.resolvers.helpers import add_order_by_constraint, WhereFilterForToken
@@ -50,7 +50,7 @@ async def get_tokens(
     info: Info, first: Optional[int] = 100, skip: Optional[int] = 0, orderBy: Optional[str] = None, 
     orderByDirection: Optional[str] = 'asc', where: Optional[WhereFilterForToken] = None
 ) -> List[Token]:
-    db: Database = info.context['db']
+    db: AsyncDatabase = info.context['db']
     query = {}
 
     if where is not None:
@@ -63,10 +63,10 @@ async def get_tokens(
     cursor = db[Collection.TOKENS].find(query, skip=skip, limit=first)
     cursor = await add_order_by_constraint(cursor, orderBy, orderByDirection)
 
-    return [Token.from_mongo(d) for d in cursor]
+    return [Token.from_mongo(d) async for d in cursor]
 
 
-async def get_token(db: Database, id: str) -> Token:
+async def get_token(db: AsyncDatabase, id: str) -> Token:
     query = {'tokenAddress': id}
-    token = db['tokens'].find_one(query)
+    token = await db['tokens'].find_one(query)
     return Token.from_mongo(token)
@@ -2,7 +2,7 @@ from dataclasses import field
 from typing import List, Optional
 
 import strawberry
-from pymongo.database import Database
+from pymongo.asynchronous.database import AsyncDatabase
 from strawberry.types import Info
 
 from server.graphql.resolvers.helpers import (
@@ -51,7 +51,7 @@ async def get_tokens_data(
     info: Info, first: Optional[int] = 100, skip: Optional[int] = 0, orderBy: Optional[str] = None, 
     orderByDirection: Optional[str] = 'asc', where: Optional[WhereFilterForTokenAndPeriod] = None
 ) -> List[TokenData]:
-    db: Database = info.context['db']
+    db: AsyncDatabase = info.context['db']
 
     periods = await validate_period_input(where)
 
@@ -64,7 +64,7 @@ async def get_tokens_data(
 
     tokens = {}
     tokens_addresses = []
-    for record in cursor:
+    async for record in cursor:
         token_address = record['tokenAddress']
         await add_empty_token_data(tokens, token_address, periods)
         tokens_addresses.append(token_address)
@@ -98,8 +98,8 @@ async def get_tokens_data(
             }
         ]
 
-        cursor = db[Collection.TOKENS_HOUR_DATA ].aggregate(pipeline)
-        for record in cursor:
+        cursor = await db[Collection.TOKENS_HOUR_DATA ].aggregate(pipeline)
+        async for record in cursor:
             token_address = record['_id']
             tokens[token_address]['period'][period_name] = {
                 'feesUSD': str(record['feesUSD'].to_decimal()),
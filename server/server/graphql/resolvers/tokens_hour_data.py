@@ -3,7 +3,7 @@ from decimal import Decimal
 from typing import List, Optional
 
 import strawberry
-from pymongo.database import Database
+from pymongo.asynchronous.database import AsyncDatabase
 from strawberry.types import Info
 
 from server.graphql.resolvers.helpers import (
@@ -61,7 +61,7 @@ async def get_tokens_hour_data(
     info: Info, first: Optional[int] = 100, skip: Optional[int] = 0, orderBy: Optional[str] = None, 
     orderByDirection: Optional[str] = 'asc', where: Optional[WhereFilterForToken] = None
 ) -> List[TokenHourData]:
-    db: Database = info.context['db']
+    db: AsyncDatabase = info.context['db']
     query = {}
 
     if where is not None:
@@ -70,4 +70,4 @@ async def get_tokens_hour_data(
     cursor = db[Collection.TOKENS_HOUR_DATA].find(query, skip=skip, limit=first)
     cursor = await add_order_by_constraint(cursor, orderBy, orderByDirection)
 
-    return [TokenHourData.from_mongo(d) for d in cursor]
+    return [TokenHourData.from_mongo(d) async for d in cursor]
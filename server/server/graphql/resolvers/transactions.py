@@ -3,13 +3,14 @@ from decimal import Decimal
 from typing import List, Optional
 
 import strawberry
-from pymongo.database import Database
+from pymongo.asynchronous.database import AsyncDatabase
 from strawberry.types import Info
 from strawberry.scalars import JSON
 
 from server.graphql.resolvers.helpers import add_order_by_constraint, convert_timestamp_to_datetime, WhereFilterForTransaction, filter_transactions, filter_pools_by_token_addresses
-from server.const import Collection
+from server.const import Collection, Transformer
 from server.graphql.resolvers.pools import Pool
+from server.transform.progress import get_up_to_watermark_query, get_watermark
 
 
 @strawberry.type
@@ -52,8 +53,9 @@ async def get_transactions(
     info: Info, first: Optional[int] = 100, skip: Optional[int] = 0, orderBy: Optional[str] = None, 
     orderByDirection: Optional[str] = 'asc', where: Optional[WhereFilterForTransaction] = None
 ) -> List[Transaction]:
-    db: Database = info.context['db']
-    query = {"processed": True}
+    db: AsyncDatabase = info.context['db']
+    watermark = await get_watermark(db, Transformer.EVENTS, Collection.POOLS_DATA)
+    query = await get_up_to_watermark_query(watermark)
 
     if where is not None:
         await filter_pools_by_token_addresses(where, query, db)
@@ -62,4 +64,4 @@ async def get_transactions(
     cursor = db[Collection.POOLS_DATA].find(query, skip=skip, limit=first)
     cursor = await add_order_by_constraint(cursor, orderBy, orderByDirection)
 
-    return [Transaction.from_mongo(d) for d in cursor]
+    return [Transaction.from_mongo(d) async for d in cursor]
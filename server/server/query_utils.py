@@ -1,12 +1,16 @@
-from pymongo.database import Database
+import asyncio
+from collections import OrderedDict
+
+from pymongo.asynchronous.database import AsyncDatabase
 from typing import List, Optional, Any
 
-from server.const import Collection, FACTORY_ADDRESS, ZERO_DECIMAL128
-from server.utils import amount_after_decimals, get_hour_id
+from server.const import Collection, FACTORY_ADDRESS, TOKEN_REGISTRY_SIZE, ZERO_DECIMAL, ZERO_DECIMAL128
+from server.rpc_client import get_rpc_client
+from server.transform.price_history import get_token_price_usd
+from server.utils import amount_after_decimals, decode_u256, get_hour_id
 
 from starknet_py.contract import ContractFunction
 from starknet_py.net.client_models import Call
-from starknet_py.net.full_node_client import FullNodeClient
 from starknet_py.cairo.felt import decode_shortstring
 
 from structlog import get_logger
@@ -18,68 +22,114 @@ async def filter_by_the_latest_value(query: dict):
     query['_cursor.to'] = None
 
 
-async def get_factory_record(db: Database) -> dict:
+async def create_factory_record() -> dict:
+    return {
+        'address': FACTORY_ADDRESS,
+        'txCount': 0,
+        'totalValueLockedETH': ZERO_DECIMAL128,
+        'totalValueLockedUSD': ZERO_DECIMAL128,
+        'totalVolumeETH': ZERO_DECIMAL128,
+        'totalVolumeUSD': ZERO_DECIMAL128,
+        'untrackedVolumeUSD': ZERO_DECIMAL128,
+        'totalFeesETH': ZERO_DECIMAL128,
+        'totalFeesUSD': ZERO_DECIMAL128,
+    }
+
+
+async def get_factory_record(db: AsyncDatabase) -> dict:
     factory_collection = db[Collection.FACTORIES]
-    existing_factory_record = factory_collection.find_one({'address': FACTORY_ADDRESS})
+    existing_factory_record = await factory_collection.find_one({'address': FACTORY_ADDRESS})
     if existing_factory_record is None:
-        FACTORY_RECORD = {
-            'address': FACTORY_ADDRESS,
-            'txCount': 0,
-            'totalValueLockedETH': ZERO_DECIMAL128,
-            'totalValueLockedUSD': ZERO_DECIMAL128,
-            'totalVolumeETH': ZERO_DECIMAL128,
-            'totalVolumeUSD': ZERO_DECIMAL128,
-            'untrackedVolumeUSD': ZERO_DECIMAL128,
-            'totalFeesETH': ZERO_DECIMAL128,
-            'totalFeesUSD': ZERO_DECIMAL128,
-        }
-        factory_collection.insert_one(FACTORY_RECORD)
+        FACTORY_RECORD = await create_factory_record()
+        await factory_collection.insert_one(FACTORY_RECORD)
         return FACTORY_RECORD
     return existing_factory_record
 
-async def get_pool_record(db: Database, pool_address: str) -> dict:
+async def get_pool_record(db: AsyncDatabase, pool_address: str) -> dict:
     # consider adding a cache mechanism
     pools_collection = db[Collection.POOLS]
     query = {'poolAddress': pool_address}
     await filter_by_the_latest_value(query)
-    return pools_collection.find_one(query)
+    return await pools_collection.find_one(query)
+
+TOKEN_METADATA_FIELDS = ('tokenAddress', 'symbol', 'name', 'decimals')
+
+
+async def register_token(db: AsyncDatabase, token_address: str, rpc_url: Optional[str] = None) -> dict:
+    symbol, name, decimals = await asyncio.gather(
+        get_token_symbol(token_address, rpc_url),
+        get_token_name(token_address, rpc_url),
+        get_token_decimals(token_address, rpc_url),
+    )
+    TOKEN_RECORD = {
+        'tokenAddress': token_address,
+        'symbol': symbol,
+        'name': name,
+        'decimals': decimals,
+        'derivedETH': ZERO_DECIMAL128,
+        'totalValueLocked': ZERO_DECIMAL128,
+        'totalValueLockedUSD': ZERO_DECIMAL128,
+    }
+    # another process may have registered the token while the metadata was fetched, its record is kept
+    await db[Collection.TOKENS].update_one({'tokenAddress': token_address}, {'$setOnInsert': TOKEN_RECORD},
+                                           upsert=True)
+    return TOKEN_RECORD
+
+
+# In-process LRU of the token metadata (address, symbol, name, decimals), which never changes once a token
+# is registered. Concurrent lookups of the same unseen token share a single registration
+class TokenRegistry:
+    _tokens = OrderedDict()
+    _lookups = dict()
+
+    @classmethod
+    async def get(cls, db: AsyncDatabase, token_address: str, rpc_url: Optional[str] = None) -> dict:
+        token = cls._tokens.get(token_address)
+        if token is not None:
+            cls._tokens.move_to_end(token_address)
+            return token
+        lookup = cls._lookups.get(token_address)
+        if lookup is None:
+            lookup = cls._lookups[token_address] = asyncio.ensure_future(cls._load(db, token_address, rpc_url))
+            lookup.add_done_callback(lambda _: cls._lookups.pop(token_address, None))
+        return await asyncio.shield(lookup)
 
-async def get_token_record(db: Database, token_address: str, rpc_url: Optional[str] = None) -> dict:
+    @classmethod
+    async def _load(cls, db: AsyncDatabase, token_address: str, rpc_url: Optional[str] = None) -> dict:
+        token = await db[Collection.TOKENS].find_one({'tokenAddress': token_address})
+        if token is None:
+            token = await register_token(db, token_address, rpc_url)
+        token = {field: token[field] for field in TOKEN_METADATA_FIELDS if field in token}
+        cls._tokens[token_address] = token
+        if len(cls._tokens) > TOKEN_REGISTRY_SIZE:
+            cls._tokens.popitem(last=False)
+        return token
+
+
+async def get_token_metadata(db: AsyncDatabase, token_address: str, rpc_url: Optional[str] = None) -> dict:
+    return await TokenRegistry.get(db, token_address, rpc_url)
+
+
+async def get_token_record(db: AsyncDatabase, token_address: str, rpc_url: Optional[str] = None) -> dict:
     # logger.info("Getting token", token_address=token_address, rpc_url=rpc_url)
     tokens_collection = db[Collection.TOKENS]
     query = {'tokenAddress': token_address}
-    existing_token_record = tokens_collection.find_one(query)
+    existing_token_record = await tokens_collection.find_one(query)
     if existing_token_record is None:
-        TOKEN_RECORD = {
-            'tokenAddress': token_address,
-            'symbol': await get_token_symbol(token_address, rpc_url),
-            'name': await get_token_name(token_address, rpc_url),
-            'decimals': await get_token_decimals(token_address, rpc_url),
-            'derivedETH': ZERO_DECIMAL128,
-            'totalValueLocked': ZERO_DECIMAL128,
-            'totalValueLockedUSD': ZERO_DECIMAL128,
-        }
-        existing_token_record = tokens_collection.find_one(query) ## Hacky way to counter parallel get_tokens
-        if existing_token_record is None:
-            tokens_collection.insert_one(TOKEN_RECORD)
-            return TOKEN_RECORD
+        await TokenRegistry.get(db, token_address, rpc_url)
+        existing_token_record = await tokens_collection.find_one(query)
     return existing_token_record
 
-async def get_token_hour_record(db: Database, token_address: str, hourId: int) -> dict:
-    # consider adding a cache mechanism
-    query = {'tokenAddress': token_address, 'hourId': hourId}
-    return db[Collection.TOKENS_HOUR_DATA].find_one(query)
-
-
 async def get_transaction_value_data(db, key) -> dict:
     pool_record = await get_pool_record(db, key[0])
-    token0_record = await get_token_record(db, pool_record['token0'])
-    token1_record = await get_token_record(db, pool_record['token1'])
+    token0_record, token1_record = await get_tokens_from_pool(db, pool_record)
     hour_id, _ = await get_hour_id(key[1])
-    token0_hour_data = await get_token_hour_record(db, token0_record['tokenAddress'], hour_id)
-    token1_hour_data = await get_token_hour_record(db, token1_record['tokenAddress'], hour_id)
-    price0USD = token0_hour_data['close'].to_decimal()
-    price1USD = token1_hour_data['close'].to_decimal()
+    price0USD, price1USD = await asyncio.gather(
+        get_token_price_usd(db, token0_record['tokenAddress'], hour_id),
+        get_token_price_usd(db, token1_record['tokenAddress'], hour_id),
+    )
+    price0USD = price0USD or ZERO_DECIMAL
+    price1USD = price1USD or ZERO_DECIMAL
     amount0 = await amount_after_decimals(abs(key[3]), token0_record['decimals'])
     amount1 = await amount_after_decimals(abs(key[4]), token1_record['decimals'])
     if (key[2] == 'Swap'):
@@ -92,28 +142,30 @@ async def get_transaction_value_data(db, key) -> dict:
     return {"price0USD": str(price0USD), "price1USD": str(price1USD), "txValueUSD": str(tx_value_usd)}
 
 
-async def get_tokens_from_pool(db: Database, existing_pool: dict, rpc_url: str) -> tuple[dict, dict]:
-    # consider adding a cache mechanism
+async def get_tokens_from_pool(db: AsyncDatabase, existing_pool: dict, rpc_url: Optional[str] = None
+                               ) -> tuple[dict, dict]:
     token0_address = existing_pool['token0']
     token1_address = existing_pool['token1']
     
-    token0 = await get_token_record(db, token0_address, rpc_url)
-    token1 = await get_token_record(db, token1_address, rpc_url)
+    token0, token1 = await asyncio.gather(
+        get_token_metadata(db, token0_address, rpc_url),
+        get_token_metadata(db, token1_address, rpc_url),
+    )
     return token0, token1
 
 
-async def get_all_token_pools(db: Database, token_address: str) -> list[dict]:
+async def get_all_token_pools(db: AsyncDatabase, token_address: str) -> list[dict]:
     query = {
         '$or': [
             {'token0': token_address},
             {'token1': token_address},
         ]
     }
-    return db[Collection.POOLS].find(query)
+    return await db[Collection.POOLS].find(query).to_list()
 
-async def get_position_record(db: Database, position_id: str) -> dict:
+async def get_position_record(db: AsyncDatabase, position_id: str) -> dict:
     position_collection = db[Collection.POSITIONS]
-    position_record = db[Collection.POSITIONS].find_one({'positionId': position_id})
+    position_record = await db[Collection.POSITIONS].find_one({'positionId': position_id})
     if position_record is None:
         position_record = {
             'positionId': position_id,
@@ -133,11 +185,11 @@ async def get_position_record(db: Database, position_id: str) -> dict:
             'lastUpdatedTimestamp': 0,
             'lpPoints': ZERO_DECIMAL128,
         }
-        position_collection.insert_one(position_record)
+        await position_collection.insert_one(position_record)
     return position_record
 
-async def get_teahouse_position_record(db: Database, record: dict, rpc_url: str) -> dict:
-    position_record = db[Collection.TEAHOUSE_VAULT].find_one({
+async def get_teahouse_position_record(db: AsyncDatabase, record: dict, rpc_url: str) -> dict:
+    position_record = await db[Collection.TEAHOUSE_VAULT].find_one({
         'poolAddress': record['poolAddress'],
     })
     if position_record is None:
@@ -165,7 +217,7 @@ async def get_teahouse_position_record(db: Database, record: dict, rpc_url: str)
             'lastUpdatedTimestamp': record['timestamp'],
             'lpPoints': ZERO_DECIMAL128,
         }
-        db[Collection.TEAHOUSE_VAULT].insert_one(position_record)
+        await db[Collection.TEAHOUSE_VAULT].insert_one(position_record)
     return position_record
 
 async def get_token_name(token_address: str, rpc_url: str) -> str:
@@ -198,8 +250,20 @@ async def get_token_decimals(token_address: str, rpc_url: str) -> int:
             return 0
     return result[0]
     
+async def get_pool_fee_growth_global(pool_address: str, rpc_url: str,
+                                     block_number: int | str = 'latest') -> tuple[int, int]:
+    fee_growth_global_0_X128, fee_growth_global_1_X128 = await asyncio.gather(
+        simple_call(pool_address, "get_fee_growth_global_0_X128", [], rpc_url, block_number),
+        simple_call(pool_address, "get_fee_growth_global_1_X128", [], rpc_url, block_number),
+    )
+    return await decode_u256(fee_growth_global_0_X128), await decode_u256(fee_growth_global_1_X128)
+
+async def get_pool_fee_protocol(pool_address: str, rpc_url: str, block_number: int | str = 'latest') -> int:
+    result = await simple_call(pool_address, "get_fee_protocol", [], rpc_url, block_number)
+    return result[0]
+
 async def simple_call(contract_address: str, method: str, calldata: List[int], rpc_url: str, block_number: int | str = 'latest'):
-    rpc = FullNodeClient(node_url=rpc_url)
+    rpc = await get_rpc_client(rpc_url)
     selector = ContractFunction.get_selector(method)
     call = Call(int(contract_address, 16), selector, calldata)
     try:
@@ -210,7 +274,7 @@ async def simple_call(contract_address: str, method: str, calldata: List[int], r
         raise
 
 async def simulate_tx(tx: Any, rpc_url: str, block_number: int):
-    rpc = FullNodeClient(node_url=rpc_url)
+    rpc = await get_rpc_client(rpc_url)
     simulated_txs = await rpc.simulate_transactions(
         transactions=[tx], skip_validate=True, skip_fee_charge=True, block_number=block_number)
     return simulated_txs[0].transaction_trace.execute_invocation.result
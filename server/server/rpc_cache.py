@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import json
+import pickle
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from server.const import RPC_CACHE_MAX_SIZE, RPC_CACHE_PATH
+
+from structlog import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# share of the max size to free on eviction, so the cache is not trimmed again on the next insert
+RPC_CACHE_EVICTION_RATIO = 0.1
+
+
+async def get_rpc_cache_key(rpc_url: str, method: str, block_number: int | str | None, *params: Any) -> str | None:
+    # only results pinned to a block number are immutable, tags like latest or pending move with the chain
+    if not isinstance(block_number, int) or isinstance(block_number, bool):
+        return None
+    key_data = json.dumps([rpc_url, method, block_number, *params], sort_keys=True, default=str)
+    return hashlib.sha256(key_data.encode()).hexdigest()
+
+
+# SQLite backed cache of RPC results keyed by the hash of (node, method, block, call parameters),
+# the least recently read entries are evicted once the stored results exceed the max size
+class RpcCache:
+    def __init__(self, path: str, max_size: int):
+        self.path = path
+        self.max_size = max_size
+        self._size = None
+        self._connection = None
+        # sqlite connections are bound to a thread, every query runs on the same worker thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rpc-cache')
+
+    def _get_connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS rpc_cache ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed_at REAL NOT NULL)'
+            )
+            self._connection.execute('CREATE INDEX IF NOT EXISTS rpc_cache_accessed_at ON rpc_cache (accessed_at)')
+            self._connection.commit()
+            self._size = self._get_stored_size()
+        return self._connection
+
+    def _get_stored_size(self) -> int:
+        return self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM rpc_cache').fetchone()[0]
+
+    def _get(self, key: str) -> bytes | None:
+        connection = self._get_connection()
+        row = connection.execute('SELECT value FROM rpc_cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        connection.execute('UPDATE rpc_cache SET accessed_at = ? WHERE key = ?', (time.time(), key))
+        connection.commit()
+        return row[0]
+
+    def _set(self, key: str, value: bytes):
+        connection = self._get_connection()
+        cursor = connection.execute(
+            'INSERT OR IGNORE INTO rpc_cache (key, value, size, accessed_at) VALUES (?, ?, ?, ?)',
+            (key, value, len(value), time.time()),
+        )
+        connection.commit()
+        self._size += len(value) * cursor.rowcount
+        if self._size > self.max_size:
+            self._evict()
+
+    def _evict(self):
+        # other processes may share the file, so the size is recounted before trimming
+        self._size = self._get_stored_size()
+        target_size = self.max_size * (1 - RPC_CACHE_EVICTION_RATIO)
+        if self._size <= target_size:
+            return
+        evicted_keys = []
+        rows = self._connection.execute('SELECT key, size FROM rpc_cache ORDER BY accessed_at')
+        for key, size in rows:
+            if self._size <= target_size:
+                break
+            evicted_keys.append((key,))
+            self._size -= size
+        rows.close()
+        self._connection.executemany('DELETE FROM rpc_cache WHERE key = ?', evicted_keys)
+        self._connection.commit()
+        logger.info(f'Evicted {len(evicted_keys)} RPC cache entries')
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+        self._connection = None
+
+    async def get(self, key: str) -> tuple[bool, Any]:
+        loop = asyncio.get_running_loop()
+        value = await loop.run_in_executor(self._executor, self._get, key)
+        if value is None:
+            return False, None
+        return True, pickle.loads(value)
+
+    async def set(self, key: str, result: Any):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._set, key, pickle.dumps(result))
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._close)
+        self._executor.shutdown()
+
+
+async def create_rpc_cache() -> RpcCache | None:
+    if not RPC_CACHE_PATH:
+        return None
+    return RpcCache(RPC_CACHE_PATH, RPC_CACHE_MAX_SIZE)
@@ -0,0 +1,168 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+
+import aiohttp
+
+from starknet_py.net.client_errors import ClientError
+from starknet_py.net.client_models import Call
+from starknet_py.net.full_node_client import FullNodeClient
+from starknet_py.net.http_client import ServerError
+
+from server.const import RPC_MAX_CONCURRENCY, RPC_MAX_RETRIES, RPC_REQUEST_TIMEOUT, RPC_RETRY_BACKOFF
+from server.rpc_cache import RpcCache, create_rpc_cache, get_rpc_cache_key
+
+from structlog import get_logger
+
+
+logger = get_logger(__name__)
+
+
+RETRYABLE_HTTP_STATUSES = {'408', '429', '500', '502', '503', '504'}
+
+
+async def is_retryable_rpc_error(exc: Exception) -> bool:
+    # contract errors (missing entry point, reverted simulation) are answers, not failures of the node
+    if isinstance(exc, ClientError):
+        return str(exc.code) in RETRYABLE_HTTP_STATUSES
+    return isinstance(exc, (aiohttp.ClientError, asyncio.TimeoutError, ServerError))
+
+
+class RpcMethodStats:
+    def __init__(self):
+        self.calls = 0
+        self.cache_hits = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    async def to_dict(self) -> dict:
+        return {
+            'calls': self.calls,
+            'cacheHits': self.cache_hits,
+            'errors': self.errors,
+            'retries': self.retries,
+            'avgLatency': round(self.total_latency / self.calls, 4) if self.calls else 0.0,
+            'maxLatency': round(self.max_latency, 4),
+        }
+
+
+# One client per node url for the whole process: the underlying HTTP session keeps its connections alive,
+# the semaphore bounds the requests in flight and failed requests are retried with an exponential backoff.
+# Results of requests pinned to a block number are stored in the rpc cache when one is configured
+class RpcClient:
+    def __init__(self, rpc_url: str, cache: RpcCache | None = None):
+        self.rpc_url = rpc_url
+        self.cache = cache
+        self._session = None
+        self._client = None
+        self._semaphore = asyncio.Semaphore(RPC_MAX_CONCURRENCY)
+        self._stats = dict()
+
+    async def get_client(self) -> FullNodeClient:
+        if self._client is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=RPC_MAX_CONCURRENCY),
+                timeout=aiohttp.ClientTimeout(total=RPC_REQUEST_TIMEOUT),
+            )
+            self._client = FullNodeClient(node_url=self.rpc_url, session=self._session)
+        return self._client
+
+    async def request(self, method: str, request_func: Callable[[FullNodeClient], Awaitable[Any]]) -> Any:
+        client = await self.get_client()
+        stats = self._stats.setdefault(method, RpcMethodStats())
+        attempt = 0
+        while True:
+            async with self._semaphore:
+                started = time.monotonic()
+                try:
+                    return await request_func(client)
+                except Exception as exc:
+                    error = exc
+                finally:
+                    latency = time.monotonic() - started
+                    stats.calls += 1
+                    stats.total_latency += latency
+                    stats.max_latency = max(stats.max_latency, latency)
+            stats.errors += 1
+            if attempt >= RPC_MAX_RETRIES or not await is_retryable_rpc_error(error):
+                raise error
+            attempt += 1
+            stats.retries += 1
+            logger.warning(f'RPC {method} failed, retrying in {RPC_RETRY_BACKOFF * 2 ** (attempt - 1)}s',
+                           attempt=attempt, error=str(error))
+            await asyncio.sleep(RPC_RETRY_BACKOFF * 2 ** (attempt - 1))
+
+    async def cached_request(self, method: str, cache_key: str | None,
+                             request_func: Callable[[FullNodeClient], Awaitable[Any]]) -> Any:
+        if self.cache is None or cache_key is None:
+            return await self.request(method, request_func)
+        is_cached, result = await self.cache.get(cache_key)
+        if is_cached:
+            self._stats.setdefault(method, RpcMethodStats()).cache_hits += 1
+            return result
+        result = await self.request(method, request_func)
+        await self.cache.set(cache_key, result)
+        return result
+
+    async def call_contract(self, call: Call, block_number: int | str = 'latest') -> list[int]:
+        cache_key = await get_rpc_cache_key(self.rpc_url, 'call', block_number, call.to_addr, call.selector,
+                                            call.calldata)
+        return await self.cached_request('call', cache_key, lambda client: client.call_contract(
+            call, block_number=block_number))
+
+    async def get_contract_nonce(self, contract_address: str, block_number: int | str = 'latest') -> int:
+        cache_key = await get_rpc_cache_key(self.rpc_url, 'getNonce', block_number, contract_address)
+        return await self.cached_request('getNonce', cache_key, lambda client: client.get_contract_nonce(
+            contract_address, block_number=block_number))
+
+    async def simulate_transactions(self, transactions: list, block_number: int | str = 'latest',
+                                    skip_validate: bool = True, skip_fee_charge: bool = True) -> list:
+        cache_key = await get_rpc_cache_key(self.rpc_url, 'simulateTransactions', block_number,
+                                            [vars(tx) for tx in transactions], skip_validate, skip_fee_charge)
+        return await self.cached_request('simulateTransactions', cache_key, lambda client: client.simulate_transactions(
+            transactions=transactions, skip_validate=skip_validate, skip_fee_charge=skip_fee_charge,
+            block_number=block_number))
+
+    async def get_stats(self) -> dict:
+        return {method: await stats.to_dict() for method, stats in self._stats.items()}
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+        self._session = None
+        self._client = None
+
+
+class RpcClients:
+    _clients = dict()
+    _cache = None
+
+    @classmethod
+    async def get(cls, rpc_url: str) -> RpcClient:
+        client = cls._clients.get(rpc_url)
+        if client is None:
+            if cls._cache is None:
+                cls._cache = await create_rpc_cache()
+            client = cls._clients[rpc_url] = RpcClient(rpc_url, cls._cache)
+        return client
+
+    @classmethod
+    async def log_stats(cls):
+        for rpc_client in cls._clients.values():
+            for method, stats in (await rpc_client.get_stats()).items():
+                logger.info(f'RPC {method} stats', **stats)
+
+    @classmethod
+    async def close(cls):
+        for rpc_client in cls._clients.values():
+            await rpc_client.close()
+        if cls._cache is not None:
+            await cls._cache.close()
+        cls._clients = dict()
+        cls._cache = None
+
+
+async def get_rpc_client(rpc_url: str) -> RpcClient:
+    return await RpcClients.get(rpc_url)
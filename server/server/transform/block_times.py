@@ -0,0 +1,100 @@
+import asyncio
+from array import array
+from bisect import bisect_left
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.asynchronous.database import AsyncDatabase
+
+from server.const import Collection, BLOCK_TIMES_INDEX_SIZE
+
+
+BLOCK_TIMES = dict()
+
+
+async def create_block_times_index(db: AsyncDatabase):
+    await db[Collection.BLOCKS].create_index([('timestamp', ASCENDING)])
+
+
+async def get_closest_block(candidates: list[tuple[int, int]], target_timestamp: float) -> int | None:
+    # candidates are (timestamp, block number) pairs around the target, the earlier block wins a tie
+    if not candidates:
+        return None
+    _, block_number = min(candidates, key=lambda candidate: (abs(candidate[0] - target_timestamp), candidate[0]))
+    return block_number
+
+
+async def find_closest_block(db: AsyncDatabase, target_timestamp: float) -> int | None:
+    # two indexed range queries, the last block at or before the target and the first one after it
+    projection = {'timestamp': 1, 'blockNumber': 1}
+    candidates = []
+    for condition, sort in (('$lte', DESCENDING), ('$gt', ASCENDING)):
+        block = await db[Collection.BLOCKS].find_one({'timestamp': {condition: target_timestamp}}, projection,
+                                                     sort=[('timestamp', sort)])
+        if block is not None:
+            candidates.append((block['timestamp'], int(block['blockNumber'])))
+    return await get_closest_block(candidates, target_timestamp)
+
+
+# Timestamps and numbers of the latest BLOCK_TIMES_INDEX_SIZE blocks kept in sorted arrays, loaded once and
+# extended with the blocks the sink inserted since, so the block closest to a timestamp is found with a bisect.
+# Timestamps before the oldest kept block are looked up in Mongo
+class BlockTimes:
+    def __init__(self, db: AsyncDatabase):
+        self.db = db
+        self._timestamps = array('q')
+        self._blocks = array('q')
+        self._lock = asyncio.Lock()
+
+    async def _load(self):
+        projection = {'timestamp': 1, 'blockNumber': 1}
+        async for block in self.db[Collection.BLOCKS].find({}, projection, sort=[('timestamp', DESCENDING)],
+                                                           limit=BLOCK_TIMES_INDEX_SIZE):
+            self._timestamps.append(block['timestamp'])
+            self._blocks.append(int(block['blockNumber']))
+        self._timestamps.reverse()
+        self._blocks.reverse()
+
+    async def _extend(self):
+        # blocks sharing the last timestamp are read again, one of them may have been inserted after the last read
+        last_timestamp = self._timestamps[-1]
+        index = bisect_left(self._timestamps, last_timestamp)
+        del self._timestamps[index:]
+        del self._blocks[index:]
+        projection = {'timestamp': 1, 'blockNumber': 1}
+        async for block in self.db[Collection.BLOCKS].find({'timestamp': {'$gte': last_timestamp}}, projection,
+                                                           sort=[('timestamp', ASCENDING)]):
+            self._timestamps.append(block['timestamp'])
+            self._blocks.append(int(block['blockNumber']))
+        if len(self._timestamps) > 2 * BLOCK_TIMES_INDEX_SIZE:
+            del self._timestamps[:-BLOCK_TIMES_INDEX_SIZE]
+            del self._blocks[:-BLOCK_TIMES_INDEX_SIZE]
+
+    async def get_closest_block(self, target_timestamp: float) -> int | None:
+        async with self._lock:
+            if not self._timestamps:
+                await self._load()
+            elif target_timestamp >= self._timestamps[-1]:
+                await self._extend()
+        if not self._timestamps or target_timestamp < self._timestamps[0]:
+            return await find_closest_block(self.db, target_timestamp)
+        index = bisect_left(self._timestamps, target_timestamp)
+        candidates = [
+            (self._timestamps[candidate_index], self._blocks[candidate_index])
+            for candidate_index in (index - 1, index)
+            if 0 <= candidate_index < len(self._timestamps)
+        ]
+        return await get_closest_block(candidates, target_timestamp)
+
+
+async def get_block_times(db: AsyncDatabase) -> BlockTimes:
+    key = (db.client, db.name)
+    if key not in BLOCK_TIMES:
+        BLOCK_TIMES[key] = BlockTimes(db)
+    return BLOCK_TIMES[key]
+
+
+async def get_closest_block_from_timestamp(db: AsyncDatabase, target_timestamp: float) -> int | None:
+    if BLOCK_TIMES_INDEX_SIZE <= 0:
+        return await find_closest_block(db, target_timestamp)
+    block_times = await get_block_times(db)
+    return await block_times.get_closest_block(target_timestamp)
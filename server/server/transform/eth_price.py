@@ -0,0 +1,46 @@
+from bisect import bisect_left, bisect_right
+from decimal import Decimal
+
+from server.const import ETH, ETH_PRICE_HISTORY_SIZE
+
+
+DEFAULT_ETH_PRICE = Decimal(2500)
+
+
+async def get_pool_eth_price(pool: dict | None) -> Decimal:
+    if pool and 'token0Price' in pool.keys() and pool['token0Price'] != Decimal(0) and 'token1Price' in pool.keys() and pool['token1Price'] != Decimal(0):
+        if (pool['token0'] == ETH):
+            return pool['token1Price']
+        else:
+            return pool['token0Price']
+    else:
+        return DEFAULT_ETH_PRICE
+
+
+# ETH price oracle fed by the Initialize and Swap events of the ETH/USDC pool: the price is recorded
+# for every block it changed at, so it can be asked as of any block without reading the pool again
+class EthPrice:
+    def __init__(self):
+        self._blocks = []
+        self._prices = []
+
+    async def get(self, block: int | None = None) -> Decimal:
+        if not self._prices:
+            return DEFAULT_ETH_PRICE
+        if block is None:
+            return self._prices[-1]
+        # blocks before the oldest recorded one get its price, the oracle starts from the transformer watermark
+        index = max(bisect_right(self._blocks, block) - 1, 0)
+        return self._prices[index]
+
+    async def update(self, pool: dict | None, block: int):
+        eth_price = await get_pool_eth_price(pool)
+        # the last event of a block sets its price, a reprocessed block drops the prices recorded after it
+        index = bisect_left(self._blocks, block)
+        del self._blocks[index:]
+        del self._prices[index:]
+        self._blocks.append(block)
+        self._prices.append(eth_price)
+        if len(self._blocks) > 2 * ETH_PRICE_HISTORY_SIZE:
+            del self._blocks[:-ETH_PRICE_HISTORY_SIZE]
+            del self._prices[:-ETH_PRICE_HISTORY_SIZE]
@@ -1,15 +1,18 @@
+import asyncio
 import time
-from decimal import Decimal
-
-from bson import Decimal128
-from pymongo import MongoClient, UpdateOne
-from pymongo.database import Database
+from functools import partial
 
-from starknet_py.contract import Contract
-from starknet_py.net.full_node_client import FullNodeClient
+from decimal import Decimal
+from pymongo import AsyncMongoClient
+from pymongo.asynchronous.client_session import AsyncClientSession
+from pymongo.asynchronous.database import AsyncDatabase
 
-from server.const import Collection, Event, FACTORY_ADDRESS, ZERO_DECIMAL128, TIME_INTERVAL
+from server.const import (
+    Collection, Event, Transformer, ZERO_DECIMAL, TIME_INTERVAL, EVENTS_BATCH_SIZE, EVENTS_PIPELINE_SIZE,
+    MONGO_MAX_POOL_SIZE, FEE_GROWTH_RECONCILE_INTERVAL,
+)
 from server.transform.interval_updates import (
+    IntervalUpdates,
     update_factory_day_data,
     update_factory_hour_data,
     update_pool_day_data,
@@ -17,12 +20,33 @@ from server.transform.interval_updates import (
     update_token_day_data,
     update_token_hour_data
 )
-from server.transform.pricing import EthPrice, find_eth_per_token, sqrt_price_x96_to_token_prices, get_tracked_amount_usd
-from server.query_utils import get_factory_record, get_pool_record, get_token_record, get_tokens_from_pool, filter_by_the_latest_value
-from server.utils import amount_after_decimals, convert_num_to_decimal128
-from server.transform.leaderboard_transformer import insert_volume_leaderboard_snapshot
+from server.transform.pricing import find_eth_per_token, sqrt_price_x96_to_token_prices, get_tracked_amount_usd
+from server.transform.fee_engine import create_fee_state_indexes, get_fee_state, get_position_fee_state
+from server.transform.fee_growth import get_swap_fee_growth, reconcile_pools_fee_growth
+from server.transform.follow import follow_changes
+from server.transform.pipeline import BatchWriter, bulk_write_operations, prefetch, run_in_transaction
+from server.transform.progress import (
+    WATERMARK_SORT,
+    create_watermark_index,
+    get_after_watermark_query,
+    get_record_watermark,
+    get_watermark,
+    is_legacy_watermark,
+    save_watermark,
+)
+from server.transform.rebuild import (
+    RebuildStateStore,
+    create_rebuild_collections,
+    insert_interval_buckets,
+    swap_rebuild_collections,
+    yield_rebuild_records,
+)
+from server.transform.state_store import StateStore
+from server.utils import amount_after_decimals
+from server.transform.ticks import check_ticks_complete, create_ticks_index, save_ticks_complete
+from server.rpc_client import RpcClients
+from server.transform.leaderboard_transformer import get_volume_leaderboard_snapshot_record
 
-from pymongo import MongoClient, UpdateOne
 from structlog import get_logger
 
 
@@ -35,56 +59,26 @@ class EventTracker:
     swap_count = 0
     burn_count = 0
     pool_addresses_to_update_fee_growth = set()
+    fee_growth_reconciled_at = None
 
 
-async def update_tokens_records(db: Database, token0_id: str, token1_id: str, token0_update_data: dict, token1_update_data: dict):
-    tokens_update_operations = [
-        UpdateOne({"_id": token0_id}, token0_update_data),
-        UpdateOne({"_id": token1_id}, token1_update_data),
-    ]
-    db[Collection.TOKENS].bulk_write(tokens_update_operations)
-
-
-async def update_pool_record(db: Database, pool_id: str, pool_update_data: dict):
-    pool_query = {"_id": pool_id}
-    await filter_by_the_latest_value(pool_query)
-    db[Collection.POOLS].update_one(pool_query, pool_update_data)
-
-
-async def update_factory_record(db: Database, factory_update_data: dict):
-    factory_collection = db[Collection.FACTORIES]
-    factory_collection.update_one({'address': FACTORY_ADDRESS}, factory_update_data)
-
-
-async def yield_pool_data_records(db: Database) -> dict:
+async def yield_pool_data_records(db: AsyncDatabase, watermark: dict | None) -> dict:
     # TODO: get records from a specific pool
-    last_block_record = db[Collection.POOLS_DATA].find(
-        {'processed': True}, { 'block': 1, '_id': 0}
-        ).sort({'block': -1}).limit(1)
-    try:
-        last_block = next(last_block_record)['block']
-    except StopIteration:
-        last_block = 0
-
-    records_query = {
-        'block': { '$gt': last_block},
-        '$or': [
-            {'processed': {'$exists': False}},
-            {'processed': False}
-        ]}
-    for record in db[Collection.POOLS_DATA].find(records_query).sort('timestamp', 1):
+    records_query = await get_after_watermark_query(watermark)
+    async for record in db[Collection.POOLS_DATA].find(records_query).sort(WATERMARK_SORT):
         yield record
 
 async def handle_initialize(*args, **kwargs):
     db = kwargs['db']
+    store = kwargs['store']
+    interval_updates = kwargs['interval_updates']
     record = kwargs['record']
-    rpc_url = kwargs['rpc_url']
 
     del record['event']
     logger.info("handle Initialize", **record)
 
-    pool = await get_pool_record(db, record['poolAddress'])
-    token0, token1 = await get_tokens_from_pool(db, pool, rpc_url)
+    pool = await store.get_pool(record['poolAddress'])
+    token0, token1 = await store.get_tokens_from_pool(pool)
 
     prices = await sqrt_price_x96_to_token_prices(record['sqrtPriceX96'], token0['decimals'], token1['decimals'])
 
@@ -92,234 +86,238 @@ async def handle_initialize(*args, **kwargs):
         '$set': {
             'sqrtPriceX96': record['sqrtPriceX96'],
             'tick': record['tick'],
-            'totalValueLockedETH': ZERO_DECIMAL128,
-            'totalValueLockedUSD': ZERO_DECIMAL128,
-            'totalValueLockedToken0': ZERO_DECIMAL128,
-            'totalValueLockedToken1': ZERO_DECIMAL128,
-            'liquidity': ZERO_DECIMAL128,
-            'token0Price': Decimal128(prices[0]),
-            'token1Price': Decimal128(prices[1]),
+            'totalValueLockedETH': ZERO_DECIMAL,
+            'totalValueLockedUSD': ZERO_DECIMAL,
+            'totalValueLockedToken0': ZERO_DECIMAL,
+            'totalValueLockedToken1': ZERO_DECIMAL,
+            'liquidity': ZERO_DECIMAL,
+            'token0Price': prices[0],
+            'token1Price': prices[1],
             'feeGrowthGlobal0X128': '0x0',
             'feeGrowthGlobal1X128': '0x0',
             'txCount': 0,
         }
     }
 
-    await update_pool_record(db, pool['_id'], pool_update_data)
-
-    await EthPrice.set(db)
+    await store.update_pool(pool, pool_update_data, record['block'])
+    await save_fee_state(store, record, await get_fee_state(pool, pool['tick'], []))
 
-    pool = await get_pool_record(db, record['poolAddress'])
-
-    await update_pool_day_data(db, pool, record['timestamp'])
-    await update_pool_hour_data(db, pool, record['timestamp'])
+    await update_pool_day_data(db, pool, record['timestamp'], interval_updates=interval_updates)
+    await update_pool_hour_data(db, pool, record['timestamp'], interval_updates=interval_updates)
 
+    token0_derivedETH, token1_derivedETH = await asyncio.gather(
+        find_eth_per_token(store, token0['tokenAddress'], record['block']),
+        find_eth_per_token(store, token1['tokenAddress'], record['block']),
+    )
     token0_update_data = {
         '$set': {
-            'derivedETH': Decimal128(await find_eth_per_token(db, token0['tokenAddress'], rpc_url)),
+            'derivedETH': token0_derivedETH,
         }
     }
     token1_update_data = {
         '$set': {
-            'derivedETH': Decimal128(await find_eth_per_token(db, token1['tokenAddress'], rpc_url)),
+            'derivedETH': token1_derivedETH,
         }
     }
-    await update_tokens_records(db, token0['_id'], token1['_id'], token0_update_data, token1_update_data)
+    await store.update_tokens(token0, token1, token0_update_data, token1_update_data)
 
     EventTracker.initialize_count += 1
 
 
+async def save_fee_state(store: StateStore, record: dict, fee_state: dict):
+    await store.update_record(Collection.POOLS_DATA, {'_id': record['_id']}, {'$set': {'feeState': fee_state}})
+
+
+async def update_position_ticks(store: StateStore, pool: dict, record: dict, liquidity_delta: Decimal):
+    pool_ticks = await store.get_pool_ticks(pool['poolAddress'])
+    tick_records = [
+        await pool_ticks.update(pool, record['tickLower'], liquidity_delta, upper=False),
+        await pool_ticks.update(pool, record['tickUpper'], liquidity_delta, upper=True),
+    ]
+    await store.update_ticks(tick_records)
+    await save_fee_state(store, record, await get_position_fee_state(pool, tick_records))
+
+
 async def handle_mint(*args, **kwargs):
     db = kwargs['db']
+    store = kwargs['store']
+    interval_updates = kwargs['interval_updates']
     record = kwargs['record']
-    rpc_url = kwargs['rpc_url']
-    factory = await get_factory_record(db)
 
     del record['event']
     logger.info("handle Mint", **record)
 
-    pool = await get_pool_record(db, record['poolAddress'])
-    token0, token1 = await get_tokens_from_pool(db, pool, rpc_url)
+    factory, pool = await asyncio.gather(store.get_factory(), store.get_pool(record['poolAddress']))
+    token0, token1 = await store.get_tokens_from_pool(pool)
     amount0 = await amount_after_decimals(record['amount0'], token0['decimals'])
     amount1 = await amount_after_decimals(record['amount1'], token1['decimals'])
 
-    token0_derivedETH = token0['derivedETH'].to_decimal()
-    token1_derivedETH = token1['derivedETH'].to_decimal()
+    token0_derivedETH = token0['derivedETH']
+    token1_derivedETH = token1['derivedETH']
 
-    eth_price = await EthPrice.get()
+    eth_price = await store.eth_price.get(record['block'])
     token0_update_data = dict()
     token0_update_data['$inc'] = dict()
     token0_update_data['$set'] = dict()
-    token0_update_data['$set']['totalValueLockedUSD'] = Decimal128((token0['totalValueLocked'].to_decimal() + amount0) 
-                                                                   * token0_derivedETH * eth_price)
-    token0_update_data['$inc']['totalValueLocked'] = Decimal128(amount0)
+    token0_update_data['$set']['totalValueLockedUSD'] = ((token0['totalValueLocked'] + amount0)
+                                                         * token0_derivedETH * eth_price)
+    token0_update_data['$inc']['totalValueLocked'] = amount0
     token0_update_data['$inc']['txCount'] = 1
 
     token1_update_data = dict()
     token1_update_data['$inc'] = dict()
     token1_update_data['$set'] = dict()
-    token1_update_data['$set']['totalValueLockedUSD'] = Decimal128((token1['totalValueLocked'].to_decimal() + amount1) 
-                                                                   * token1_derivedETH * eth_price)
-    token1_update_data['$inc']['totalValueLocked'] = Decimal128(amount1)
+    token1_update_data['$set']['totalValueLockedUSD'] = ((token1['totalValueLocked'] + amount1)
+                                                         * token1_derivedETH * eth_price)
+    token1_update_data['$inc']['totalValueLocked'] = amount1
     token1_update_data['$inc']['txCount'] = 1
 
-    pool_totalValueLockedETH = pool['totalValueLockedETH'].to_decimal()
-    factory_totalValueLockedETH = factory['totalValueLockedETH'].to_decimal() - pool_totalValueLockedETH
+    pool_totalValueLockedETH = pool['totalValueLockedETH']
+    factory_totalValueLockedETH = factory['totalValueLockedETH'] - pool_totalValueLockedETH
 
     pool_liquidity = Decimal(0)
     pool_tick = pool.get('tick')
     if pool_tick is not None and record['tickLower'] <= pool_tick < record['tickUpper']:
         pool_liquidity = Decimal(record['amount'])
 
-    pool_totalValueLockedToken0 = pool['totalValueLockedToken0'].to_decimal()
-    pool_totalValueLockedToken1 = pool['totalValueLockedToken1'].to_decimal()
+    pool_totalValueLockedToken0 = pool['totalValueLockedToken0']
+    pool_totalValueLockedToken1 = pool['totalValueLockedToken1']
     pool_totalValueLockedETH = ((pool_totalValueLockedToken0 + amount0) * token0_derivedETH) + (
         (pool_totalValueLockedToken1 + amount1) * token1_derivedETH)
     
     pool_update_data = dict()
     pool_update_data['$inc'] = dict()
     pool_update_data['$set'] = dict()
-    pool_update_data['$set']['totalValueLockedETH'] = Decimal128(pool_totalValueLockedETH)
-    pool_update_data['$set']['totalValueLockedUSD'] = Decimal128(pool_totalValueLockedETH * eth_price)
-    pool_update_data["$inc"]["liquidity"] = Decimal128(pool_liquidity)
-    pool_update_data["$inc"]['totalValueLockedToken0'] = Decimal128(amount0)
-    pool_update_data["$inc"]['totalValueLockedToken1'] = Decimal128(amount1)
+    pool_update_data['$set']['totalValueLockedETH'] = pool_totalValueLockedETH
+    pool_update_data['$set']['totalValueLockedUSD'] = pool_totalValueLockedETH * eth_price
+    pool_update_data["$inc"]["liquidity"] = pool_liquidity
+    pool_update_data["$inc"]['totalValueLockedToken0'] = amount0
+    pool_update_data["$inc"]['totalValueLockedToken1'] = amount1
     pool_update_data['$inc']['txCount'] = 1
 
     factory_update_data = dict()
     factory_update_data['$inc'] = dict()
     factory_update_data['$set'] = dict()
-    factory_update_data['$set']['totalValueLockedUSD'] = Decimal128((factory_totalValueLockedETH + pool_totalValueLockedETH) 
-                                                                    * eth_price)
-    factory_update_data['$set']['totalValueLockedETH'] = Decimal128(factory_totalValueLockedETH + pool_totalValueLockedETH)
+    factory_update_data['$set']['totalValueLockedUSD'] = ((factory_totalValueLockedETH + pool_totalValueLockedETH)
+                                                          * eth_price)
+    factory_update_data['$set']['totalValueLockedETH'] = factory_totalValueLockedETH + pool_totalValueLockedETH
     factory_update_data['$inc']['txCount'] = 1
 
-    await update_tokens_records(db, token0['_id'], token1['_id'], token0_update_data, token1_update_data)
-    await update_pool_record(db, pool['_id'], pool_update_data)
-    await update_factory_record(db, factory_update_data)
+    await update_position_ticks(store, pool, record, Decimal(record['amount']))
+    await store.update_tokens(token0, token1, token0_update_data, token1_update_data)
+    await store.update_pool(pool, pool_update_data)
+    await store.update_factory(factory_update_data)
 
-    factory = await get_factory_record(db)
-    pool = await get_pool_record(db, record['poolAddress'])
-    token0 = await get_token_record(db, token0['tokenAddress'], rpc_url)
-    token1 = await get_token_record(db, token1['tokenAddress'], rpc_url)
-    
-    await update_factory_day_data(db, factory, record['timestamp'])
-    await update_factory_hour_data(db, factory, record['timestamp'])
-    await update_pool_day_data(db, pool, record['timestamp'])
-    await update_pool_hour_data(db, pool, record['timestamp'])
-    await update_token_day_data(db, token0, record['timestamp'])
-    await update_token_hour_data(db, token0, record['timestamp'])
-    await update_token_day_data(db, token1, record['timestamp'])
-    await update_token_hour_data(db, token1, record['timestamp'])
+    await update_factory_day_data(db, factory, record['timestamp'], interval_updates=interval_updates)
+    await update_factory_hour_data(db, factory, record['timestamp'], interval_updates=interval_updates)
+    await update_pool_day_data(db, pool, record['timestamp'], interval_updates=interval_updates)
+    await update_pool_hour_data(db, pool, record['timestamp'], interval_updates=interval_updates)
+    await update_token_day_data(db, token0, record['timestamp'], eth_price, interval_updates=interval_updates)
+    await update_token_hour_data(db, token0, record['timestamp'], eth_price, interval_updates=interval_updates)
+    await update_token_day_data(db, token1, record['timestamp'], eth_price, interval_updates=interval_updates)
+    await update_token_hour_data(db, token1, record['timestamp'], eth_price, interval_updates=interval_updates)
 
     EventTracker.mint_count += 1
 
 
 async def handle_burn(*args, **kwargs):
     db = kwargs['db']
+    store = kwargs['store']
+    interval_updates = kwargs['interval_updates']
     record = kwargs['record']
-    rpc_url = kwargs['rpc_url']
-    factory = await get_factory_record(db)
 
     del record['event']
     logger.info("handle Burn", **record)
 
-    pool = await get_pool_record(db, record['poolAddress'])
-    token0, token1 = await get_tokens_from_pool(db, pool, rpc_url)
+    factory, pool = await asyncio.gather(store.get_factory(), store.get_pool(record['poolAddress']))
+    token0, token1 = await store.get_tokens_from_pool(pool)
     amount0 = await amount_after_decimals(record['amount0'], token0['decimals'])
     amount1 = await amount_after_decimals(record['amount1'], token1['decimals'])
 
-    token0_derivedETH = token0['derivedETH'].to_decimal()
-    token1_derivedETH = token1['derivedETH'].to_decimal()
+    token0_derivedETH = token0['derivedETH']
+    token1_derivedETH = token1['derivedETH']
 
-    eth_price = await EthPrice.get()
+    eth_price = await store.eth_price.get(record['block'])
     
     token0_update_data = dict()
     token0_update_data['$inc'] = dict()
     token0_update_data['$set'] = dict()
-    token0_update_data['$set']['totalValueLockedUSD'] = Decimal128((token0['totalValueLocked'].to_decimal() - amount0) 
-                                                                   * token0_derivedETH * eth_price)
-    token0_update_data['$inc']['totalValueLocked'] = Decimal128(-amount0)
+    token0_update_data['$set']['totalValueLockedUSD'] = ((token0['totalValueLocked'] - amount0)
+                                                         * token0_derivedETH * eth_price)
+    token0_update_data['$inc']['totalValueLocked'] = -amount0
     token0_update_data['$inc']['txCount'] = 1
 
     token1_update_data = dict()
     token1_update_data['$inc'] = dict()
     token1_update_data['$set'] = dict()
-    token1_update_data['$set']['totalValueLockedUSD'] = Decimal128((token1['totalValueLocked'].to_decimal() - amount1) 
-                                                                   * token1_derivedETH * eth_price)
-    token1_update_data['$inc']['totalValueLocked'] = Decimal128(-amount1)
+    token1_update_data['$set']['totalValueLockedUSD'] = ((token1['totalValueLocked'] - amount1)
+                                                         * token1_derivedETH * eth_price)
+    token1_update_data['$inc']['totalValueLocked'] = -amount1
     token1_update_data['$inc']['txCount'] = 1
 
-    pool_totalValueLockedETH = pool['totalValueLockedETH'].to_decimal()
-    factory_totalValueLockedETH = factory['totalValueLockedETH'].to_decimal() - pool_totalValueLockedETH
+    pool_totalValueLockedETH = pool['totalValueLockedETH']
+    factory_totalValueLockedETH = factory['totalValueLockedETH'] - pool_totalValueLockedETH
 
     pool_liquidity = Decimal(0)
     pool_tick = pool.get('tick')
     if pool_tick is not None and record['tickLower'] <= pool_tick < record['tickUpper']:
-        pool_liquidity = Decimal(-record['amount'])
+        pool_liquidity = -Decimal(record['amount'])
 
-    pool_totalValueLockedToken0 = pool['totalValueLockedToken0'].to_decimal()
-    pool_totalValueLockedToken1 = pool['totalValueLockedToken1'].to_decimal()
+    pool_totalValueLockedToken0 = pool['totalValueLockedToken0']
+    pool_totalValueLockedToken1 = pool['totalValueLockedToken1']
     pool_totalValueLockedETH = ((pool_totalValueLockedToken0 - amount0) * token0_derivedETH) + (
         (pool_totalValueLockedToken1 - amount1) * token1_derivedETH)
 
     pool_update_data = dict()
     pool_update_data['$inc'] = dict()
     pool_update_data['$set'] = dict()
-    pool_update_data['$set']['totalValueLockedETH'] = Decimal128(pool_totalValueLockedETH)
-    pool_update_data['$set']['totalValueLockedUSD'] = Decimal128(pool_totalValueLockedETH * eth_price)
-    pool_update_data["$inc"]["liquidity"] = Decimal128(pool_liquidity)
-    pool_update_data["$inc"]['totalValueLockedToken0'] = Decimal128(-amount0)
-    pool_update_data["$inc"]['totalValueLockedToken1'] = Decimal128(-amount1)
+    pool_update_data['$set']['totalValueLockedETH'] = pool_totalValueLockedETH
+    pool_update_data['$set']['totalValueLockedUSD'] = pool_totalValueLockedETH * eth_price
+    pool_update_data["$inc"]["liquidity"] = pool_liquidity
+    pool_update_data["$inc"]['totalValueLockedToken0'] = -amount0
+    pool_update_data["$inc"]['totalValueLockedToken1'] = -amount1
     pool_update_data['$inc']['txCount'] = 1
 
     factory_update_data = dict()
     factory_update_data['$inc'] = dict()
     factory_update_data['$set'] = dict()
-    factory_update_data['$set']['totalValueLockedUSD'] = Decimal128((factory_totalValueLockedETH + pool_totalValueLockedETH) 
-                                                                    * eth_price)
-    factory_update_data['$set']['totalValueLockedETH'] = Decimal128(factory_totalValueLockedETH + pool_totalValueLockedETH)
+    factory_update_data['$set']['totalValueLockedUSD'] = ((factory_totalValueLockedETH + pool_totalValueLockedETH)
+                                                          * eth_price)
+    factory_update_data['$set']['totalValueLockedETH'] = factory_totalValueLockedETH + pool_totalValueLockedETH
     factory_update_data['$inc']['txCount'] = 1
 
-    await update_tokens_records(db, token0['_id'], token1['_id'], token0_update_data, token1_update_data)
-    await update_pool_record(db, pool['_id'], pool_update_data)
-    await update_factory_record(db, factory_update_data)
+    await update_position_ticks(store, pool, record, -Decimal(record['amount']))
+    await store.update_tokens(token0, token1, token0_update_data, token1_update_data)
+    await store.update_pool(pool, pool_update_data)
+    await store.update_factory(factory_update_data)
 
-    factory = await get_factory_record(db)
-    pool = await get_pool_record(db, record['poolAddress'])
-    token0 = await get_token_record(db, token0['tokenAddress'], rpc_url)
-    token1 = await get_token_record(db, token1['tokenAddress'], rpc_url)
-    
-    await update_factory_day_data(db, factory, record['timestamp'])
-    await update_factory_hour_data(db, factory, record['timestamp'])
-    await update_pool_day_data(db, pool, record['timestamp'])
-    await update_pool_hour_data(db, pool, record['timestamp'])
-    await update_token_hour_data(db, token0, record['timestamp'])
-    await update_token_day_data(db, token1, record['timestamp'])
-    await update_token_hour_data(db, token1, record['timestamp'])
+    await update_factory_day_data(db, factory, record['timestamp'], interval_updates=interval_updates)
+    await update_factory_hour_data(db, factory, record['timestamp'], interval_updates=interval_updates)
+    await update_pool_day_data(db, pool, record['timestamp'], interval_updates=interval_updates)
+    await update_pool_hour_data(db, pool, record['timestamp'], interval_updates=interval_updates)
+    await update_token_hour_data(db, token0, record['timestamp'], eth_price, interval_updates=interval_updates)
+    await update_token_day_data(db, token1, record['timestamp'], eth_price, interval_updates=interval_updates)
+    await update_token_hour_data(db, token1, record['timestamp'], eth_price, interval_updates=interval_updates)
 
     EventTracker.burn_count += 1
 
 
 async def handle_swap(*args, **kwargs):
     db = kwargs['db']
+    store = kwargs['store']
+    interval_updates = kwargs['interval_updates']
     record = kwargs['record']
-    factory = await get_factory_record(db)
-    rpc_url = kwargs['rpc_url']
 
     del record['event']
     logger.info("handle Swap", **record)
 
-    pool = await get_pool_record(db, record['poolAddress'])
-    token0, token1 = await get_tokens_from_pool(db, pool, rpc_url)
+    factory, pool = await asyncio.gather(store.get_factory(), store.get_pool(record['poolAddress']))
+    token0, token1 = await store.get_tokens_from_pool(pool)
     amount0 = await amount_after_decimals(record['amount0'], token0['decimals'])
     amount1 = await amount_after_decimals(record['amount1'], token1['decimals'])
 
-    # TODO
-    old_tick = pool.get('tick')
-
-    token0_derivedETH = token0['derivedETH'].to_decimal()
-    token1_derivedETH = token1['derivedETH'].to_decimal()
+    token0_derivedETH = token0['derivedETH']
+    token1_derivedETH = token1['derivedETH']
 
     amount0_abs = abs(amount0)
     amount1_abs = abs(amount1)
@@ -327,11 +325,11 @@ async def handle_swap(*args, **kwargs):
     amount0_ETH = amount0_abs * token0_derivedETH
     amount1_ETH = amount1_abs * token1_derivedETH
 
-    eth_price = await EthPrice.get()
+    eth_price = await store.eth_price.get(record['block'])
     amount0_USD = amount0_ETH * eth_price
     amount1_USD = amount1_ETH * eth_price
 
-    amount_total_USD_tracked = await get_tracked_amount_usd(amount0_abs, token0['tokenAddress'], token0_derivedETH, amount1_abs, token1['tokenAddress'], token1_derivedETH) / 2
+    amount_total_USD_tracked = await get_tracked_amount_usd(amount0_abs, token0['tokenAddress'], token0_derivedETH, amount1_abs, token1['tokenAddress'], token1_derivedETH, eth_price) / 2
     amount_total_ETH_tracked = amount_total_USD_tracked / eth_price
 
     amount_total_USD_untracked = (amount0_USD + amount1_USD) / 2
@@ -343,116 +341,117 @@ async def handle_swap(*args, **kwargs):
     factory_update_data['$inc'] = dict()
     factory_update_data['$set'] = dict()
     factory_update_data['$inc']['txCount'] = 1
-    factory_update_data['$inc']['totalVolumeETH'] = Decimal128(amount_total_ETH_tracked)
-    factory_update_data['$inc']['totalVolumeUSD'] = Decimal128(amount_total_USD_tracked)
-    factory_update_data['$inc']['untrackedVolumeUSD'] = Decimal128(amount_total_USD_untracked)
-    factory_update_data['$inc']['totalFeesETH'] = Decimal128(fees_ETH)
-    factory_update_data['$inc']['totalFeesUSD'] = Decimal128(fees_USD)
+    factory_update_data['$inc']['totalVolumeETH'] = amount_total_ETH_tracked
+    factory_update_data['$inc']['totalVolumeUSD'] = amount_total_USD_tracked
+    factory_update_data['$inc']['untrackedVolumeUSD'] = amount_total_USD_untracked
+    factory_update_data['$inc']['totalFeesETH'] = fees_ETH
+    factory_update_data['$inc']['totalFeesUSD'] = fees_USD
 
     pool_update_data = dict()
     pool_update_data['$inc'] = dict()
     pool_update_data['$set'] = dict()
-    pool_update_data['$inc']['volumeToken0'] = Decimal128(amount0_abs)
-    pool_update_data['$inc']['volumeToken1'] = Decimal128(amount1_abs)
-    pool_update_data['$inc']['volumeUSD'] = Decimal128(amount_total_USD_tracked)
-    pool_update_data['$inc']['untrackedVolumeUSD'] = Decimal128(amount_total_USD_untracked)
-    pool_update_data['$inc']['feesUSD'] = Decimal128(fees_USD)
+    pool_update_data['$inc']['volumeToken0'] = amount0_abs
+    pool_update_data['$inc']['volumeToken1'] = amount1_abs
+    pool_update_data['$inc']['volumeUSD'] = amount_total_USD_tracked
+    pool_update_data['$inc']['untrackedVolumeUSD'] = amount_total_USD_untracked
+    pool_update_data['$inc']['feesUSD'] = fees_USD
     pool_update_data['$inc']['txCount'] = 1
     
-    pool_update_data['$set']['liquidity'] = await convert_num_to_decimal128(record['liquidity'])
+    pool_ticks = await store.get_pool_ticks(pool['poolAddress'])
+    fee_growth, crossed_tick_records = await get_swap_fee_growth(pool, pool_ticks, record)
+    pool_update_data['$set'].update(fee_growth)
+    pool_update_data['$set']['liquidity'] = Decimal(record['liquidity'])
     pool_update_data['$set']['tick'] = record['tick']
     pool_update_data['$set']['sqrtPriceX96'] = record['sqrtPriceX96']
-    pool_totalValueLockedToken0 = pool['totalValueLockedToken0'].to_decimal() + amount0
-    pool_totalValueLockedToken1 = pool['totalValueLockedToken1'].to_decimal() + amount1
-    pool_update_data['$set']['totalValueLockedToken0'] = Decimal128(pool_totalValueLockedToken0)
-    pool_update_data['$set']['totalValueLockedToken1'] = Decimal128(pool_totalValueLockedToken1)
+    pool_totalValueLockedToken0 = pool['totalValueLockedToken0'] + amount0
+    pool_totalValueLockedToken1 = pool['totalValueLockedToken1'] + amount1
+    pool_update_data['$set']['totalValueLockedToken0'] = pool_totalValueLockedToken0
+    pool_update_data['$set']['totalValueLockedToken1'] = pool_totalValueLockedToken1
 
     token0_update_data = dict()
     token0_update_data['$inc'] = dict()
     token0_update_data['$set'] = dict()
-    token0_update_data['$inc']['volume'] = Decimal128(amount0_abs)
-    token0_totalValueLocked = token0['totalValueLocked'].to_decimal() + amount0
-    token0_update_data['$inc']['volumeUSD'] = Decimal128(amount_total_USD_tracked)
-    token0_update_data['$inc']['untrackedVolumeUSD'] = Decimal128(amount_total_USD_untracked)
-    token0_update_data['$inc']['feesUSD'] = Decimal128(fees_USD)
+    token0_update_data['$inc']['volume'] = amount0_abs
+    token0_totalValueLocked = token0['totalValueLocked'] + amount0
+    token0_update_data['$inc']['volumeUSD'] = amount_total_USD_tracked
+    token0_update_data['$inc']['untrackedVolumeUSD'] = amount_total_USD_untracked
+    token0_update_data['$inc']['feesUSD'] = fees_USD
     token0_update_data['$inc']['txCount'] = 1
 
     token1_update_data = dict()
     token1_update_data['$inc'] = dict()
     token1_update_data['$set'] = dict()
-    token1_update_data['$inc']['volume'] = Decimal128(amount1_abs)
-    token1_totalValueLocked = token1['totalValueLocked'].to_decimal() + amount1
-    token1_update_data['$inc']['volumeUSD'] = Decimal128(amount_total_USD_tracked)
-    token1_update_data['$inc']['untrackedVolumeUSD'] = Decimal128(amount_total_USD_untracked)
-    token1_update_data['$inc']['feesUSD'] = Decimal128(fees_USD)
+    token1_update_data['$inc']['volume'] = amount1_abs
+    token1_totalValueLocked = token1['totalValueLocked'] + amount1
+    token1_update_data['$inc']['volumeUSD'] = amount_total_USD_tracked
+    token1_update_data['$inc']['untrackedVolumeUSD'] = amount_total_USD_untracked
+    token1_update_data['$inc']['feesUSD'] = fees_USD
     token1_update_data['$inc']['txCount'] = 1
 
     prices = await sqrt_price_x96_to_token_prices(record['sqrtPriceX96'], token0['decimals'], token1['decimals'])
-    pool_update_data['$set']['token0Price'] = Decimal128(prices[0])
-    pool_update_data['$set']['token1Price'] = Decimal128(prices[1])
-
-    await EthPrice.set(db)
-
-    token0_derivedETH = await find_eth_per_token(db, token0['tokenAddress'], rpc_url)
-    token1_derivedETH = await find_eth_per_token(db, token1['tokenAddress'], rpc_url)
-    token0_update_data['$set']['derivedETH'] = Decimal128(token0_derivedETH)
-    token1_update_data['$set']['derivedETH'] = Decimal128(token1_derivedETH)
+    pool_update_data['$set']['token0Price'] = prices[0]
+    pool_update_data['$set']['token1Price'] = prices[1]
+
+    token0_derivedETH, token1_derivedETH = await asyncio.gather(
+        find_eth_per_token(store, token0['tokenAddress'], record['block']),
+        find_eth_per_token(store, token1['tokenAddress'], record['block']),
+    )
+    token0_update_data['$set']['derivedETH'] = token0_derivedETH
+    token1_update_data['$set']['derivedETH'] = token1_derivedETH
     
-    factory_totalValueLockedETH = factory['totalValueLockedETH'].to_decimal() - pool['totalValueLockedETH'].to_decimal()
+    factory_totalValueLockedETH = factory['totalValueLockedETH'] - pool['totalValueLockedETH']
 
-    eth_price = await EthPrice.get()
     pool_totalValueLockedETH = (pool_totalValueLockedToken0 * token0_derivedETH) + (pool_totalValueLockedToken1 * token1_derivedETH)
-    pool_update_data['$set']['totalValueLockedETH'] = Decimal128(pool_totalValueLockedETH)
-    pool_update_data['$set']['totalValueLockedUSD'] = Decimal128(pool_totalValueLockedETH * eth_price)
+    pool_update_data['$set']['totalValueLockedETH'] = pool_totalValueLockedETH
+    pool_update_data['$set']['totalValueLockedUSD'] = pool_totalValueLockedETH * eth_price
 
     factory_totalValueLockedETH = factory_totalValueLockedETH + pool_totalValueLockedETH
-    factory_update_data['$set']['totalValueLockedETH'] = Decimal128(factory_totalValueLockedETH)
-    factory_update_data['$set']['totalValueLockedUSD'] = Decimal128(factory_totalValueLockedETH * eth_price)
+    factory_update_data['$set']['totalValueLockedETH'] = factory_totalValueLockedETH
+    factory_update_data['$set']['totalValueLockedUSD'] = factory_totalValueLockedETH * eth_price
 
-    token1_update_data['$set']['totalValueLocked'] = Decimal128(token0_totalValueLocked)
-    token1_update_data['$set']['totalValueLockedUSD'] = Decimal128(token0_totalValueLocked * token0_derivedETH * eth_price)
+    token1_update_data['$set']['totalValueLocked'] = token0_totalValueLocked
+    token1_update_data['$set']['totalValueLockedUSD'] = token0_totalValueLocked * token0_derivedETH * eth_price
 
-    token1_update_data['$set']['totalValueLocked'] = Decimal128(token1_totalValueLocked)
-    token1_update_data['$set']['totalValueLockedUSD'] = Decimal128(token1_totalValueLocked * token1_derivedETH * eth_price)
+    token1_update_data['$set']['totalValueLocked'] = token1_totalValueLocked
+    token1_update_data['$set']['totalValueLockedUSD'] = token1_totalValueLocked * token1_derivedETH * eth_price
 
     EventTracker.pool_addresses_to_update_fee_growth.add(record['poolAddress'])
 
-    await update_tokens_records(db, token0['_id'], token1['_id'], token0_update_data, token1_update_data)
-    await update_pool_record(db, pool['_id'], pool_update_data)
-    await update_factory_record(db, factory_update_data)
+    await store.update_ticks(crossed_tick_records)
+    await save_fee_state(store, record, await get_fee_state(fee_growth, record['tick'], crossed_tick_records))
 
-    factory = await get_factory_record(db)
-    pool = await get_pool_record(db, record['poolAddress'])
-    token0 = await get_token_record(db, token0['tokenAddress'], rpc_url)
-    token1 = await get_token_record(db, token1['tokenAddress'], rpc_url)
-    
-    await update_factory_day_data(db, factory, record['timestamp'], amount_total_ETH_tracked, amount_total_USD_tracked, fees_USD)
-    await update_factory_hour_data(db, factory, record['timestamp'], amount_total_ETH_tracked, amount_total_USD_tracked, fees_USD)
-    await update_pool_day_data(db, pool, record['timestamp'], amount_total_USD_tracked, amount0_abs, amount1_abs, fees_USD)
-    await update_pool_hour_data(db, pool, record['timestamp'], amount_total_USD_tracked, amount0_abs, amount1_abs, fees_USD)
-    await update_token_day_data(db, token0, record['timestamp'], amount_total_USD_tracked, amount0_abs, fees_USD)
-    await update_token_hour_data(db, token0, record['timestamp'], amount_total_USD_tracked, amount0_abs, fees_USD)
-    await update_token_day_data(db, token1, record['timestamp'], amount_total_USD_tracked, amount1_abs, fees_USD)
-    await update_token_hour_data(db, token1, record['timestamp'], amount_total_USD_tracked, amount1_abs, fees_USD)
+    await store.update_tokens(token0, token1, token0_update_data, token1_update_data)
+    await store.update_pool(pool, pool_update_data, record['block'])
+    await store.update_factory(factory_update_data)
+
+    await update_factory_day_data(db, factory, record['timestamp'], amount_total_ETH_tracked, amount_total_USD_tracked, fees_USD, interval_updates=interval_updates)
+    await update_factory_hour_data(db, factory, record['timestamp'], amount_total_ETH_tracked, amount_total_USD_tracked, fees_USD, interval_updates=interval_updates)
+    await update_pool_day_data(db, pool, record['timestamp'], amount_total_USD_tracked, amount0_abs, amount1_abs, fees_USD, interval_updates=interval_updates)
+    await update_pool_hour_data(db, pool, record['timestamp'], amount_total_USD_tracked, amount0_abs, amount1_abs, fees_USD, interval_updates=interval_updates)
+    await update_token_day_data(db, token0, record['timestamp'], eth_price, amount_total_USD_tracked, amount0_abs, fees_USD, interval_updates=interval_updates)
+    await update_token_hour_data(db, token0, record['timestamp'], eth_price, amount_total_USD_tracked, amount0_abs, fees_USD, interval_updates=interval_updates)
+    await update_token_day_data(db, token1, record['timestamp'], eth_price, amount_total_USD_tracked, amount1_abs, fees_USD, interval_updates=interval_updates)
+    await update_token_hour_data(db, token1, record['timestamp'], eth_price, amount_total_USD_tracked, amount1_abs, fees_USD, interval_updates=interval_updates)
 
-    await insert_volume_leaderboard_snapshot(db, fees_USD, record)
+    # a rebuild does not replay the volume leaderboard, its snapshots were inserted when the swap was first handled
+    if not kwargs.get('rebuild'):
+        await store.insert_record(Collection.VOLUME_LEADERBOARD_SNAPSHOT,
+                                  await get_volume_leaderboard_snapshot_record(fees_USD, record))
 
     EventTracker.swap_count += 1
 
-async def update_pool_fee_growth(*args, **kwargs):
-    db = kwargs['db']
-    rpc_url = kwargs['rpc_url']
-    for pool_address in EventTracker.pool_addresses_to_update_fee_growth:
-        pool_update_data = dict()
-        pool_update_data['$set'] = dict()
-        pool = await get_pool_record(db, pool_address)
-        contract = await Contract.from_address(address=pool_address, provider=FullNodeClient(node_url=rpc_url))
-        if contract is not None:
-            (fee_growth_global_0_X128,) = await contract.functions["get_fee_growth_global_0_X128"].call()
-            pool_update_data['$set']['feeGrowthGlobal0X128'] = hex(fee_growth_global_0_X128)
-            (fee_growth_global_1_X128,) = await contract.functions["get_fee_growth_global_1_X128"].call()
-            pool_update_data['$set']['feeGrowthGlobal1X128'] = hex(fee_growth_global_1_X128)
-            await update_pool_record(db, pool['_id'], pool_update_data)
+async def reconcile_fee_growth(store: StateStore, rpc_url: str, watermark: dict | None, force: bool = False):
+    # the fee growth is tracked from the swaps, the pools swapped since the last reconciliation are checked against
+    # their contract every FEE_GROWTH_RECONCILE_INTERVAL seconds
+    if watermark is None or not EventTracker.pool_addresses_to_update_fee_growth:
+        return
+    if not force and EventTracker.fee_growth_reconciled_at is not None and (
+            time.monotonic() - EventTracker.fee_growth_reconciled_at < FEE_GROWTH_RECONCILE_INTERVAL):
+        return
+    await reconcile_pools_fee_growth(store, rpc_url, EventTracker.pool_addresses_to_update_fee_growth,
+                                     watermark['block'])
+    EventTracker.pool_addresses_to_update_fee_growth = set()
+    EventTracker.fee_growth_reconciled_at = time.monotonic()
 
 
 EVENT_TO_FUNCTION_MAP = {
@@ -463,39 +462,122 @@ EVENT_TO_FUNCTION_MAP = {
 }
 
 
-async def process_events(mongo_url: str, mongo_database: Database, rpc_url: str):
-    processed_records = []
-    with MongoClient(mongo_url) as mongo:
-        db_name = mongo_database.replace('-', '_')
-        db = mongo[db_name]
-        await EthPrice.set(db)
-        async for record in yield_pool_data_records(db):
-            event_func = EVENT_TO_FUNCTION_MAP.get(record['event'])
-            if event_func:
-                await event_func(
-                    db=db, 
-                    record=record,
-                    rpc_url=rpc_url)
-                processed_records.append(
-                    UpdateOne({"_id": record['_id']}, {"$set": {"processed": True}})
-                )
-        if processed_records:
-            db[Collection.POOLS_DATA].bulk_write(processed_records)
-        await update_pool_fee_growth(db=db, rpc_url=rpc_url)
-
+async def commit_events_batch(db: AsyncDatabase, store_operations: dict, interval_operations: dict,
+                              watermark: dict | None):
+    # the batch is written together with its watermark, a batch interrupted by a crash is rolled back and
+    # handled again from the last committed watermark
+    async def write_events_batch(session: AsyncClientSession | None):
+        await bulk_write_operations(db, store_operations, session)
+        await bulk_write_operations(db, interval_operations, session)
+        await save_watermark(db, Transformer.EVENTS, watermark, session)
+
+    await run_in_transaction(db, write_events_batch)
+
+
+async def submit_events_batch(writer: BatchWriter, store: StateStore, interval_updates: IntervalUpdates,
+                              watermark: dict | None):
+    await writer.submit(await store.get_flush_operations(), await interval_updates.get_flush_operations(), watermark)
+
+
+async def process_events_batch(db: AsyncDatabase, store: StateStore, interval_updates: IntervalUpdates,
+                               records: list[dict], rpc_url: str, rebuild: bool = False):
+    for record in records:
+        event_func = EVENT_TO_FUNCTION_MAP.get(record['event'])
+        if event_func:
+            await event_func(
+                db=db, 
+                store=store,
+                interval_updates=interval_updates,
+                record=record,
+                rpc_url=rpc_url,
+                rebuild=rebuild)
+
+
+async def yield_pool_data_batches(db: AsyncDatabase, watermark: dict | None) -> tuple[list[dict], dict]:
+    batch_records = []
+    async for record in yield_pool_data_records(db, watermark):
+        if len(batch_records) >= EVENTS_BATCH_SIZE and (
+                not await is_legacy_watermark(watermark) or record['block'] != watermark['block']):
+            yield batch_records, watermark
+            batch_records = []
+        watermark = await get_record_watermark(record)
+        batch_records.append(record)
+    if batch_records:
+        yield batch_records, watermark
+
+
+async def process_events(db: AsyncDatabase, rpc_url: str):
+    # pipeline: the next batches are read while a batch is computed, the computed ones are written in the background
+    store = StateStore(db, rpc_url)
+    interval_updates = IntervalUpdates()
+    watermark = await get_watermark(db, Transformer.EVENTS, Collection.POOLS_DATA)
+    await store.load_eth_price(watermark['block'] if watermark else 0)
+    async with BatchWriter(partial(commit_events_batch, db), EVENTS_PIPELINE_SIZE) as writer:
+        async for batch_records, watermark in prefetch(yield_pool_data_batches(db, watermark), EVENTS_PIPELINE_SIZE):
+            await process_events_batch(db, store, interval_updates, batch_records, rpc_url)
+            await submit_events_batch(writer, store, interval_updates, watermark)
+        await reconcile_fee_growth(store, rpc_url, watermark)
+        await submit_events_batch(writer, store, interval_updates, watermark)
+    await log_processed_events()
+
+
+async def log_processed_events():
     logger.info(f'Successfully processed {EventTracker.initialize_count} Initialize events')
     logger.info(f'Successfully processed {EventTracker.mint_count} Mint events')
     logger.info(f'Successfully processed {EventTracker.swap_count} Swap events')
     logger.info(f'Successfully processed {EventTracker.burn_count} Burn events')
-    logger.info(f'Successfully updated {len(EventTracker.pool_addresses_to_update_fee_growth)} pools fee growth')
+    await RpcClients.log_stats()
     EventTracker.initialize_count = 0
     EventTracker.mint_count = 0
     EventTracker.swap_count = 0
     EventTracker.burn_count = 0
-    EventTracker.pool_addresses_to_update_fee_growth = set()
 
 
-async def run_events_transformer(mongo_url: str, mongo_database: Database, rpc_url: str):
-    while True:
-        await process_events(mongo_url, mongo_database, rpc_url)
-        time.sleep(TIME_INTERVAL)
+async def rebuild_events(db: AsyncDatabase, rpc_url: str):
+    batch_records = []
+    store = RebuildStateStore(db, rpc_url)
+    interval_updates = IntervalUpdates()
+    watermark = None
+    await create_rebuild_collections(db)
+    await store.load()
+    await store.load_eth_price(0)
+    logger.info('Rebuilding events transformer collections')
+    async for record in yield_rebuild_records(db):
+        if len(batch_records) >= EVENTS_BATCH_SIZE:
+            await process_events_batch(db, store, interval_updates, batch_records, rpc_url, rebuild=True)
+            await insert_interval_buckets(db, interval_updates, record['timestamp'])
+            await bulk_write_operations(db, await store.get_record_update_operations())
+            logger.info(f'Rebuilt events up to block {watermark["block"]}')
+            batch_records = []
+        watermark = await get_record_watermark(record)
+        batch_records.append(record)
+    await process_events_batch(db, store, interval_updates, batch_records, rpc_url, rebuild=True)
+    await reconcile_fee_growth(store, rpc_url, watermark, force=True)
+    await insert_interval_buckets(db, interval_updates)
+    await bulk_write_operations(db, await store.get_record_update_operations())
+    await store.insert_rebuild_records()
+    await swap_rebuild_collections(db)
+    await save_watermark(db, Transformer.EVENTS, watermark)
+    await save_ticks_complete(db)
+    await log_processed_events()
+
+
+async def run_events_transformer(mongo_url: str, mongo_database: str, rpc_url: str, follow: bool = False,
+                                 rebuild: bool = False):
+    async with AsyncMongoClient(mongo_url, maxPoolSize=MONGO_MAX_POOL_SIZE) as mongo:
+        db_name = mongo_database.replace('-', '_')
+        db = mongo[db_name]
+        await create_watermark_index(db, Collection.POOLS_DATA)
+        await create_ticks_index(db)
+        await create_fee_state_indexes(db)
+        if rebuild:
+            await rebuild_events(db, rpc_url)
+            return
+        await check_ticks_complete(db)
+        if follow:
+            await follow_changes(db, Transformer.EVENTS, {
+                Collection.POOLS_DATA: lambda: process_events(db, rpc_url),
+            })
+        while True:
+            await process_events(db, rpc_url)
+            await asyncio.sleep(TIME_INTERVAL)
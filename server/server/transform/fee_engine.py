@@ -0,0 +1,241 @@
+from pymongo import ASCENDING, DESCENDING
+from pymongo.asynchronous.database import AsyncDatabase
+
+from server.const import Collection, Event
+from server.query_utils import filter_by_the_latest_value
+from server.transform.fee_growth import FEE_GROWTH_FIELDS, Q128
+from server.transform.progress import WATERMARK_SORT
+from server.transform.ticks import FEE_GROWTH_OUTSIDE_FIELDS
+from server.utils import UINT256_MODULUS
+
+from structlog import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# The events transformer stores the fee state of the pool after every event on its pools_data record (feeState):
+# the fee growth globals, the current tick and the ticks the event updated. The positions transformer stores
+# the fee checkpoint of the position after every event on its positions_data record (feeCheckpoint), so the fees
+# owed to a position as of any block are computed from the records before it, without RPC calls
+REVERSED_WATERMARK_SORT = [(field, DESCENDING) for field, _ in WATERMARK_SORT]
+FEE_STATE_INDEXES = {
+    Collection.POOLS_DATA: [
+        [('poolAddress', ASCENDING), ('block', DESCENDING)],
+        [('poolAddress', ASCENDING), ('feeState.ticks.tickIdx', ASCENDING), ('block', DESCENDING)],
+    ],
+    Collection.POSITIONS_DATA: [
+        [('positionId', ASCENDING), ('block', DESCENDING)],
+    ],
+}
+
+
+async def create_fee_state_indexes(db: AsyncDatabase):
+    for collection, indexes in FEE_STATE_INDEXES.items():
+        for index in indexes:
+            await db[collection].create_index(index)
+
+
+async def get_fee_growth_inside(fee_state: dict, tick_lower: int, tick_upper: int, lower_tick: dict | None,
+                                upper_tick: dict | None) -> tuple[int, int]:
+    # fee growth between the ticks of a position, as computed by the pool contract
+    fee_growth_inside = []
+    for outside_field, global_field in FEE_GROWTH_OUTSIDE_FIELDS.items():
+        fee_growth_global = int(fee_state[global_field], 16)
+        lower_outside = int(lower_tick[outside_field], 16) if lower_tick else 0
+        upper_outside = int(upper_tick[outside_field], 16) if upper_tick else 0
+        below = lower_outside if fee_state['tick'] >= tick_lower else fee_growth_global - lower_outside
+        above = upper_outside if fee_state['tick'] < tick_upper else fee_growth_global - upper_outside
+        fee_growth_inside.append((fee_growth_global - below - above) % UINT256_MODULUS)
+    return fee_growth_inside[0], fee_growth_inside[1]
+
+
+async def get_fees_owed(liquidity: int, fee_growth_inside: tuple[int, int],
+                        fee_growth_inside_last: tuple[int, int]) -> tuple[int, int] | None:
+    # the fee growth inside wraps around in the contract but never moves backwards, a delta past half the range
+    # is a decrease of the stored fee state and the fees owed are unknown, None falls back to the collect simulation
+    deltas = [(current - last) % UINT256_MODULUS for current, last in zip(fee_growth_inside, fee_growth_inside_last)]
+    if liquidity > 0 and any(delta >= UINT256_MODULUS // 2 for delta in deltas):
+        logger.warning('Position fee growth inside decreased', feeGrowthInside=fee_growth_inside,
+                       feeGrowthInsideLast=fee_growth_inside_last)
+        return None
+    fees_owed0, fees_owed1 = (delta * liquidity // Q128 for delta in deltas)
+    return fees_owed0, fees_owed1
+
+
+async def get_tick_fee_state(tick_record: dict) -> dict:
+    return {
+        'tickIdx': tick_record['tickIdx'],
+        'feeGrowthOutside0X128': tick_record['feeGrowthOutside0X128'],
+        'feeGrowthOutside1X128': tick_record['feeGrowthOutside1X128'],
+    }
+
+
+async def get_fee_state(fee_growth: dict, tick: int | None, tick_records: list[dict]) -> dict:
+    fee_state = {field: fee_growth.get(field, '0x0') for field in FEE_GROWTH_FIELDS}
+    fee_state['tick'] = tick
+    fee_state['ticks'] = [await get_tick_fee_state(tick_record) for tick_record in tick_records]
+    return fee_state
+
+
+async def get_position_fee_state(pool: dict, tick_records: list[dict]) -> dict:
+    # after a Mint or Burn, the fee growth inside the position ticks is checkpointed by the position manager
+    lower_tick, upper_tick = tick_records
+    fee_state = await get_fee_state(pool, pool.get('tick'), tick_records)
+    fee_growth_inside0, fee_growth_inside1 = await get_fee_growth_inside(
+        fee_state, lower_tick['tickIdx'], upper_tick['tickIdx'], lower_tick, upper_tick)
+    fee_state['feeGrowthInside0X128'] = hex(fee_growth_inside0)
+    fee_state['feeGrowthInside1X128'] = hex(fee_growth_inside1)
+    return fee_state
+
+
+async def find_pool_fee_state(db: AsyncDatabase, pool_address: str, block: int) -> dict | None:
+    query = {
+        'poolAddress': pool_address,
+        'block': {'$lte': block},
+        'feeState': {'$exists': True},
+    }
+    record = await db[Collection.POOLS_DATA].find_one(query, {'feeState': 1}, sort=REVERSED_WATERMARK_SORT)
+    return record['feeState'] if record else None
+
+
+async def find_tick_fee_state(db: AsyncDatabase, pool_address: str, tick: int, block: int) -> dict | None:
+    query = {
+        'poolAddress': pool_address,
+        'feeState.ticks.tickIdx': tick,
+        'block': {'$lte': block},
+    }
+    record = await db[Collection.POOLS_DATA].find_one(query, {'feeState.ticks': 1}, sort=REVERSED_WATERMARK_SORT)
+    if record is None:
+        return None
+    return next(tick_state for tick_state in record['feeState']['ticks'] if tick_state['tickIdx'] == tick)
+
+
+async def find_position_pool_address(db: AsyncDatabase, record: dict, position_record: dict) -> str | None:
+    # positions reference their pool by its tokens and fee, the position record has them when the event misses them
+    token0, token1, fee = (record.get(field, position_record.get(field))
+                           for field in ('token0Address', 'token1Address', 'poolFee'))
+    if token0 is None or token1 is None or fee is None:
+        return None
+    query = {
+        'token0': token0,
+        'token1': token1,
+        'fee': fee,
+    }
+    await filter_by_the_latest_value(query)
+    pool = await db[Collection.POOLS].find_one(query, {'poolAddress': 1})
+    return pool['poolAddress'] if pool else None
+
+
+async def find_position_fee_growth_inside(db: AsyncDatabase, record: dict,
+                                          position_record: dict) -> tuple[str, tuple[int, int]] | None:
+    # the position manager changes the pool position with a Mint or Burn (a zero Burn before a Collect)
+    # earlier in the same transaction, other pools may have a position with the same ticks in a multicall
+    if record.get('txIndex') is None or record.get('eventIndex') is None:
+        return None
+    pool_address = await find_position_pool_address(db, record, position_record)
+    if pool_address is None:
+        return None
+    query = {
+        'poolAddress': pool_address,
+        'block': record['block'],
+        'txIndex': record['txIndex'],
+        'eventIndex': {'$lt': record['eventIndex']},
+        'event': {'$in': [Event.MINT, Event.BURN]},
+        'tickLower': record['tickLower'],
+        'tickUpper': record['tickUpper'],
+        'feeState.feeGrowthInside0X128': {'$exists': True},
+    }
+    pool_record = await db[Collection.POOLS_DATA].find_one(query, {'poolAddress': 1, 'feeState': 1},
+                                                           sort=REVERSED_WATERMARK_SORT)
+    if pool_record is None:
+        return None
+    fee_state = pool_record['feeState']
+    return pool_record['poolAddress'], (int(fee_state['feeGrowthInside0X128'], 16),
+                                        int(fee_state['feeGrowthInside1X128'], 16))
+
+
+async def get_checkpoint_fee_growth_inside(checkpoint: dict) -> tuple[int, int]:
+    return int(checkpoint['feeGrowthInside0LastX128'], 16), int(checkpoint['feeGrowthInside1LastX128'], 16)
+
+
+async def is_new_position(position_record: dict) -> bool:
+    return all(position_record[field].to_decimal() == 0
+               for field in ('liquidity', 'depositedToken0', 'depositedToken1'))
+
+
+async def get_fee_checkpoint(db: AsyncDatabase, record: dict, position_record: dict, liquidity_delta: int,
+                             collected_fees: tuple[int, int] = (0, 0)) -> dict | None:
+    # fees owed after a position event: the fees earned since the previous checkpoint by the liquidity before the
+    # event are added and the collected ones are taken out, None once the chain of checkpoints is broken
+    previous_checkpoint = position_record.get('feeCheckpoint')
+    previous_liquidity = int(position_record['liquidity'].to_decimal())
+    # the chain starts with the first deposit of the position, positions older than the checkpoints have none
+    if previous_checkpoint is None and not await is_new_position(position_record):
+        return None
+    position_fee_growth_inside = await find_position_fee_growth_inside(db, record, position_record)
+    if position_fee_growth_inside is None:
+        # without liquidity the position earns nothing, a Collect of the fees owed needs no pool event
+        if previous_checkpoint is None or previous_liquidity > 0:
+            return None
+        position_fee_growth_inside = (previous_checkpoint['poolAddress'],
+                                      await get_checkpoint_fee_growth_inside(previous_checkpoint))
+    pool_address, fee_growth_inside = position_fee_growth_inside
+
+    fees_owed = (0, 0)
+    if previous_checkpoint is not None:
+        fees_earned = await get_fees_owed(previous_liquidity, fee_growth_inside,
+                                          await get_checkpoint_fee_growth_inside(previous_checkpoint))
+        if fees_earned is None:
+            return None
+        fees_owed = tuple(
+            max(int(owed, 16) + earned - collected, 0)
+            for owed, earned, collected in zip(
+                (previous_checkpoint['feesOwed0'], previous_checkpoint['feesOwed1']), fees_earned, collected_fees)
+        )
+    return {
+        'poolAddress': pool_address,
+        'tickLower': record['tickLower'],
+        'tickUpper': record['tickUpper'],
+        'liquidity': str(previous_liquidity + liquidity_delta),
+        'feeGrowthInside0LastX128': hex(fee_growth_inside[0]),
+        'feeGrowthInside1LastX128': hex(fee_growth_inside[1]),
+        'feesOwed0': hex(fees_owed[0]),
+        'feesOwed1': hex(fees_owed[1]),
+    }
+
+
+async def find_fee_checkpoint(db: AsyncDatabase, position_id: str, block: int) -> dict | None:
+    query = {
+        'positionId': position_id,
+        'block': {'$lte': block},
+        'feeCheckpoint': {'$exists': True},
+    }
+    record = await db[Collection.POSITIONS_DATA].find_one(query, {'feeCheckpoint': 1},
+                                                          sort=REVERSED_WATERMARK_SORT)
+    return record['feeCheckpoint'] if record else None
+
+
+async def get_position_uncollected_fees(db: AsyncDatabase, position_record: dict,
+                                        block: int) -> tuple[int, int] | None:
+    # uncollected fees of a position at the end of a block, None when they cannot be computed offline
+    checkpoint = await find_fee_checkpoint(db, position_record['positionId'], block)
+    if checkpoint is None:
+        return None
+    fees_owed = (int(checkpoint['feesOwed0'], 16), int(checkpoint['feesOwed1'], 16))
+    liquidity = int(checkpoint['liquidity'])
+    if liquidity == 0:
+        return fees_owed
+
+    pool_address = checkpoint['poolAddress']
+    fee_state = await find_pool_fee_state(db, pool_address, block)
+    lower_tick = await find_tick_fee_state(db, pool_address, checkpoint['tickLower'], block)
+    upper_tick = await find_tick_fee_state(db, pool_address, checkpoint['tickUpper'], block)
+    if fee_state is None or lower_tick is None or upper_tick is None:
+        return None
+    fee_growth_inside = await get_fee_growth_inside(fee_state, checkpoint['tickLower'], checkpoint['tickUpper'],
+                                                    lower_tick, upper_tick)
+    fees_earned = await get_fees_owed(liquidity, fee_growth_inside, await get_checkpoint_fee_growth_inside(checkpoint))
+    if fees_earned is None:
+        return None
+    return fees_owed[0] + fees_earned[0], fees_owed[1] + fees_earned[1]
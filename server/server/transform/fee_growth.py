@@ -0,0 +1,179 @@
+import asyncio
+from bisect import bisect_left, bisect_right
+from decimal import Decimal
+
+from server.query_utils import get_pool_fee_growth_global, get_pool_fee_protocol
+from server.transform.state_store import StateStore
+from server.transform.ticks import PoolTicks
+from server.utils import UINT256_MODULUS
+
+from structlog import get_logger
+
+
+logger = get_logger(__name__)
+
+
+Q96 = 2 ** 96
+Q128 = 2 ** 128
+FEE_DENOMINATOR = 1000000
+FEE_GROWTH_FIELDS = ('feeGrowthGlobal0X128', 'feeGrowthGlobal1X128')
+MIN_TICK = -887272
+MAX_TICK = 887272
+# 2**128 / sqrt(1.0001) ** (2 ** bit) of every bit of a tick, as in the TickMath of the pool contract
+TICK_BIT_RATIOS = (
+    0xfffcb933bd6fad37aa2d162d1a594001, 0xfff97272373d413259a46990580e213a, 0xfff2e50f5f656932ef12357cf3c7fdcc,
+    0xffe5caca7e10e4e61c3624eaa0941cd0, 0xffcb9843d60f6159c9db58835c926644, 0xff973b41fa98c081472e6896dfb254c0,
+    0xff2ea16466c96a3843ec78b326b52861, 0xfe5dee046a99a2a811c461f1969c3053, 0xfcbe86c7900a88aedcffc83b479aa3a4,
+    0xf987a7253ac413176f2b074cf7815e54, 0xf3392b0822b70005940c7a398e4b70f3, 0xe7159475a2c29b7443b29c7fa6e889d9,
+    0xd097f3bdfd2022b8845ad8f792aa5825, 0xa9f746462d870fdf8a65dc1f90e061e5, 0x70d869a156d2a1b890bb3df62baf32f7,
+    0x31be135f97d08fd981231505542fcfa6, 0x9aa508b5b7a84e1c677de54f3e99bc9, 0x5d6af8dedb81196699c329225ee604,
+    0x2216e584f5fa1ea926041bedfe98, 0x48a170391f7dc42444e8fa2,
+)
+# ticks of a word of the tick bitmap, a swap step never goes past the word of its current tick
+TICKS_PER_WORD = 256
+
+
+async def parse_int(value) -> int:
+    # the indexer stores the raw amounts as decimal strings, older records as numbers
+    return int(Decimal(str(value)))
+
+
+async def ceil_div(numerator: int, denominator: int) -> int:
+    return -(-numerator // denominator)
+
+
+async def get_sqrt_ratio_at_tick(tick: int) -> int:
+    abs_tick = abs(tick)
+    ratio = TICK_BIT_RATIOS[0] if abs_tick & 1 else Q128
+    for bit in range(1, len(TICK_BIT_RATIOS)):
+        if abs_tick & (1 << bit):
+            ratio = ratio * TICK_BIT_RATIOS[bit] >> 128
+    if tick > 0:
+        ratio = (UINT256_MODULUS - 1) // ratio
+    return (ratio >> 32) + (1 if ratio % (1 << 32) else 0)
+
+
+async def get_amount_in(sqrt_price_from: int, sqrt_price_to: int, liquidity: int, zero_for_one: bool) -> int:
+    # input amount moving the price between two prices, rounded up like the pool contract
+    sqrt_price_low, sqrt_price_high = sorted((sqrt_price_from, sqrt_price_to))
+    if zero_for_one:
+        return await ceil_div(
+            await ceil_div((liquidity << 96) * (sqrt_price_high - sqrt_price_low), sqrt_price_high), sqrt_price_low)
+    return await ceil_div(liquidity * (sqrt_price_high - sqrt_price_low), Q96)
+
+
+async def get_next_tick(ticks: list[int], tick: int, tick_spacing: int, zero_for_one: bool) -> tuple[int, bool]:
+    # next initialized tick in the swap direction within the bitmap word of the current tick, or the word end
+    compressed = tick // tick_spacing
+    if zero_for_one:
+        word_start = (compressed - compressed % TICKS_PER_WORD) * tick_spacing
+        index = bisect_right(ticks, compressed * tick_spacing) - 1
+        if index >= 0 and ticks[index] >= word_start:
+            return ticks[index], True
+        return max(word_start, MIN_TICK), False
+    compressed += 1
+    word_end = (compressed - compressed % TICKS_PER_WORD + TICKS_PER_WORD - 1) * tick_spacing
+    index = bisect_left(ticks, compressed * tick_spacing)
+    if index < len(ticks) and ticks[index] <= word_end:
+        return ticks[index], True
+    return min(word_end, MAX_TICK), False
+
+
+# The fee of a swap is taken on the input token, the swap is walked through the initialized ticks like the pool
+# contract does: the fee of every step is spread over the liquidity in range during the step and the crossed ticks
+# flip their outside fee growth against the fee growth at the crossing. The input of the last step is only known
+# from the event amount, the rest of it is the fee of that step. 1 / feeProtocol of every fee goes to the protocol.
+async def get_swap_fee_growth(pool: dict, pool_ticks: PoolTicks, record: dict) -> tuple[dict, list[dict]]:
+    fee_growth = {field: pool.get(field, '0x0') for field in FEE_GROWTH_FIELDS}
+    amount0 = await parse_int(record['amount0'])
+    amount1 = await parse_int(record['amount1'])
+    zero_for_one = amount0 > 0
+    field, amount_remaining = ('feeGrowthGlobal0X128', amount0) if zero_for_one else ('feeGrowthGlobal1X128', amount1)
+    if amount_remaining <= 0 or pool.get('tick') is None or not pool.get('sqrtPriceX96'):
+        return fee_growth, []
+
+    fee = int(pool['fee'])
+    fee_protocol = int(pool.get('feeProtocol', 0))
+    tick = pool['tick']
+    sqrt_price = await parse_int(pool['sqrtPriceX96'])
+    sqrt_price_end = await parse_int(record['sqrtPriceX96'])
+    liquidity = await parse_int(pool['liquidity'])
+    fee_growth_global = int(fee_growth[field], 16)
+    crossed_tick_records = []
+    while True:
+        tick_next, initialized = await get_next_tick(pool_ticks.ticks, tick, int(pool['tickSpacing']), zero_for_one)
+        sqrt_price_next = await get_sqrt_ratio_at_tick(tick_next)
+        last_step = sqrt_price_next < sqrt_price_end if zero_for_one else sqrt_price_next > sqrt_price_end
+        amount_in = await get_amount_in(sqrt_price, sqrt_price_end if last_step else sqrt_price_next, liquidity,
+                                        zero_for_one)
+        if last_step:
+            fee_amount = amount_remaining - amount_in
+            if fee_amount < 0:
+                logger.warning('Swap amount below the input of its price move', poolAddress=pool['poolAddress'],
+                               block=record['block'], amountIn=amount_in, amountRemaining=amount_remaining)
+                fee_amount = 0
+        else:
+            fee_amount = await ceil_div(amount_in * fee, FEE_DENOMINATOR - fee)
+        amount_remaining -= amount_in + fee_amount
+        if fee_protocol > 0:
+            fee_amount -= fee_amount // fee_protocol
+        if liquidity > 0:
+            fee_growth_global = (fee_growth_global + fee_amount * Q128 // liquidity) % UINT256_MODULUS
+        if last_step:
+            break
+
+        sqrt_price = sqrt_price_next
+        if initialized:
+            fee_growth[field] = hex(fee_growth_global)
+            tick_record = await pool_ticks.cross(tick_next, fee_growth)
+            crossed_tick_records.append(tick_record)
+            liquidity_net = int(tick_record['liquidityNet'])
+            liquidity += -liquidity_net if zero_for_one else liquidity_net
+        tick = tick_next - 1 if zero_for_one else tick_next
+
+    fee_growth[field] = hex(fee_growth_global)
+    if liquidity != await parse_int(record['liquidity']):
+        logger.warning('Swap liquidity differs from the ticks', poolAddress=pool['poolAddress'],
+                       block=record['block'], ticksLiquidity=liquidity, liquidity=record['liquidity'])
+    return fee_growth, crossed_tick_records
+
+
+async def reconcile_pool_fee_growth(store: StateStore, pool_address: str, rpc_url: str, block: int) -> bool:
+    (fee_growth_global_0_X128, fee_growth_global_1_X128), fee_protocol = await asyncio.gather(
+        get_pool_fee_growth_global(pool_address, rpc_url, block),
+        get_pool_fee_protocol(pool_address, rpc_url, block),
+    )
+    pool = await store.get_pool(pool_address)
+    pool_update_data = {'$set': {}}
+    if fee_protocol != pool.get('feeProtocol', 0):
+        logger.warning('Pool fee protocol changed', poolAddress=pool_address, block=block,
+                       local=pool.get('feeProtocol', 0), contract=fee_protocol)
+        pool_update_data['$set']['feeProtocol'] = fee_protocol
+
+    drifted = False
+    for field, contract_value in zip(FEE_GROWTH_FIELDS, (fee_growth_global_0_X128, fee_growth_global_1_X128)):
+        local_value = int(pool.get(field, '0x0'), 16)
+        if contract_value == local_value:
+            continue
+        drifted = True
+        # the fee growth only moves forward: the ticks and the positions checkpoints were taken against the local
+        # value, a lower one would make the fee growth inside of the positions wrap around
+        if (contract_value - local_value) % UINT256_MODULUS < UINT256_MODULUS // 2:
+            logger.warning('Pool fee growth behind the contract', poolAddress=pool_address, block=block,
+                           field=field, local=hex(local_value), contract=hex(contract_value))
+            pool_update_data['$set'][field] = hex(contract_value)
+        else:
+            logger.error('Pool fee growth ahead of the contract, the local value is kept', poolAddress=pool_address,
+                         block=block, field=field, local=hex(local_value), contract=hex(contract_value))
+    if pool_update_data['$set']:
+        await store.update_pool(pool, pool_update_data)
+    return drifted
+
+
+async def reconcile_pools_fee_growth(store: StateStore, rpc_url: str, pool_addresses: set[str], block: int):
+    # the contract is read as of the last handled block, so the values compare to the local ones
+    drifted = await asyncio.gather(*[
+        reconcile_pool_fee_growth(store, pool_address, rpc_url, block)
+        for pool_address in pool_addresses
+    ])
+    logger.info(f'Reconciled {len(pool_addresses)} pools fee growth, {sum(drifted)} drifted')
@@ -0,0 +1,76 @@
+import asyncio
+from typing import Awaitable, Callable
+
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.errors import OperationFailure, PyMongoError
+
+from server.const import FOLLOW_BATCH_SIZE, FOLLOW_MAX_AWAIT_MS, TIME_INTERVAL
+from server.transform.progress import get_resume_token, save_resume_token
+
+from structlog import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# resume token is no longer usable (invalid token, history lost) so the stream has to start from now
+STALE_RESUME_TOKEN_ERROR_CODES = {260, 280, 286}
+
+
+async def follow_changes(db: AsyncDatabase, transformer: str,
+                         processors: dict[str, Callable[[], Awaitable]], updated_collections: tuple[str, ...] = ()):
+    # a processor is triggered by the records inserted into its collection, and by the updated ones for the
+    # updated_collections
+    pipeline = [
+        {
+            '$match': {
+                '$or': [
+                    {
+                        'operationType': 'insert',
+                        'ns.coll': {'$in': list(processors)},
+                    },
+                    {
+                        'operationType': {'$in': ['update', 'replace']},
+                        'ns.coll': {'$in': list(updated_collections)},
+                    },
+                ]
+            }
+        }
+    ]
+    while True:
+        resume_token = await get_resume_token(db, transformer)
+        try:
+            async with await db.watch(pipeline, resume_after=resume_token,
+                                      max_await_time_ms=FOLLOW_MAX_AWAIT_MS) as stream:
+                # the stream is opened first so nothing inserted during the catch-up scan is missed,
+                # changes are only a trigger, records are always read past the transformer watermark
+                logger.info(f'Catching up {transformer} transformer before following changes')
+                for processor in processors.values():
+                    await processor()
+
+                while stream.alive:
+                    changed_collections = set()
+                    changes_count = 0
+                    while changes_count < FOLLOW_BATCH_SIZE:
+                        change = await stream.try_next()
+                        if change is None:
+                            break
+                        changed_collections.add(change['ns']['coll'])
+                        changes_count += 1
+
+                    for collection, processor in processors.items():
+                        if collection in changed_collections:
+                            await processor()
+
+                    if stream.resume_token != resume_token:
+                        resume_token = stream.resume_token
+                        await save_resume_token(db, transformer, resume_token)
+        except OperationFailure as exc:
+            if exc.code not in STALE_RESUME_TOKEN_ERROR_CODES:
+                raise
+            logger.warning(f'Resume token of {transformer} transformer is stale, following changes from now',
+                           error=str(exc))
+            await save_resume_token(db, transformer, None)
+        except PyMongoError as exc:
+            logger.warning(f'Change stream of {transformer} transformer failed, restarting', error=str(exc))
+            await asyncio.sleep(TIME_INTERVAL)
@@ -1,294 +1,300 @@
 from decimal import Decimal
 
-from bson import Decimal128
-from pymongo.database import Database
+from pymongo.asynchronous.database import AsyncDatabase
 
-from server.const import Collection, ZERO_DECIMAL128, ZERO_DECIMAL
-from server.utils import get_day_id, get_hour_id
-from server.transform.pricing import EthPrice
+from server.const import Collection, ZERO_DECIMAL
+from server.transform.pipeline import bulk_write_operations
+from server.utils import DECIMAL128_CONTEXT, get_day_id, get_hour_id, to_decimal, to_decimal128
 
 from pymongo import UpdateOne
 
 
-async def update_factory_day_data(db: Database, factory_record: dict, timestamp: str, 
-                            amount_total_ETH_tracked: Decimal = ZERO_DECIMAL, 
-                            amount_total_USD_tracked: Decimal = ZERO_DECIMAL, 
-                            fees_USD: Decimal = ZERO_DECIMAL):
+async def fold_update_data(bucket_update_data: dict, update_data: dict):
+    # open comes from the first event of the bucket, close and the snapshot fields from the last one
+    for field, value in update_data.get('$setOnInsert', {}).items():
+        bucket_update_data['$setOnInsert'].setdefault(field, value)
+    bucket_update_data['$set'].update(update_data.get('$set', {}))
+    for field, value in update_data.get('$inc', {}).items():
+        value = to_decimal(value)
+        if isinstance(value, Decimal):
+            value = DECIMAL128_CONTEXT.add(bucket_update_data['$inc'].get(field, 0), value)
+        else:
+            value = bucket_update_data['$inc'].get(field, 0) + value
+        bucket_update_data['$inc'][field] = value
+    for field, value in update_data.get('$max', {}).items():
+        value = to_decimal(value)
+        if field not in bucket_update_data['$max'] or value > bucket_update_data['$max'][field]:
+            bucket_update_data['$max'][field] = value
+    for field, value in update_data.get('$min', {}).items():
+        value = to_decimal(value)
+        if field not in bucket_update_data['$min'] or value < bucket_update_data['$min'][field]:
+            bucket_update_data['$min'][field] = value
+
+
+async def serialize_update_data(bucket_update_data: dict) -> dict:
+    update_data = dict()
+    for operator, fields in bucket_update_data.items():
+        if fields:
+            update_data[operator] = {field: to_decimal128(value) for field, value in fields.items()}
+    return update_data
+
+
+async def get_bucket_document(bucket_filter: dict, bucket_update_data: dict) -> dict:
+    # the document the upsert of the bucket would create in an empty collection
+    bucket_document = dict(bucket_filter)
+    for fields in (await serialize_update_data(bucket_update_data)).values():
+        bucket_document.update(fields)
+    return bucket_document
+
+
+async def is_bucket_before(bucket_filter: dict, day_id: int, hour_id: int) -> bool:
+    if 'dayId' in bucket_filter:
+        return bucket_filter['dayId'] < day_id
+    return bucket_filter['hourId'] < hour_id
+
+
+# Candle accumulator for the interval collections: the updates of a batch are folded in memory
+# per (entity, dayId/hourId) bucket and every touched bucket is written with a single upsert on flush
+class IntervalUpdates:
+    def __init__(self):
+        self._buckets = dict()
+
+    async def add(self, collection: str, bucket_filter: dict, update_data: dict):
+        buckets = self._buckets.setdefault(collection, dict())
+        bucket_key = tuple(bucket_filter.values())
+        if bucket_key not in buckets:
+            buckets[bucket_key] = (bucket_filter, {
+                '$setOnInsert': dict(),
+                '$set': dict(),
+                '$inc': dict(),
+                '$max': dict(),
+                '$min': dict(),
+            })
+        await fold_update_data(buckets[bucket_key][1], update_data)
+
+    async def get_flush_operations(self) -> dict[str, list[UpdateOne]]:
+        flush_operations = {
+            collection: [
+                UpdateOne(bucket_filter, await serialize_update_data(bucket_update_data), upsert=True)
+                for bucket_filter, bucket_update_data in buckets.values()
+            ]
+            for collection, buckets in self._buckets.items()
+        }
+        self._buckets = dict()
+        return flush_operations
+
+    async def flush(self, db: AsyncDatabase):
+        await bulk_write_operations(db, await self.get_flush_operations())
+
+    async def insert(self, db: AsyncDatabase, collection_names: dict, timestamp: str | None = None):
+        # for a rebuild into empty collections: with records replayed in block order, the buckets of a day/hour
+        # before the one of the timestamp are complete and inserted as documents, all of them without a timestamp
+        if timestamp is not None:
+            (day_id, _), (hour_id, _) = await get_day_id(timestamp), await get_hour_id(timestamp)
+        for collection, buckets in self._buckets.items():
+            bucket_documents = []
+            for bucket_key, (bucket_filter, bucket_update_data) in list(buckets.items()):
+                if timestamp is None or await is_bucket_before(bucket_filter, day_id, hour_id):
+                    bucket_documents.append(await get_bucket_document(bucket_filter, bucket_update_data))
+                    del buckets[bucket_key]
+            if bucket_documents:
+                await db[collection_names[collection]].insert_many(bucket_documents, ordered=False)
+
+
+async def upsert_interval_data(db: AsyncDatabase, collection: str, bucket_filter: dict, update_data: dict,
+                               interval_updates: IntervalUpdates | None = None):
+    if interval_updates is not None:
+        await interval_updates.add(collection, bucket_filter, update_data)
+    else:
+        await db[collection].update_one(bucket_filter, await serialize_update_data(update_data), upsert=True)
+
+
+async def update_factory_day_data(db: AsyncDatabase, factory_record: dict, timestamp: str,
+                            amount_total_ETH_tracked: Decimal = ZERO_DECIMAL,
+                            amount_total_USD_tracked: Decimal = ZERO_DECIMAL,
+                            fees_USD: Decimal = ZERO_DECIMAL,
+                            interval_updates: IntervalUpdates | None = None):
     day_id, day_start = await get_day_id(timestamp)
 
-    factory_day_data_record = db[Collection.FACTORIES_DAY_DATA].find_one({'dayId': day_id})
-    if not factory_day_data_record:
-        factory_day_data_record = {
-            'dayId': day_id,
+    factory_day_data_update = {
+        '$setOnInsert': {
             'date': day_start,
-            'volumeETH': ZERO_DECIMAL128,
-            'volumeUSD': ZERO_DECIMAL128,
-            'feesUSD': ZERO_DECIMAL128,
-            'txCount': 0,
-        }
-    factory_day_data_record['totalValueLockedUSD'] = factory_record['totalValueLockedUSD']
-    factory_day_data_record['txCount'] += 1
-    factory_day_data_record['volumeETH'] = Decimal128(factory_day_data_record['volumeETH'].to_decimal() + amount_total_ETH_tracked)
-    factory_day_data_record['volumeUSD'] = Decimal128(factory_day_data_record['volumeUSD'].to_decimal() + amount_total_USD_tracked)
-    factory_day_data_record['feesUSD'] = Decimal128(factory_day_data_record['feesUSD'].to_decimal() + fees_USD)
-
-    update_request = UpdateOne({
-        'dayId': day_id
-        }, {
-            '$set': factory_day_data_record
-        }, upsert=True)
-    db[Collection.FACTORIES_DAY_DATA].bulk_write([update_request])
-    return factory_day_data_record
-
-
-async def update_factory_hour_data(db: Database, factory_record: dict, timestamp: str, 
-                                   amount_total_ETH_tracked: Decimal = ZERO_DECIMAL, 
-                                   amount_total_USD_tracked: Decimal = ZERO_DECIMAL, 
-                                   fees_USD: Decimal = ZERO_DECIMAL):
+        },
+        '$set': {
+            'totalValueLockedUSD': factory_record['totalValueLockedUSD'],
+        },
+        '$inc': {
+            'txCount': 1,
+            'volumeETH': amount_total_ETH_tracked,
+            'volumeUSD': amount_total_USD_tracked,
+            'feesUSD': fees_USD,
+        },
+    }
+    await upsert_interval_data(db, Collection.FACTORIES_DAY_DATA, {'dayId': day_id}, factory_day_data_update,
+                               interval_updates)
+
+
+async def update_factory_hour_data(db: AsyncDatabase, factory_record: dict, timestamp: str,
+                                   amount_total_ETH_tracked: Decimal = ZERO_DECIMAL,
+                                   amount_total_USD_tracked: Decimal = ZERO_DECIMAL,
+                                   fees_USD: Decimal = ZERO_DECIMAL,
+                                   interval_updates: IntervalUpdates | None = None):
     hour_id, hour_start = await get_hour_id(timestamp)
 
-    factory_hour_data_record = db[Collection.FACTORIES_HOUR_DATA].find_one({'hourId': hour_id})
-    if not factory_hour_data_record:
-        factory_hour_data_record = {
-            'hourId': hour_id,
+    factory_hour_data_update = {
+        '$setOnInsert': {
             'periodStartUnix': hour_start,
-            'volumeETH': ZERO_DECIMAL128,
-            'volumeUSD': ZERO_DECIMAL128,
-            'feesUSD': ZERO_DECIMAL128,
-            'txCount': 0,
-        }
-    factory_hour_data_record['totalValueLockedUSD'] = factory_record['totalValueLockedUSD']
-    factory_hour_data_record['txCount'] += 1
-    factory_hour_data_record['volumeETH'] = Decimal128(factory_hour_data_record['volumeETH'].to_decimal() + amount_total_ETH_tracked)
-    factory_hour_data_record['volumeUSD'] = Decimal128(factory_hour_data_record['volumeUSD'].to_decimal() + amount_total_USD_tracked)
-    factory_hour_data_record['feesUSD'] = Decimal128(factory_hour_data_record['feesUSD'].to_decimal() + fees_USD)
-
-    update_request = UpdateOne({
-        'hourId': hour_id
-        }, {
-            '$set': factory_hour_data_record
-        }, upsert=True)
-    db[Collection.FACTORIES_HOUR_DATA].bulk_write([update_request])
-    return factory_hour_data_record
-
-
-async def update_pool_day_data(db: Database, pool_record: dict, timestamp: str, 
-                         amount_total_USD_tracked: Decimal = ZERO_DECIMAL, 
-                         amount0_abs: Decimal = ZERO_DECIMAL, 
-                         amount1_abs: Decimal = ZERO_DECIMAL, 
-                         fees_USD: Decimal = ZERO_DECIMAL):
-    day_id, day_start = await get_day_id(timestamp)
-
-    pool_day_data_record = db[Collection.POOLS_DAY_DATA].find_one({
-        'poolAddress': pool_record['poolAddress'],
-        'dayId': day_id,
-    })
-    if not pool_day_data_record:
-        pool_day_data_record = {
-            'dayId': day_id,
-            'date': day_start,
-            'poolAddress': pool_record['poolAddress'],
-            'volumeToken0': ZERO_DECIMAL128,
-            'volumeToken1': ZERO_DECIMAL128,
-            'volumeUSD': ZERO_DECIMAL128,
-            'feesUSD': ZERO_DECIMAL128,
-            'txCount': 0,
+        },
+        '$set': {
+            'totalValueLockedUSD': factory_record['totalValueLockedUSD'],
+        },
+        '$inc': {
+            'txCount': 1,
+            'volumeETH': amount_total_ETH_tracked,
+            'volumeUSD': amount_total_USD_tracked,
+            'feesUSD': fees_USD,
+        },
+    }
+    await upsert_interval_data(db, Collection.FACTORIES_HOUR_DATA, {'hourId': hour_id}, factory_hour_data_update,
+                               interval_updates)
+
+
+async def get_pool_interval_update_data(pool_record: dict, amount_total_USD_tracked: Decimal, amount0_abs: Decimal,
+                                        amount1_abs: Decimal, fees_USD: Decimal) -> dict:
+    return {
+        '$setOnInsert': {
             'open': pool_record['token0Price'],
+        },
+        '$max': {
             'high': pool_record['token0Price'],
-            'low': pool_record['token0Price']
-        }
+        },
+        '$min': {
+            'low': pool_record['token0Price'],
+        },
+        '$set': {
+            'liquidity': pool_record['liquidity'],
+            'sqrtPriceX96': pool_record['sqrtPriceX96'],
+            'feeGrowthGlobal0X128': pool_record['feeGrowthGlobal0X128'],
+            'feeGrowthGlobal1X128': pool_record['feeGrowthGlobal1X128'],
+            'token0Price': pool_record['token0Price'],
+            'token1Price': pool_record['token1Price'],
+            'tick': pool_record['tick'],
+            'totalValueLockedUSD': pool_record['totalValueLockedUSD'],
+            'close': pool_record['token0Price'],
+        },
+        '$inc': {
+            'txCount': 1,
+            'volumeUSD': amount_total_USD_tracked,
+            'volumeToken0': amount0_abs,
+            'volumeToken1': amount1_abs,
+            'feesUSD': fees_USD,
+        },
+    }
+
+
+async def update_pool_day_data(db: AsyncDatabase, pool_record: dict, timestamp: str,
+                         amount_total_USD_tracked: Decimal = ZERO_DECIMAL,
+                         amount0_abs: Decimal = ZERO_DECIMAL,
+                         amount1_abs: Decimal = ZERO_DECIMAL,
+                         fees_USD: Decimal = ZERO_DECIMAL,
+                         interval_updates: IntervalUpdates | None = None):
+    day_id, day_start = await get_day_id(timestamp)
+
+    pool_day_data_update = await get_pool_interval_update_data(pool_record, amount_total_USD_tracked, amount0_abs,
+                                                               amount1_abs, fees_USD)
+    pool_day_data_update['$setOnInsert']['date'] = day_start
 
-    if pool_record['token0Price'].to_decimal() > pool_day_data_record['high'].to_decimal():
-        pool_day_data_record['high'] = pool_record['token0Price']
-
-    if pool_record['token0Price'].to_decimal() < pool_day_data_record['low'].to_decimal():
-        pool_day_data_record['low'] = pool_record['token0Price']
-
-    pool_day_data_record['liquidity'] = pool_record['liquidity']
-    pool_day_data_record['sqrtPriceX96'] = pool_record['sqrtPriceX96']
-    pool_day_data_record['feeGrowthGlobal0X128'] = pool_record['feeGrowthGlobal0X128']
-    pool_day_data_record['feeGrowthGlobal1X128'] = pool_record['feeGrowthGlobal1X128']
-    pool_day_data_record['token0Price'] = pool_record['token0Price']
-    pool_day_data_record['token1Price'] = pool_record['token1Price']
-    pool_day_data_record['tick'] = pool_record['tick']
-    pool_day_data_record['totalValueLockedUSD'] = pool_record['totalValueLockedUSD']
-    pool_day_data_record['txCount'] += 1
-    pool_day_data_record['close'] = pool_record['token0Price']
-    pool_day_data_record['volumeUSD'] = Decimal128(pool_day_data_record['volumeUSD'].to_decimal() + amount_total_USD_tracked)
-    pool_day_data_record['volumeToken0'] = Decimal128(pool_day_data_record['volumeToken0'].to_decimal() + amount0_abs)
-    pool_day_data_record['volumeToken1'] = Decimal128(pool_day_data_record['volumeToken1'].to_decimal() + amount1_abs)
-    pool_day_data_record['feesUSD'] = Decimal128(pool_day_data_record['feesUSD'].to_decimal() + fees_USD)
-
-    update_request = UpdateOne({
+    pool_day_data_filter = {
         'poolAddress': pool_record['poolAddress'],
         'dayId': day_id,
-        }, {
-            '$set': pool_day_data_record,
-        }, upsert=True)
-    db[Collection.POOLS_DAY_DATA].bulk_write([update_request])
-    return pool_day_data_record
-  
-
-async def update_pool_hour_data(db: Database, pool_record: dict, timestamp: str, 
-                          amount_total_USD_tracked: Decimal = ZERO_DECIMAL, 
-                          amount0_abs: Decimal = ZERO_DECIMAL, 
-                          amount1_abs: Decimal = ZERO_DECIMAL, 
-                          fees_USD: Decimal = ZERO_DECIMAL):
+    }
+    await upsert_interval_data(db, Collection.POOLS_DAY_DATA, pool_day_data_filter, pool_day_data_update,
+                               interval_updates)
+
+
+async def update_pool_hour_data(db: AsyncDatabase, pool_record: dict, timestamp: str,
+                          amount_total_USD_tracked: Decimal = ZERO_DECIMAL,
+                          amount0_abs: Decimal = ZERO_DECIMAL,
+                          amount1_abs: Decimal = ZERO_DECIMAL,
+                          fees_USD: Decimal = ZERO_DECIMAL,
+                          interval_updates: IntervalUpdates | None = None):
     hour_id, hour_start = await get_hour_id(timestamp)
 
-    pool_hour_data_record = db[Collection.POOLS_HOUR_DATA].find_one({
-        'poolAddress': pool_record['poolAddress'],
-        'hourId': hour_id,
-    })
-    if not pool_hour_data_record:
-        pool_hour_data_record = {
-            'hourId': hour_id,
-            'periodStartUnix': hour_start,
-            'poolAddress': pool_record['poolAddress'],
-            'volumeToken0': ZERO_DECIMAL128,
-            'volumeToken1': ZERO_DECIMAL128,
-            'volumeUSD': ZERO_DECIMAL128,
-            'feesUSD': ZERO_DECIMAL128,
-            'txCount': 0,
-            'open': pool_record['token0Price'],
-            'high': pool_record['token0Price'],
-            'low': pool_record['token0Price']
-        }
+    pool_hour_data_update = await get_pool_interval_update_data(pool_record, amount_total_USD_tracked, amount0_abs,
+                                                                amount1_abs, fees_USD)
+    pool_hour_data_update['$setOnInsert']['periodStartUnix'] = hour_start
 
-    if pool_record['token0Price'].to_decimal() > pool_hour_data_record['high'].to_decimal():
-        pool_hour_data_record['high'] = pool_record['token0Price']
-
-    if pool_record['token0Price'].to_decimal() < pool_hour_data_record['low'].to_decimal():
-        pool_hour_data_record['low'] = pool_record['token0Price']
-
-    pool_hour_data_record['liquidity'] = pool_record['liquidity']
-    pool_hour_data_record['sqrtPriceX96'] = pool_record['sqrtPriceX96']
-    pool_hour_data_record['feeGrowthGlobal0X128'] = pool_record['feeGrowthGlobal0X128']
-    pool_hour_data_record['feeGrowthGlobal1X128'] = pool_record['feeGrowthGlobal1X128']
-    pool_hour_data_record['token0Price'] = pool_record['token0Price']
-    pool_hour_data_record['token1Price'] = pool_record['token1Price']
-    pool_hour_data_record['tick'] = pool_record['tick']
-    pool_hour_data_record['totalValueLockedUSD'] = pool_record['totalValueLockedUSD']
-    pool_hour_data_record['txCount'] += 1
-    pool_hour_data_record['close'] = pool_record['token0Price']
-    pool_hour_data_record['volumeUSD'] = Decimal128(pool_hour_data_record['volumeUSD'].to_decimal() + amount_total_USD_tracked)
-    pool_hour_data_record['volumeToken0'] = Decimal128(pool_hour_data_record['volumeToken0'].to_decimal() + amount0_abs)
-    pool_hour_data_record['volumeToken1'] = Decimal128(pool_hour_data_record['volumeToken1'].to_decimal() + amount1_abs)
-    pool_hour_data_record['feesUSD'] = Decimal128(pool_hour_data_record['feesUSD'].to_decimal() + fees_USD)
-
-    update_request = UpdateOne({
+    pool_hour_data_filter = {
         'poolAddress': pool_record['poolAddress'],
         'hourId': hour_id,
-        }, {
-            '$set': pool_hour_data_record,
-        }, upsert=True)
-    db[Collection.POOLS_HOUR_DATA].bulk_write([update_request])
-    return pool_hour_data_record
-
-
-async def update_token_day_data(db: Database, token_record: dict, timestamp: str, 
-                          amount_total_USD_tracked: Decimal = ZERO_DECIMAL, 
-                          amount_abs: Decimal = ZERO_DECIMAL, 
-                          fees_USD: Decimal = ZERO_DECIMAL):
+    }
+    await upsert_interval_data(db, Collection.POOLS_HOUR_DATA, pool_hour_data_filter, pool_hour_data_update,
+                               interval_updates)
+
+
+async def get_token_interval_update_data(token_record: dict, eth_price: Decimal, amount_total_USD_tracked: Decimal,
+                                         amount_abs: Decimal, fees_USD: Decimal) -> dict:
+    token_price = token_record['derivedETH'] * eth_price
+    return {
+        '$setOnInsert': {
+            'open': token_price,
+        },
+        '$max': {
+            'high': token_price,
+        },
+        '$min': {
+            'low': token_price,
+        },
+        '$set': {
+            'close': token_price,
+            'priceUSD': token_price,
+            'totalValueLocked': token_record['totalValueLocked'],
+            'totalValueLockedUSD': token_record['totalValueLockedUSD'],
+            'derivedETH': token_record['derivedETH'],
+        },
+        '$inc': {
+            'txCount': 1,
+            'volume': amount_abs,
+            'volumeUSD': amount_total_USD_tracked,
+            'untrackedVolumeUSD': amount_total_USD_tracked,
+            'feesUSD': fees_USD,
+        },
+    }
+
+
+async def update_token_day_data(db: AsyncDatabase, token_record: dict, timestamp: str, eth_price: Decimal,
+                          amount_total_USD_tracked: Decimal = ZERO_DECIMAL,
+                          amount_abs: Decimal = ZERO_DECIMAL,
+                          fees_USD: Decimal = ZERO_DECIMAL,
+                          interval_updates: IntervalUpdates | None = None):
     day_id, day_start = await get_day_id(timestamp)
-    eth_price = await EthPrice.get()
-    token_price = token_record['derivedETH'].to_decimal() * eth_price
-
-    token_day_data_record = db[Collection.TOKENS_DAY_DATA].find_one({
-        'tokenAddress': token_record['tokenAddress'],
-        'dayId': day_id,
-    })
-    if not token_day_data_record:
-        token_day_data_record = {
-            'dayId': day_id,
-            'date': day_start,
-            'tokenAddress': token_record['tokenAddress'],
-            'volume': ZERO_DECIMAL128,
-            'volumeUSD': ZERO_DECIMAL128,
-            'feesUSD': ZERO_DECIMAL128,
-            'untrackedVolumeUSD': ZERO_DECIMAL128,
-            'txCount': 0,
-            'open': Decimal128(token_price),
-            'high': Decimal128(token_price),
-            'low': Decimal128(token_price)
-        }
-
-    if token_price > token_day_data_record['high'].to_decimal():
-        token_day_data_record['high'] = Decimal128(token_price)
 
-    if token_price < token_day_data_record['low'].to_decimal():
-        token_day_data_record['low'] = Decimal128(token_price)
+    token_day_data_update = await get_token_interval_update_data(token_record, eth_price, amount_total_USD_tracked,
+                                                                 amount_abs, fees_USD)
+    token_day_data_update['$setOnInsert']['date'] = day_start
 
-    token_day_data_record['close'] = Decimal128(token_price)
-    token_day_data_record['priceUSD'] = Decimal128(token_price)
-    token_day_data_record['totalValueLocked'] = token_record['totalValueLocked']
-    token_day_data_record['totalValueLockedUSD'] = token_record['totalValueLockedUSD']
-    token_day_data_record['derivedETH'] = token_record['derivedETH']
-    token_day_data_record['volume'] = Decimal128(token_day_data_record['volume'].to_decimal() + amount_abs)
-    token_day_data_record['volumeUSD'] = Decimal128(token_day_data_record['volumeUSD'].to_decimal() + amount_total_USD_tracked)
-    token_day_data_record['untrackedVolumeUSD'] = Decimal128(token_day_data_record['untrackedVolumeUSD'].to_decimal() + amount_total_USD_tracked)
-    token_day_data_record['feesUSD'] = Decimal128(token_day_data_record['feesUSD'].to_decimal() + fees_USD)
-    token_day_data_record['txCount'] += 1
-
-    update_request = UpdateOne({
+    token_day_data_filter = {
         'tokenAddress': token_record['tokenAddress'],
         'dayId': day_id,
-        }, {
-            '$set': token_day_data_record
-        }, upsert=True)
-    db[Collection.TOKENS_DAY_DATA].bulk_write([update_request])
-    return token_day_data_record
+    }
+    await upsert_interval_data(db, Collection.TOKENS_DAY_DATA, token_day_data_filter, token_day_data_update,
+                               interval_updates)
 
 
-async def update_token_hour_data(db: Database, token_record: dict, timestamp: str, 
-                           amount_total_USD_tracked: Decimal = ZERO_DECIMAL, 
-                           amount_abs: Decimal = ZERO_DECIMAL, 
-                           fees_USD: Decimal = ZERO_DECIMAL):
+async def update_token_hour_data(db: AsyncDatabase, token_record: dict, timestamp: str, eth_price: Decimal,
+                           amount_total_USD_tracked: Decimal = ZERO_DECIMAL,
+                           amount_abs: Decimal = ZERO_DECIMAL,
+                           fees_USD: Decimal = ZERO_DECIMAL,
+                           interval_updates: IntervalUpdates | None = None):
     hour_id, hour_start = await get_hour_id(timestamp)
-    eth_price = await EthPrice.get()
-    token_price = token_record['derivedETH'].to_decimal() * eth_price
-
-    token_hour_data_record = db[Collection.TOKENS_HOUR_DATA].find_one({
-        'tokenAddress': token_record['tokenAddress'],
-        'hourId': hour_id,
-    })
-    if not token_hour_data_record:
-        token_hour_data_record = {
-            'hourId': hour_id,
-            'periodStartUnix': hour_start,
-            'tokenAddress': token_record['tokenAddress'],
-            'volume': ZERO_DECIMAL128,
-            'volumeUSD': ZERO_DECIMAL128,
-            'feesUSD': ZERO_DECIMAL128,
-            'untrackedVolumeUSD': ZERO_DECIMAL128,
-            'txCount': 0,
-            'open': Decimal128(token_price),
-            'high': Decimal128(token_price),
-            'low': Decimal128(token_price),
-        }
-
-    if token_price > token_hour_data_record['high'].to_decimal():
-        token_hour_data_record['high'] = Decimal128(token_price)
-
-    if token_price < token_hour_data_record['low'].to_decimal():
-        token_hour_data_record['low'] = Decimal128(token_price)
 
-    token_hour_data_record['close'] = Decimal128(token_price)
-    token_hour_data_record['priceUSD'] = Decimal128(token_price)
-    token_hour_data_record['totalValueLocked'] = token_record['totalValueLocked']
-    token_hour_data_record['totalValueLockedUSD'] = token_record['totalValueLockedUSD']
-    token_hour_data_record['derivedETH'] = token_record['derivedETH']
-    token_hour_data_record['volume'] = Decimal128(token_hour_data_record['volume'].to_decimal() + amount_abs)
-    token_hour_data_record['volumeUSD'] = Decimal128(token_hour_data_record['volumeUSD'].to_decimal() + amount_total_USD_tracked)
-    token_hour_data_record['untrackedVolumeUSD'] = Decimal128(token_hour_data_record['untrackedVolumeUSD'].to_decimal() + amount_total_USD_tracked)
-    token_hour_data_record['feesUSD'] = Decimal128(token_hour_data_record['feesUSD'].to_decimal() + fees_USD)
-    token_hour_data_record['txCount'] += 1
+    token_hour_data_update = await get_token_interval_update_data(token_record, eth_price, amount_total_USD_tracked,
+                                                                  amount_abs, fees_USD)
+    token_hour_data_update['$setOnInsert']['periodStartUnix'] = hour_start
 
-    update_request = UpdateOne({
+    token_hour_data_filter = {
         'tokenAddress': token_record['tokenAddress'],
         'hourId': hour_id,
-        }, {
-            '$set': token_hour_data_record
-        }, upsert=True)
-    db[Collection.TOKENS_HOUR_DATA].bulk_write([update_request])
-    return token_hour_data_record
+    }
+    await upsert_interval_data(db, Collection.TOKENS_HOUR_DATA, token_hour_data_filter, token_hour_data_update,
+                               interval_updates)
@@ -0,0 +1,195 @@
+import asyncio
+import os
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.errors import DuplicateKeyError
+
+from server.const import Collection, Transformer, LEADERBOARD_LEASE_TTL, TIME_INTERVAL
+
+from structlog import get_logger
+
+
+logger = get_logger(__name__)
+
+
+class RunStatus:
+    RUNNING = 'running'
+    FINISHED = 'finished'
+
+
+async def create_leaderboard_runs_index(db: AsyncDatabase):
+    await db[Collection.LEADERBOARD_RUNS].create_index([('status', ASCENDING), ('startedAt', DESCENDING)])
+
+
+async def acquire_lease(db: AsyncDatabase, owner: str) -> bool:
+    # the lease is taken when it is free, expired or already held by the owner, an upsert over a lease held by
+    # another owner fails on the _id
+    now = datetime.now(timezone.utc)
+    query = {
+        '_id': Transformer.LEADERBOARD,
+        '$or': [
+            {'lease': None},
+            {'lease.expiresAt': {'$lte': now}},
+            {'lease.owner': owner},
+        ]
+    }
+    lease = {
+        'owner': owner,
+        'expiresAt': now + timedelta(seconds=LEADERBOARD_LEASE_TTL),
+    }
+    try:
+        await db[Collection.TRANSFORMER_PROGRESS].update_one(query, {'$set': {'lease': lease}}, upsert=True)
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+async def renew_lease(db: AsyncDatabase, owner: str) -> bool:
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=LEADERBOARD_LEASE_TTL)
+    result = await db[Collection.TRANSFORMER_PROGRESS].update_one(
+        {'_id': Transformer.LEADERBOARD, 'lease.owner': owner}, {'$set': {'lease.expiresAt': expires_at}})
+    return result.matched_count > 0
+
+
+async def release_lease(db: AsyncDatabase, owner: str):
+    await db[Collection.TRANSFORMER_PROGRESS].update_one(
+        {'_id': Transformer.LEADERBOARD, 'lease.owner': owner}, {'$unset': {'lease': ''}})
+
+
+async def get_interrupted_run(db: AsyncDatabase) -> dict | None:
+    # with the lease held, a run still marked as running was stopped before its last phase
+    return await db[Collection.LEADERBOARD_RUNS].find_one({'status': RunStatus.RUNNING},
+                                                          sort=[('startedAt', DESCENDING)])
+
+
+async def start_run(db: AsyncDatabase, owner: str) -> dict:
+    interrupted_run = await get_interrupted_run(db)
+    if interrupted_run is not None:
+        logger.info(f'Resuming leaderboard run {interrupted_run["_id"]}')
+        await db[Collection.LEADERBOARD_RUNS].update_one(
+            {'_id': interrupted_run['_id']}, {'$set': {'owner': owner}, '$inc': {'attempts': 1}})
+        return interrupted_run
+    run_record = {
+        '_id': ObjectId(),
+        'owner': owner,
+        'status': RunStatus.RUNNING,
+        'startedAt': datetime.now(timezone.utc),
+        'attempts': 1,
+        'phases': {},
+    }
+    await db[Collection.LEADERBOARD_RUNS].insert_one(run_record)
+    return run_record
+
+
+async def finish_run(db: AsyncDatabase, run_record: dict):
+    finished_at = datetime.now(timezone.utc)
+    started_at = run_record['startedAt'].replace(tzinfo=timezone.utc)
+    await db[Collection.LEADERBOARD_RUNS].update_one({'_id': run_record['_id']}, {'$set': {
+        'status': RunStatus.FINISHED,
+        'finishedAt': finished_at,
+        'durationSeconds': (finished_at - started_at).total_seconds(),
+    }})
+
+
+# A phase of a run, its checkpoint is saved on the run record so an interrupted phase resumes after it
+class RunPhase:
+    def __init__(self, db: AsyncDatabase, run_id: ObjectId, name: str, phase_record: dict):
+        self.db = db
+        self.run_id = run_id
+        self.name = name
+        self.checkpoint = phase_record.get('checkpoint')
+
+    async def update(self, fields: dict):
+        await self.db[Collection.LEADERBOARD_RUNS].update_one(
+            {'_id': self.run_id}, {'$set': {f'phases.{self.name}.{field}': value for field, value in fields.items()}})
+
+    async def save_checkpoint(self, checkpoint: Any):
+        self.checkpoint = checkpoint
+        await self.update({'checkpoint': checkpoint})
+
+
+async def run_phase(db: AsyncDatabase, run_record: dict, name: str, phase_func: Callable[[RunPhase], Awaitable]):
+    phase_record = run_record['phases'].get(name, {})
+    if phase_record.get('finishedAt') is not None:
+        return
+    phase = RunPhase(db, run_record['_id'], name, phase_record)
+    # the time spent in the earlier attempts of an interrupted phase is kept
+    previous_duration = phase_record.get('durationSeconds', 0)
+    started_at = time.monotonic()
+    await phase.update({'startedAt': phase_record.get('startedAt', datetime.now(timezone.utc))})
+    try:
+        await phase_func(phase)
+    finally:
+        duration = previous_duration + time.monotonic() - started_at
+        await phase.update({'durationSeconds': duration})
+    await phase.update({'finishedAt': datetime.now(timezone.utc)})
+    logger.info(f'Leaderboard phase {name} finished in {duration:.1f}s')
+
+
+# Runs the leaderboard phases one run at a time. A run holds a lease in the transformer_progress collection,
+# renewed every third of LEADERBOARD_LEASE_TTL, so runs of other processes do not overlap with it. Triggers
+# received during a run are coalesced into one run started after it, and when the lease is held elsewhere
+# the trigger waits for it. Finished phases are recorded on the run record in the leaderboard_runs collection
+# together with their timings, an interrupted run skips them when it is resumed
+class LeaderboardRunCoordinator:
+    def __init__(self, db: AsyncDatabase, phases: list[tuple[str, Callable[[RunPhase], Awaitable]]]):
+        self.db = db
+        self.phases = phases
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{ObjectId()}'
+        self._task = None
+        self._pending = False
+
+    def trigger(self):
+        self._pending = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run_pending())
+
+    async def _run_pending(self):
+        while self._pending:
+            if not await acquire_lease(self.db, self.owner):
+                logger.info('Leaderboard run is held by another process, waiting for its lease')
+                await asyncio.sleep(TIME_INTERVAL)
+                continue
+            self._pending = False
+            try:
+                await self._run()
+            except Exception:
+                logger.exception('Leaderboard run failed, it will be resumed by the next trigger')
+            finally:
+                await release_lease(self.db, self.owner)
+
+    async def _keep_lease(self, run_task: asyncio.Task):
+        while True:
+            await asyncio.sleep(LEADERBOARD_LEASE_TTL / 3)
+            if not await renew_lease(self.db, self.owner):
+                logger.warning('Leaderboard run lost its lease, stopping it')
+                run_task.cancel()
+                return
+
+    async def _run_phases(self):
+        logger.info('Leaderboard transformer started...')
+        run_record = await start_run(self.db, self.owner)
+        for name, phase_func in self.phases:
+            await run_phase(self.db, run_record, name, phase_func)
+        await finish_run(self.db, run_record)
+
+    async def _run(self):
+        run_task = asyncio.ensure_future(self._run_phases())
+        lease_task = asyncio.ensure_future(self._keep_lease(run_task))
+        try:
+            await run_task
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise
+        finally:
+            lease_task.cancel()
+
+    async def resume_interrupted_run(self):
+        if await get_interrupted_run(self.db) is not None:
+            self.trigger()
@@ -1,14 +1,19 @@
 import asyncio
+import random
 from datetime import datetime, timedelta, timezone
 from decimal import Decimal
 
-from bson import Decimal128
-from pymongo import MongoClient, UpdateOne, ASCENDING
-from pymongo.database import Database
+from bson import Decimal128, ObjectId
+from pymongo import AsyncMongoClient, UpdateOne, ASCENDING
+from pymongo.asynchronous.client_session import AsyncClientSession
+from pymongo.asynchronous.database import AsyncDatabase
 import pytz
 import schedule
 
-from server.const import Collection, ZERO_DECIMAL128, ZERO_DECIMAL
+from server.const import (
+    Collection, ZERO_DECIMAL128, ZERO_DECIMAL, MONGO_MAX_POOL_SIZE, FEES_VERIFICATION_RATE, LEADERBOARD_CONCURRENCY,
+    LEADERBOARD_BULK_WRITE_SIZE,
+)
 from server.graphql.resolvers.helpers import convert_timestamp_to_datetime
 from server.transform.lp_contest_updates import (
     insert_lp_leaderboard_snapshot,
@@ -18,6 +23,13 @@ from server.transform.lp_contest_updates import (
     simulate_collect_tx,
 )
 from server.query_utils import get_position_record, get_teahouse_position_record, simple_call
+from server.rpc_client import RpcClients
+from server.utils import DECIMAL128_CONTEXT, to_decimal128
+from server.transform.block_times import create_block_times_index
+from server.transform.leaderboard_runs import LeaderboardRunCoordinator, RunPhase, create_leaderboard_runs_index
+from server.transform.pipeline import BatchWriter, bulk_write_operations, run_in_transaction
+from server.transform.price_history import create_price_history_indexes
+from server.transform.fee_engine import create_fee_state_indexes, get_position_uncollected_fees
 
 from structlog import get_logger
 
@@ -42,11 +54,16 @@ class NftPosition:
         pass 
 
     @staticmethod
-    async def update_position(db: Database, position_record: dict, position_update_data: dict):
+    async def get_position_key(record: dict):
+        pass
+
+    @staticmethod
+    async def get_position_query(position_record: dict) -> dict:
         pass
 
     @staticmethod
-    async def get_uncollected_fees(rpc_url: str, position_record: dict, block: int) -> tuple[Decimal, Decimal]:
+    async def get_uncollected_fees(db: AsyncDatabase, rpc_url: str, position_record: dict,
+                                   block: int) -> tuple[Decimal, Decimal]:
         pass
 
 
@@ -70,13 +87,27 @@ class JediSwapPosition(NftPosition):
         return await get_position_record(db, record['positionId'])
 
     @staticmethod
-    async def update_position(db: Database, position_record: dict, position_update_data: dict):
-        position_query = {'positionId': position_record['positionId']}
-        db[JediSwapPosition.collection].update_one(position_query, position_update_data)
+    async def get_position_key(record: dict):
+        return record['positionId']
+
+    @staticmethod
+    async def get_position_query(position_record: dict) -> dict:
+        return {'positionId': position_record['positionId']}
     
     @staticmethod
-    async def get_uncollected_fees(rpc_url: str, position_record: dict, block: int) -> tuple[Decimal, Decimal]:
-        return await simulate_collect_tx(rpc_url, position_record, block)
+    async def get_uncollected_fees(db: AsyncDatabase, rpc_url: str, position_record: dict,
+                                   block: int) -> tuple[Decimal, Decimal]:
+        # computed from the fee state stored by the transformers, the collect simulation is kept for the positions
+        # without a chain of fee checkpoints and to verify a share of the computed fees
+        fees = await get_position_uncollected_fees(db, position_record, block)
+        if fees is None:
+            return await simulate_collect_tx(rpc_url, position_record, block)
+        if random.random() < FEES_VERIFICATION_RATE:
+            simulated_fees = await simulate_collect_tx(rpc_url, position_record, block)
+            if tuple(simulated_fees) != fees:
+                logger.warning('Position fees differ from the collect simulation', positionId=position_record['positionId'],
+                               block=block, fees=fees, simulated_fees=simulated_fees)
+        return fees
 
 
 class TeahousePosition(NftPosition):
@@ -104,14 +135,18 @@ class TeahousePosition(NftPosition):
         return await get_teahouse_position_record(db, record['position'], rpc_url)
 
     @staticmethod
-    async def update_position(db: Database, position_record: dict, position_update_data: dict):
-        position_query = {
+    async def get_position_key(record: dict):
+        return record['position']['poolAddress']
+
+    @staticmethod
+    async def get_position_query(position_record: dict) -> dict:
+        return {
             'poolAddress': position_record['poolAddress'],
         }
-        db[TeahousePosition.collection].update_one(position_query, position_update_data)
 
     @staticmethod
-    async def get_uncollected_fees(rpc_url: str, position_record: dict, block: int) -> tuple[Decimal, Decimal]:
+    async def get_uncollected_fees(db: AsyncDatabase, rpc_url: str, position_record: dict,
+                                   block: int) -> tuple[Decimal, Decimal]:
         try:
             try:
                 result = await simple_call(position_record['vaultAddress'], 'all_position_info', [], rpc_url, block_number=block)
@@ -125,15 +160,18 @@ class TeahousePosition(NftPosition):
             return ZERO_DECIMAL, ZERO_DECIMAL
 
 
-async def yield_position_records(db: Database, collection: str) -> dict:
+async def yield_position_records(db: AsyncDatabase, collection: str, after_id: ObjectId | None = None) -> dict:
     query = {
         'liquidity': {'$ne': ZERO_DECIMAL128},
     }
-    for record in db[collection].find(query):
+    if after_id is not None:
+        query['_id'] = {'$gt': after_id}
+    async for record in db[collection].find(query, sort=[('_id', ASCENDING)]):
         yield record
 
 
-async def handle_positions_for_lp_leaderboard(db: Database, position_class: NftPosition):
+async def handle_positions_for_lp_leaderboard(db: AsyncDatabase, position_class: NftPosition,
+                                              phase: RunPhase | None = None):
     # ensure that the transformer runs after 00:00
     await asyncio.sleep(1)
 
@@ -142,7 +180,10 @@ async def handle_positions_for_lp_leaderboard(db: Database, position_class: NftP
     current_dt = current_dt - timedelta(days=1)
     current_dt = current_dt.replace(hour=23, minute=59, second=59)
     
-    async for position_record in yield_position_records(db, position_class.collection):
+    # the snapshots are inserted again until the points of the position are calculated, a resumed phase continues
+    # after the last handled position
+    after_id = phase.checkpoint if phase is not None else None
+    async for position_record in yield_position_records(db, position_class.collection, after_id):
         last_updated_dt = convert_timestamp_to_datetime(position_record['lastUpdatedTimestamp'])
         last_updated_dt = last_updated_dt.replace(hour=23, minute=59, second=59, microsecond=0, tzinfo=timezone.utc)
 
@@ -154,77 +195,161 @@ async def handle_positions_for_lp_leaderboard(db: Database, position_class: NftP
                 await insert_lp_leaderboard_snapshot(record['event_data'], db, position_record=record['position_record'],
                                                      teahouse=position_class.teahouse)
             processed_positions_records += 1
+        if phase is not None:
+            await phase.save_checkpoint(position_record['_id'])
 
     logger.info(f'Successfully processed {processed_positions_records} {position_class.log_msg}Positions records '
                 f'for the leaderboard contest')
 
 
-async def calculate_lp_leaderboard_user_total_points(db: Database, rpc_url: str, position_class: NftPosition):
+async def apply_position_update(position_record: dict, position_update_data: dict):
+    # the next snapshots of the position are calculated from the updated record before it is written
+    position_record.update(position_update_data['$set'])
+    for field, value in position_update_data['$inc'].items():
+        position_record[field] = to_decimal128(
+            DECIMAL128_CONTEXT.add(position_record.get(field, ZERO_DECIMAL128).to_decimal(), value.to_decimal()))
+
+
+async def calculate_lp_leaderboard_record(db: AsyncDatabase, rpc_url: str, position_class: NftPosition, record: dict,
+                                          latest_position_record: dict) -> dict[str, UpdateOne]:
+    position_record_in_event = record['position']
+
+    current_fees_usd, token0_fees_current, token1_fees_current, token0_price, token1_price = await get_current_position_total_fees_usd(
+        record, latest_position_record, record, db, rpc_url, position_class.get_uncollected_fees)
+    if current_fees_usd < ZERO_DECIMAL:
+        current_fees_usd = ZERO_DECIMAL
+
+    last_time_vested_value, current_time_vested_value, period = await get_time_vested_value(
+        record, position_record_in_event, latest_position_record)
+
+    pool_boost = await get_pool_boost(latest_position_record['token0Address'], latest_position_record['token1Address'])
+
+    points = current_fees_usd * last_time_vested_value * pool_boost * Decimal(1000)
+
+    position_update_data = dict()
+    position_update_data['$set'] = dict()
+    position_update_data['$inc'] = dict()
+    position_update_data['$set']['lastUnclaimedFeesToken0'] = Decimal128(token0_fees_current)
+    position_update_data['$set']['lastUnclaimedFeesToken1'] = Decimal128(token1_fees_current)
+    position_update_data['$set']['timeVestedValue'] = Decimal128(current_time_vested_value)
+    position_update_data['$set']['lastUpdatedTimestamp'] = record['timestamp']
+    position_update_data['$inc']['lpPoints'] = Decimal128(points)
+
+    lp_contest_snapshot_data = dict()
+    lp_contest_snapshot_data['$set'] = dict()
+    lp_contest_snapshot_data['$set']['currentFeesUsd'] = Decimal128(current_fees_usd)
+    lp_contest_snapshot_data['$set']['lastUnclaimedFeesToken0'] = latest_position_record['lastUnclaimedFeesToken0']
+    lp_contest_snapshot_data['$set']['lastUnclaimedFeesToken1'] = latest_position_record['lastUnclaimedFeesToken1']
+    lp_contest_snapshot_data['$set']['currentUnclaimedFeesToken0'] = Decimal128(token0_fees_current)
+    lp_contest_snapshot_data['$set']['currentUnclaimedFeesToken1'] = Decimal128(token1_fees_current)
+    lp_contest_snapshot_data['$set']['token0Price'] = Decimal128(token0_price)
+    lp_contest_snapshot_data['$set']['token1Price'] = Decimal128(token1_price)
+    lp_contest_snapshot_data['$set']['lastTimeVestedValue'] = Decimal128(last_time_vested_value)
+    lp_contest_snapshot_data['$set']['currentTimeVestedValue'] = Decimal128(current_time_vested_value)
+    lp_contest_snapshot_data['$set']['period'] = period
+    lp_contest_snapshot_data['$set']['poolBoost'] = Decimal128(pool_boost)
+    lp_contest_snapshot_data['$set']['lpPoints'] = Decimal128(points)
+    lp_contest_snapshot_data['$set']['processed'] = True
+
+    lp_contest_snapshot_query = {'_id': record['_id']}
+
+    lp_contest_data = dict()
+    lp_contest_data['$inc'] = dict()
+    lp_contest_data['$inc']['points'] = Decimal128(points)
+
+    lp_contest_query = {'userAddress': latest_position_record[position_class.lp_contest_user_key]}
+
+    record_operations = {
+        position_class.collection: UpdateOne(await position_class.get_position_query(latest_position_record),
+                                             position_update_data),
+        Collection.LP_LEADERBOARD_SNAPSHOT: UpdateOne(lp_contest_snapshot_query, lp_contest_snapshot_data),
+        Collection.LP_LEADERBOARD: UpdateOne(lp_contest_query, lp_contest_data, upsert=True),
+    }
+    await apply_position_update(latest_position_record, position_update_data)
+    return record_operations
+
+
+async def commit_lp_leaderboard_batch(db: AsyncDatabase, operations: dict[str, list]):
+    # the positions, snapshots and leaderboard updates of the records are written together, an interrupted run
+    # handles the records of the batches not written again
+    async def write_lp_leaderboard_batch(session: AsyncClientSession | None):
+        await bulk_write_operations(db, operations, session)
+
+    await run_in_transaction(db, write_lp_leaderboard_batch)
+
+
+async def get_lp_leaderboard_operations(position_class: NftPosition) -> dict[str, list]:
+    return {
+        position_class.collection: [],
+        Collection.LP_LEADERBOARD_SNAPSHOT: [],
+        Collection.LP_LEADERBOARD: [],
+    }
+
+
+async def calculate_lp_leaderboard_user_total_points(db: AsyncDatabase, rpc_url: str, position_class: NftPosition):
+    # records of different positions are calculated concurrently, the records of a position are calculated one after
+    # another in timestamp order from the position record updated by the previous one. The last task of every
+    # position is kept, a failure is raised by the next tasks of its position and at the end of the run
     processed_lp_records = 0
-    for record in db[Collection.LP_LEADERBOARD_SNAPSHOT].find(position_class.lp_snapshot_query, batch_size=10
-                                                              ).sort('timestamp', ASCENDING):
-        position_record_in_event = record['position']
-        latest_position_record = await position_class.get_latest_position(db=db, record=record, rpc_url=rpc_url)
-
-        current_fees_usd, token0_fees_current, token1_fees_current, token0_price, token1_price = await get_current_position_total_fees_usd(
-            record, latest_position_record, record, db, rpc_url, position_class.get_uncollected_fees)
-        if current_fees_usd < ZERO_DECIMAL:
-            current_fees_usd = ZERO_DECIMAL
-        
-        last_time_vested_value, current_time_vested_value, period = await get_time_vested_value(
-            record, position_record_in_event, latest_position_record)
-
-        pool_boost = await get_pool_boost(latest_position_record['token0Address'], latest_position_record['token1Address'])
-
-        points = current_fees_usd * last_time_vested_value * pool_boost * Decimal(1000)
-
-        position_update_data = dict()
-        position_update_data['$set'] = dict()
-        position_update_data['$inc'] = dict()
-        position_update_data['$set']['lastUnclaimedFeesToken0'] = Decimal128(token0_fees_current)
-        position_update_data['$set']['lastUnclaimedFeesToken1'] = Decimal128(token1_fees_current)
-        position_update_data['$set']['timeVestedValue'] = Decimal128(current_time_vested_value)
-        position_update_data['$set']['lastUpdatedTimestamp'] = record['timestamp']
-        position_update_data['$inc']['lpPoints'] = Decimal128(points)
-
-        await position_class.update_position(db, latest_position_record, position_update_data)
-
-        lp_contest_snapshot_data = dict()
-        lp_contest_snapshot_data['$set'] = dict()
-        lp_contest_snapshot_data['$set']['currentFeesUsd'] = Decimal128(current_fees_usd)
-        lp_contest_snapshot_data['$set']['lastUnclaimedFeesToken0'] = latest_position_record['lastUnclaimedFeesToken0']
-        lp_contest_snapshot_data['$set']['lastUnclaimedFeesToken1'] = latest_position_record['lastUnclaimedFeesToken1']
-        lp_contest_snapshot_data['$set']['currentUnclaimedFeesToken0'] = Decimal128(token0_fees_current)
-        lp_contest_snapshot_data['$set']['currentUnclaimedFeesToken1'] = Decimal128(token1_fees_current)
-        lp_contest_snapshot_data['$set']['token0Price'] = Decimal128(token0_price)
-        lp_contest_snapshot_data['$set']['token1Price'] = Decimal128(token1_price)
-        lp_contest_snapshot_data['$set']['lastTimeVestedValue'] = Decimal128(last_time_vested_value)
-        lp_contest_snapshot_data['$set']['currentTimeVestedValue'] = Decimal128(current_time_vested_value)
-        lp_contest_snapshot_data['$set']['period'] = period
-        lp_contest_snapshot_data['$set']['poolBoost'] = Decimal128(pool_boost)
-        lp_contest_snapshot_data['$set']['lpPoints'] = Decimal128(points)
-        lp_contest_snapshot_data['$set']['processed'] = True
-
-        lp_contest_snapshot_query = {'_id': record['_id']}
-        db[Collection.LP_LEADERBOARD_SNAPSHOT].update_one(lp_contest_snapshot_query, lp_contest_snapshot_data)
-
-        lp_contest_data = dict()
-        lp_contest_data['$inc'] = dict()
-        lp_contest_data['$inc']['points'] = Decimal128(points)
-
-        lp_contest_query = {'userAddress': latest_position_record[position_class.lp_contest_user_key]}
-        db[Collection.LP_LEADERBOARD].update_one(lp_contest_query, lp_contest_data, upsert=True)
-
-        processed_lp_records += 1
-        if processed_lp_records % 100 == 0:
-            logger.info(f'Processed {processed_lp_records} records')
+    operations = await get_lp_leaderboard_operations(position_class)
+    position_records = dict()
+    position_tasks = dict()
+    # a record waiting for the previous record of its position holds no calculation slot, the records read ahead
+    # of the calculations are bounded separately
+    semaphore = asyncio.Semaphore(LEADERBOARD_CONCURRENCY)
+    pending_records = asyncio.Semaphore(LEADERBOARD_BULK_WRITE_SIZE)
+
+    async def calculate_position_record(record: dict, position_key, previous_task: asyncio.Task | None):
+        nonlocal processed_lp_records
+        try:
+            if previous_task is not None:
+                await previous_task
+            async with semaphore:
+                latest_position_record = position_records.get(position_key)
+                if latest_position_record is None:
+                    latest_position_record = await position_class.get_latest_position(db=db, record=record,
+                                                                                       rpc_url=rpc_url)
+                    # a position missing from the collection is not updated, it is read again for its next records
+                    if '_id' in latest_position_record:
+                        position_records[position_key] = latest_position_record
+                record_operations = await calculate_lp_leaderboard_record(db, rpc_url, position_class, record,
+                                                                          latest_position_record)
+            # the operations of a record are added to the current batch together, a batch never holds part of them
+            for collection, operation in record_operations.items():
+                operations[collection].append(operation)
+            processed_lp_records += 1
+            if processed_lp_records % 100 == 0:
+                logger.info(f'Processed {processed_lp_records} records')
+        finally:
+            pending_records.release()
+
+    async with BatchWriter(lambda batch_operations: commit_lp_leaderboard_batch(db, batch_operations), 1) as writer:
+        try:
+            async for record in db[Collection.LP_LEADERBOARD_SNAPSHOT].find(position_class.lp_snapshot_query,
+                                                                            batch_size=LEADERBOARD_BULK_WRITE_SIZE
+                                                                            ).sort('timestamp', ASCENDING):
+                await pending_records.acquire()
+                position_key = await position_class.get_position_key(record)
+                position_tasks[position_key] = asyncio.create_task(
+                    calculate_position_record(record, position_key, position_tasks.get(position_key)))
+                if len(operations[Collection.LP_LEADERBOARD_SNAPSHOT]) >= LEADERBOARD_BULK_WRITE_SIZE:
+                    # the tasks keep adding to a new batch while the full one waits for the writer
+                    batch, operations = operations, await get_lp_leaderboard_operations(position_class)
+                    await writer.submit(batch)
+            await asyncio.gather(*position_tasks.values())
+        finally:
+            # a failed or cancelled run stops the calculations still in progress
+            for task in position_tasks.values():
+                task.cancel()
+            await asyncio.gather(*position_tasks.values(), return_exceptions=True)
+        await writer.submit(operations)
 
     logger.info(f'Successfully calculated {processed_lp_records} {position_class.log_msg}user records '
                 f'for the lp leaderboard contest')
 
 
-async def insert_volume_leaderboard_snapshot(db: Database, fess_usd: Decimal, record: dict):
-    volume_leaderboard_snapshot_record = {
+async def get_volume_leaderboard_snapshot_record(fess_usd: Decimal, record: dict) -> dict:
+    return {
         'userAddress': record['tx_sender'],
         'swapFeesUsd': Decimal128(fess_usd),
         'sybilMultiplier': 0,
@@ -233,10 +358,14 @@ async def insert_volume_leaderboard_snapshot(db: Database, fess_usd: Decimal, re
         'volumePoints': ZERO_DECIMAL128,
         'processed': False,
     }
-    db[Collection.VOLUME_LEADERBOARD_SNAPSHOT].insert_one(volume_leaderboard_snapshot_record)
 
 
-async def calculate_volume_leaderboard_user_total_points(db: Database):
+async def insert_volume_leaderboard_snapshot(db: AsyncDatabase, fess_usd: Decimal, record: dict):
+    volume_leaderboard_snapshot_record = await get_volume_leaderboard_snapshot_record(fess_usd, record)
+    await db[Collection.VOLUME_LEADERBOARD_SNAPSHOT].insert_one(volume_leaderboard_snapshot_record)
+
+
+async def calculate_volume_leaderboard_user_total_points(db: AsyncDatabase):
     processed_volume_records = 0
     volume_contest_update_operation = []
     volume_contest_snapshot_update_operation = []
@@ -256,8 +385,8 @@ async def calculate_volume_leaderboard_user_total_points(db: Database):
             }
         },
     ]
-    results = db[Collection.VOLUME_LEADERBOARD_SNAPSHOT].aggregate(pipeline)
-    results = list(results)
+    results = await db[Collection.VOLUME_LEADERBOARD_SNAPSHOT].aggregate(pipeline)
+    results = await results.to_list()
     last_swap_event = None
     if results:
         last_index = int(len(results) * SWAP_PERCENTILE_TRESHOLD) - 1
@@ -266,7 +395,7 @@ async def calculate_volume_leaderboard_user_total_points(db: Database):
     match_query = {
         'processed': False,
     }
-    for record in db[Collection.VOLUME_LEADERBOARD_SNAPSHOT].find(match_query, batch_size=10
+    async for record in db[Collection.VOLUME_LEADERBOARD_SNAPSHOT].find(match_query, batch_size=10
                                                                   ).sort('timestamp', ASCENDING):
         fees_usd = record['swapFeesUsd'].to_decimal()
         sybil_multiplier = 1
@@ -294,42 +423,47 @@ async def calculate_volume_leaderboard_user_total_points(db: Database):
         processed_volume_records += 1
         
     if volume_contest_snapshot_update_operation:
-        db[Collection.VOLUME_LEADERBOARD_SNAPSHOT].bulk_write(volume_contest_snapshot_update_operation)
+        await db[Collection.VOLUME_LEADERBOARD_SNAPSHOT].bulk_write(volume_contest_snapshot_update_operation)
 
     if volume_contest_update_operation:
-        db[Collection.VOLUME_LEADERBOARD].bulk_write(volume_contest_update_operation)
+        await db[Collection.VOLUME_LEADERBOARD].bulk_write(volume_contest_update_operation)
     logger.info(f'Successfully calculated {processed_volume_records} user records for the volume leaderboard contest')
 
 
-async def process_leaderboard(mongo_url: str, mongo_database: Database, rpc_url: str):
-    logger.info('Leaderboard transformer started...')
-    with MongoClient(mongo_url) as mongo:
-        db_name = mongo_database.replace('-', '_')
-        db = mongo[db_name]
-        await handle_positions_for_lp_leaderboard(db, JediSwapPosition)
-        await calculate_lp_leaderboard_user_total_points(db, rpc_url, JediSwapPosition)
-        await handle_positions_for_lp_leaderboard(db, TeahousePosition)
-        await calculate_lp_leaderboard_user_total_points(db, rpc_url, TeahousePosition)
-        await calculate_volume_leaderboard_user_total_points(db)
+async def get_leaderboard_phases(db: AsyncDatabase, rpc_url: str) -> list:
+    # the points phases only handle the snapshots not processed yet, so they resume on their own
+    return [
+        ('jediswapSnapshots', lambda phase: handle_positions_for_lp_leaderboard(db, JediSwapPosition, phase)),
+        ('jediswapPoints', lambda phase: calculate_lp_leaderboard_user_total_points(db, rpc_url, JediSwapPosition)),
+        ('teahouseSnapshots', lambda phase: handle_positions_for_lp_leaderboard(db, TeahousePosition, phase)),
+        ('teahousePoints', lambda phase: calculate_lp_leaderboard_user_total_points(db, rpc_url, TeahousePosition)),
+        ('volumePoints', lambda phase: calculate_volume_leaderboard_user_total_points(db)),
+        ('rpcStats', lambda phase: RpcClients.log_stats()),
+    ]
 
 
-def schedule_process_leaderboard(mongo_url: str, mongo_database: Database, rpc_url: str):
-    asyncio.ensure_future(process_leaderboard(mongo_url, mongo_database, rpc_url))
+def schedule_process_leaderboard(coordinator: LeaderboardRunCoordinator):
+    coordinator.trigger()
 
-def process_leaderboard_once(mongo_url: str, mongo_database: Database, rpc_url: str):
-    asyncio.ensure_future(process_leaderboard(mongo_url, mongo_database, rpc_url))
+def process_leaderboard_once(coordinator: LeaderboardRunCoordinator):
+    coordinator.trigger()
     return schedule.CancelJob
 
 
 async def run_leaderboard_transformer(mongo_url: str, mongo_database: str, rpc_url: str):
-    schedule.every().day.at('00:00', pytz.timezone('UTC')).do(schedule_process_leaderboard, 
-                                                              mongo_url=mongo_url, 
-                                                              mongo_database=mongo_database, 
-                                                              rpc_url=rpc_url)
-    schedule.every(10).minutes.do(process_leaderboard_once, 
-                                    mongo_url=mongo_url, 
-                                    mongo_database=mongo_database, 
-                                    rpc_url=rpc_url)
-    while True:
-        schedule.run_pending()
-        await asyncio.sleep(1)
+    async with AsyncMongoClient(mongo_url, maxPoolSize=MONGO_MAX_POOL_SIZE) as mongo:
+        db_name = mongo_database.replace('-', '_')
+        db = mongo[db_name]
+        await create_fee_state_indexes(db)
+        await create_block_times_index(db)
+        await create_price_history_indexes(db)
+        await create_leaderboard_runs_index(db)
+        coordinator = LeaderboardRunCoordinator(db, await get_leaderboard_phases(db, rpc_url))
+        await coordinator.resume_interrupted_run()
+        schedule.every().day.at('00:00', pytz.timezone('UTC')).do(schedule_process_leaderboard, 
+                                                                  coordinator=coordinator)
+        schedule.every(10).minutes.do(process_leaderboard_once, 
+                                        coordinator=coordinator)
+        while True:
+            schedule.run_pending()
+            await asyncio.sleep(1)
@@ -1,20 +1,24 @@
+import asyncio
+
 from bson import Decimal128
 from datetime import datetime, timedelta, timezone
 from decimal import Decimal
 
-from pymongo.database import Database
+from pymongo.asynchronous.database import AsyncDatabase
 
 from server.const import (
     Collection, Event, ZERO_DECIMAL, ZERO_DECIMAL128, MAX_UINT128, ETH,
     USDC, USDT, STRK, DEFAULT_DECIMALS
 )
 from server.graphql.resolvers.helpers import convert_timestamp_to_datetime
-from server.query_utils import simulate_tx, get_position_record, get_token_record
+from server.query_utils import simulate_tx, get_position_record, get_token_metadata
+from server.rpc_client import get_rpc_client
+from server.transform.block_times import get_closest_block_from_timestamp
+from server.transform.price_history import get_token_price_usd
 from server.utils import get_hour_id, format_address, amount_after_decimals
 
 from starknet_py.contract import ContractFunction
 from starknet_py.net.client_models import TransactionType
-from starknet_py.net.full_node_client import FullNodeClient
 from structlog import get_logger
 
 
@@ -37,19 +41,22 @@ async def get_pool_boost(token0_address: str, token1_address: str) -> Decimal:
         return Decimal(1)
 
 
-async def get_current_position_total_fees_usd(event_data: dict, position_record: dict, snapshot_record: dict, db: Database, rpc_url: str, 
+async def get_current_position_total_fees_usd(event_data: dict, position_record: dict, snapshot_record: dict, db: AsyncDatabase, rpc_url: str, 
                                               get_uncollected_fees_func: callable) -> tuple[Decimal, Decimal, Decimal, Decimal, Decimal]:
     current_unclaimed_token0_fees = ZERO_DECIMAL
     current_unclaimed_token1_fees = ZERO_DECIMAL
 
     hour_id, _ = await get_hour_id(event_data['timestamp'])
-    token0_price = await get_token_price_by_hour_id(db, hour_id, position_record['token0Address'])
-    token1_price = await get_token_price_by_hour_id(db, hour_id, position_record['token1Address'])
-    
-    token0_fees, token1_fees = await get_uncollected_fees_func(rpc_url, position_record, event_data['block'])
+    token0_price, token1_price, (token0_fees, token1_fees) = await asyncio.gather(
+        get_token_price_by_hour_id(db, hour_id, position_record['token0Address']),
+        get_token_price_by_hour_id(db, hour_id, position_record['token1Address']),
+        get_uncollected_fees_func(db, rpc_url, position_record, event_data['block']),
+    )
     if token0_fees or token1_fees:
-        token0 = await get_token_record(db, position_record['token0Address'], rpc_url)
-        token1 = await get_token_record(db, position_record['token1Address'], rpc_url)
+        token0, token1 = await asyncio.gather(
+            get_token_metadata(db, position_record['token0Address'], rpc_url),
+            get_token_metadata(db, position_record['token1Address'], rpc_url),
+        )
         current_unclaimed_token0_fees = await amount_after_decimals(token0_fees, token0.get('decimals', DEFAULT_DECIMALS))
         current_unclaimed_token1_fees = await amount_after_decimals(token1_fees, token1.get('decimals', DEFAULT_DECIMALS))
 
@@ -127,13 +134,8 @@ class CollectTx:
 
 
 async def simulate_collect_tx(rpc_url: str, position_record: dict, block_number: int) -> tuple[Decimal, Decimal]:
-    rpc = FullNodeClient(node_url=rpc_url)
-    try:
-        nonce = await rpc.get_contract_nonce(format_address(position_record['ownerAddress']), block_number=block_number)
-    except Exception:
-        logger.warning(f"Cannot get a nonce for position {position_record['positionId']}. Retrying...")
-        nonce = await rpc.get_contract_nonce(format_address(position_record['ownerAddress']), block_number=block_number)
-        logger.info('Sucessfully retrieved nonce')
+    rpc = await get_rpc_client(rpc_url)
+    nonce = await rpc.get_contract_nonce(format_address(position_record['ownerAddress']), block_number=block_number)
 
     tx_errors = []
     for is_braavos_account in [False, True]:
@@ -152,24 +154,15 @@ async def simulate_collect_tx(rpc_url: str, position_record: dict, block_number:
     return ZERO_DECIMAL, ZERO_DECIMAL
 
 
-async def get_token_price_by_hour_id(db: Database, hour_id: int, token_address: str) -> Decimal:
-    query = {
-        'hourId': {
-            '$lte': hour_id,
-        },
-        'priceUSD': {
-            '$ne': 0
-        },
-        'tokenAddress': token_address,
-    }
-    token_hour_data = list(db[Collection.TOKENS_HOUR_DATA].find(query).sort({'hourId': -1}))
-    if not token_hour_data:
+async def get_token_price_by_hour_id(db: AsyncDatabase, hour_id: int, token_address: str) -> Decimal:
+    token_price = await get_token_price_usd(db, token_address, hour_id)
+    if token_price is None:
         logger.info(f'Token price for {token_address} and hour id {hour_id} not found')
         return ZERO_DECIMAL
-    return token_hour_data[0]['priceUSD'].to_decimal()
+    return token_price
 
 
-async def insert_lp_snapshot_to_db(position_id: str, event_data: dict, db: Database, event: str | None = None, 
+async def insert_lp_snapshot_to_db(position_id: str, event_data: dict, db: AsyncDatabase, event: str | None = None, 
                                    position_record: dict | None = None, amount0_fees: Decimal = ZERO_DECIMAL, 
                                    amount1_fees: Decimal = ZERO_DECIMAL):
     lp_leaderboard_snapshot_record = {
@@ -195,10 +188,10 @@ async def insert_lp_snapshot_to_db(position_id: str, event_data: dict, db: Datab
         'token0Price': ZERO_DECIMAL128,
         'token1Price': ZERO_DECIMAL128,
     }
-    db[Collection.LP_LEADERBOARD_SNAPSHOT].insert_one(lp_leaderboard_snapshot_record)
+    await db[Collection.LP_LEADERBOARD_SNAPSHOT].insert_one(lp_leaderboard_snapshot_record)
 
 
-async def insert_lp_leaderboard_snapshot(event_data: dict, db: Database, event: str | None = None, 
+async def insert_lp_leaderboard_snapshot(event_data: dict, db: AsyncDatabase, event: str | None = None, 
                                          position_record: dict | None = None, teahouse: bool = False):
     if not position_record:
         position_record = await get_position_record(db, event_data['positionId'])
@@ -213,13 +206,13 @@ async def insert_lp_leaderboard_snapshot(event_data: dict, db: Database, event:
         lp_snapshot_query['position.vaultAddress'] = position_record['vaultAddress']
         lp_snapshot_query['position.poolAddress'] = position_record['poolAddress']
 
-    record = db[Collection.LP_LEADERBOARD_SNAPSHOT].find_one(lp_snapshot_query)
+    record = await db[Collection.LP_LEADERBOARD_SNAPSHOT].find_one(lp_snapshot_query)
     if not record:
         await insert_lp_snapshot_to_db(position_id, event_data, db, event, position_record)
 
 
 async def update_lp_leaderboard_snapshot_decrease_liquidity_event(
-        event_data: dict, db: Database, position_record: dict | None = None, teahouse: bool = False,
+        event_data: dict, db: AsyncDatabase, position_record: dict | None = None, teahouse: bool = False,
         amount0_fees: Decimal = ZERO_DECIMAL, amount1_fees: Decimal = ZERO_DECIMAL) -> bool:
     lp_snapshot_query = {
         'positionId': position_record.get('positionId', ''),
@@ -230,9 +223,9 @@ async def update_lp_leaderboard_snapshot_decrease_liquidity_event(
         lp_snapshot_query['position.vaultAddress'] = position_record['vaultAddress']
         lp_snapshot_query['position.poolAddress'] = position_record['poolAddress']
 
-    if record := db[Collection.LP_LEADERBOARD_SNAPSHOT].find_one(lp_snapshot_query):
+    if record := await db[Collection.LP_LEADERBOARD_SNAPSHOT].find_one(lp_snapshot_query):
         record_query = {'_id': record['_id']}
-        db[Collection.LP_LEADERBOARD_SNAPSHOT].update_one(record_query, {
+        await db[Collection.LP_LEADERBOARD_SNAPSHOT].update_one(record_query, {
             '$inc': {
                 'collectedFeesToken0': Decimal128(amount0_fees),
                 'collectedFeesToken1': Decimal128(amount1_fees),
@@ -243,7 +236,7 @@ async def update_lp_leaderboard_snapshot_decrease_liquidity_event(
         
 
 async def insert_lp_leaderboard_snapshot_collect_event(
-        event_data: dict, db: Database, position_record: dict | None = None, teahouse: bool = False,
+        event_data: dict, db: AsyncDatabase, position_record: dict | None = None, teahouse: bool = False,
         amount0_fees: Decimal = ZERO_DECIMAL, amount1_fees: Decimal = ZERO_DECIMAL):
     current_dt = convert_timestamp_to_datetime(event_data['timestamp'])
     current_dt = current_dt.replace(hour=23, minute=59, second=59, microsecond=0, tzinfo=timezone.utc)
@@ -267,9 +260,9 @@ async def insert_lp_leaderboard_snapshot_collect_event(
             lp_snapshot_query['position.vaultAddress'] = position_record['vaultAddress']
             lp_snapshot_query['position.poolAddress'] = position_record['poolAddress']
 
-        if record := db[Collection.LP_LEADERBOARD_SNAPSHOT].find_one(lp_snapshot_query):
+        if record := await db[Collection.LP_LEADERBOARD_SNAPSHOT].find_one(lp_snapshot_query):
             record_query = {'_id': record['_id']}
-            db[Collection.LP_LEADERBOARD_SNAPSHOT].update_one(record_query, {
+            await db[Collection.LP_LEADERBOARD_SNAPSHOT].update_one(record_query, {
                 '$inc': {
                     'collectedFeesToken0': Decimal128(amount0_fees),
                     'collectedFeesToken1': Decimal128(amount1_fees),
@@ -291,42 +284,18 @@ async def insert_lp_leaderboard_snapshot_collect_event(
 
 
 
-async def get_closest_block_from_timestamp(db: Database, target_timestamp: float) -> int | None:
-    pipeline = [
-        {
-            '$addFields': {
-                'diff': {
-                    '$abs': {
-                        '$subtract': ['$timestamp', target_timestamp]
-                    }
-                }
-            }
-        },
-        {
-            '$sort': {
-                'diff': 1
-            }
-        },
-        {
-            '$limit': 1
-        }
-    ]
-    result = list(db[Collection.BLOCKS].aggregate(pipeline))
-    return result[0] if result else None
-
-
-async def is_lp_leaderboard_record_processed(db: Database, dt_obj: datetime, position_record: dict,
+async def is_lp_leaderboard_record_processed(db: AsyncDatabase, dt_obj: datetime, position_record: dict,
                                              records_to_be_inserted: list) -> bool:
     timestamp = int(dt_obj.timestamp() * 1000)
     block = await get_closest_block_from_timestamp(db, timestamp)
-    if not block:
+    if block is None:
         logger.warning(f'Cannot get a block for position {position_record["positionId"]} '
                        f'and timestamp {timestamp}. Skipping the position')
         return False
     event_data = {
         'positionId': position_record.get('positionId'),
         'timestamp': timestamp,
-        'block': int(block['blockNumber']),
+        'block': block,
     }
     records_to_be_inserted.append({
         'event_data': event_data,
@@ -335,7 +304,7 @@ async def is_lp_leaderboard_record_processed(db: Database, dt_obj: datetime, pos
     return True
 
 
-async def process_position_for_lp_leaderboard(db: Database, current_dt: datetime, last_updated_dt: datetime, 
+async def process_position_for_lp_leaderboard(db: AsyncDatabase, current_dt: datetime, last_updated_dt: datetime, 
                                               position_record: dict) -> tuple[bool, list]:
     records_to_be_inserted = []
     missing_block = False
@@ -348,7 +317,7 @@ async def process_position_for_lp_leaderboard(db: Database, current_dt: datetime
     return missing_block, records_to_be_inserted
 
 
-async def process_position_for_lp_leaderboard_for_position_transformer(db: Database, record: dict, position_record: dict
+async def process_position_for_lp_leaderboard_for_position_transformer(db: AsyncDatabase, record: dict, position_record: dict
                                                                        ) -> tuple[bool, list]:
     last_updated_dt = convert_timestamp_to_datetime(position_record['lastUpdatedTimestamp'])
     last_updated_dt = last_updated_dt.replace(tzinfo=timezone.utc)
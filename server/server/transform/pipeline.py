@@ -0,0 +1,115 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+from pymongo.asynchronous.client_session import AsyncClientSession
+from pymongo.asynchronous.database import AsyncDatabase
+
+from structlog import get_logger
+
+
+logger = get_logger(__name__)
+
+
+PIPELINE_END = object()
+TRANSACTIONS_SUPPORT = dict()
+
+
+async def yield_record_batches(records: AsyncIterator[dict], batch_size: int) -> AsyncIterator[list[dict]]:
+    batch_records = []
+    async for record in records:
+        batch_records.append(record)
+        if len(batch_records) >= batch_size:
+            yield batch_records
+            batch_records = []
+    if batch_records:
+        yield batch_records
+
+
+async def prefetch(items: AsyncIterator, size: int) -> AsyncIterator:
+    # the items are read ahead by a separate task, up to size of them wait in the queue for the consumer
+    queue = asyncio.Queue(maxsize=size)
+
+    async def produce():
+        try:
+            async for item in items:
+                await queue.put((item, None))
+            await queue.put((PIPELINE_END, None))
+        except Exception as exc:
+            await queue.put((PIPELINE_END, exc))
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item, exc = await queue.get()
+            if exc is not None:
+                raise exc
+            if item is PIPELINE_END:
+                return
+            yield item
+    finally:
+        producer.cancel()
+
+
+# Persistence stage: the writes submitted by the compute stage are run in submission order by a single task,
+# submit waits while size writes are pending and raises the error of a failed write
+class BatchWriter:
+    def __init__(self, write_func: Callable[..., Awaitable], size: int):
+        self.write_func = write_func
+        self._queue = asyncio.Queue(maxsize=size)
+        self._task = None
+
+    async def __aenter__(self) -> 'BatchWriter':
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        if exc_type is asyncio.CancelledError:
+            self._task.cancel()
+            return
+        # the batches submitted before a failure of the compute stage are still written
+        await self._put(PIPELINE_END)
+        await self._task
+
+    async def _run(self):
+        while True:
+            args = await self._queue.get()
+            if args is PIPELINE_END:
+                return
+            await self.write_func(*args)
+
+    async def _put(self, item):
+        put = asyncio.ensure_future(self._queue.put(item))
+        await asyncio.wait({put, self._task}, return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+        if self._task.done():
+            self._task.result()
+
+    async def submit(self, *args: Any):
+        await self._put(args)
+
+
+async def bulk_write_operations(db: AsyncDatabase, operations: dict[str, list],
+                                session: AsyncClientSession | None = None):
+    for collection, collection_operations in operations.items():
+        if collection_operations:
+            await db[collection].bulk_write(collection_operations, session=session)
+            logger.info(f'Flushed {len(collection_operations)} {collection} records')
+
+
+async def supports_transactions(db: AsyncDatabase) -> bool:
+    # transactions need a replica set or a sharded cluster, standalone servers write without them
+    if db.client not in TRANSACTIONS_SUPPORT:
+        hello = await db.client.admin.command('hello')
+        TRANSACTIONS_SUPPORT[db.client] = 'setName' in hello or hello.get('msg') == 'isdbgrid'
+        if not TRANSACTIONS_SUPPORT[db.client]:
+            logger.warning('MongoDB deployment does not support transactions, batches are written without them')
+    return TRANSACTIONS_SUPPORT[db.client]
+
+
+async def run_in_transaction(db: AsyncDatabase, write_func: Callable[[AsyncClientSession | None], Awaitable]):
+    if not await supports_transactions(db):
+        return await write_func(None)
+    async with db.client.start_session() as session:
+        # retried as a whole on transient errors, the writes of a failed attempt are rolled back
+        return await session.with_transaction(write_func)
@@ -0,0 +1,145 @@
+import asyncio
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+import numpy as np
+from pymongo import UpdateOne
+from pymongo.asynchronous.database import AsyncDatabase
+
+from server.const import Collection, DEFAULT_DECIMALS, ETH_USDC_ADDRESS, POSITIONS_VALUATION_INTERVAL, ZERO_DECIMAL128
+from server.query_utils import filter_by_the_latest_value, get_pool_record
+from server.transform.eth_price import get_pool_eth_price
+from server.transform.pipeline import bulk_write_operations
+from server.utils import decode_decimal128_fields, to_decimal, to_decimal128
+
+from structlog import get_logger
+
+
+logger = get_logger(__name__)
+
+
+Q96 = 2 ** 96
+TICK_BASE = 1.0001
+POSITION_VALUATION_FIELDS = ('amount0Current', 'amount1Current', 'valueUSD')
+
+
+class PositionValuation:
+    valued_at = None
+    trailing_run = None
+
+
+async def get_positions_valuation_query() -> dict:
+    # closed positions are valued once more so their last amounts are reset
+    return {
+        '$or': [
+            {'liquidity': {'$gt': ZERO_DECIMAL128}},
+            {'valueUSD': {'$gt': ZERO_DECIMAL128}},
+        ]
+    }
+
+
+def get_pool_sqrt_price(pool: dict) -> float:
+    if pool.get('sqrtPriceX96'):
+        return float(to_decimal(pool['sqrtPriceX96'])) / Q96
+    return TICK_BASE ** (pool.get('tick', 0) / 2)
+
+
+def get_position_amounts(liquidity: np.ndarray, tick_lower: np.ndarray, tick_upper: np.ndarray,
+                         sqrt_price: float) -> tuple[np.ndarray, np.ndarray]:
+    # raw amounts of the liquidity of every position of a pool, below its range a position only holds token0
+    # and above it only token1, so the price is clamped to the range of each position
+    sqrt_price_lower = np.power(TICK_BASE, tick_lower / 2)
+    sqrt_price_upper = np.power(TICK_BASE, tick_upper / 2)
+    sqrt_price = np.clip(sqrt_price, sqrt_price_lower, sqrt_price_upper)
+    amount0 = liquidity * (sqrt_price_upper - sqrt_price) / (sqrt_price * sqrt_price_upper)
+    amount1 = liquidity * (sqrt_price - sqrt_price_lower)
+    return amount0, amount1
+
+
+async def get_token_valuation(token: dict | None, eth_price: Decimal) -> tuple[float, float]:
+    # scale of the raw amounts and USD price of a token
+    if token is None:
+        return float(10 ** DEFAULT_DECIMALS), 0.0
+    decimals = token.get('decimals', DEFAULT_DECIMALS)
+    return float(10 ** decimals), float(token.get('derivedETH', 0) * eth_price)
+
+
+async def get_pools_by_key(db: AsyncDatabase) -> dict[tuple[str, str, int], dict]:
+    # positions reference their pool by its tokens and fee
+    query = {}
+    await filter_by_the_latest_value(query)
+    projection = {'token0': 1, 'token1': 1, 'fee': 1, 'sqrtPriceX96': 1, 'tick': 1}
+    return {
+        (pool['token0'], pool['token1'], pool['fee']): pool
+        async for pool in db[Collection.POOLS].find(query, projection)
+    }
+
+
+async def get_tokens(db: AsyncDatabase) -> dict[str, dict]:
+    projection = {'tokenAddress': 1, 'decimals': 1, 'derivedETH': 1}
+    return {
+        token['tokenAddress']: await decode_decimal128_fields(token)
+        async for token in db[Collection.TOKENS].find({}, projection)
+    }
+
+
+async def get_positions_by_pool(db: AsyncDatabase) -> dict[tuple[str, str, int], list[dict]]:
+    projection = {'token0Address': 1, 'token1Address': 1, 'poolFee': 1, 'tickLower': 1, 'tickUpper': 1, 'liquidity': 1}
+    positions = defaultdict(list)
+    async for position in db[Collection.POSITIONS].find(await get_positions_valuation_query(), projection):
+        positions[(position['token0Address'], position['token1Address'], position['poolFee'])].append(position)
+    return positions
+
+
+async def get_pool_positions_valuation(pool: dict | None, positions: list[dict], token0: tuple[float, float],
+                                       token1: tuple[float, float]) -> list[UpdateOne]:
+    liquidity = np.array([float(position['liquidity'].to_decimal()) for position in positions])
+    if pool is None or (not pool.get('sqrtPriceX96') and pool.get('tick') is None):
+        # the pool is not initialized yet, its positions have no price to be valued at
+        amount0 = amount1 = np.zeros(len(positions))
+    else:
+        tick_lower = np.array([position['tickLower'] for position in positions], dtype=np.float64)
+        tick_upper = np.array([position['tickUpper'] for position in positions], dtype=np.float64)
+        amount0, amount1 = get_position_amounts(liquidity, tick_lower, tick_upper, get_pool_sqrt_price(pool))
+    (scale0, price0), (scale1, price1) = token0, token1
+    amount0 = amount0 / scale0
+    amount1 = amount1 / scale1
+    value_usd = amount0 * price0 + amount1 * price1
+    return [
+        UpdateOne({'_id': position['_id']}, {'$set': {
+            field: to_decimal128(Decimal(repr(float(value))))
+            for field, value in zip(POSITION_VALUATION_FIELDS, values)
+        }})
+        for position, *values in zip(positions, amount0, amount1, value_usd)
+    ]
+
+
+async def run_trailing_valuation(db: AsyncDatabase, delay: float):
+    await asyncio.sleep(delay)
+    await value_positions(db)
+
+
+async def value_positions(db: AsyncDatabase, force: bool = False):
+    # current amounts and USD value of the open positions, all positions of a pool are valued in one pass
+    # at most every POSITIONS_VALUATION_INTERVAL seconds, a trigger within the interval runs once after it
+    if not force and PositionValuation.valued_at is not None:
+        delay = PositionValuation.valued_at + POSITIONS_VALUATION_INTERVAL - time.monotonic()
+        if delay > 0:
+            if PositionValuation.trailing_run is None or PositionValuation.trailing_run.done():
+                PositionValuation.trailing_run = asyncio.create_task(run_trailing_valuation(db, delay))
+            return
+    # prices updated during the run trigger the next one
+    PositionValuation.valued_at = time.monotonic()
+    pools = await get_pools_by_key(db)
+    tokens = await get_tokens(db)
+    eth_price = await get_pool_eth_price(await decode_decimal128_fields(await get_pool_record(db, ETH_USDC_ADDRESS)))
+
+    operations = []
+    for (token0_address, token1_address, fee), positions in (await get_positions_by_pool(db)).items():
+        token0 = await get_token_valuation(tokens.get(token0_address), eth_price)
+        token1 = await get_token_valuation(tokens.get(token1_address), eth_price)
+        operations.extend(await get_pool_positions_valuation(
+            pools.get((token0_address, token1_address, fee)), positions, token0, token1))
+    await bulk_write_operations(db, {Collection.POSITIONS: operations})
+    logger.info(f'Valued {len(operations)} positions')
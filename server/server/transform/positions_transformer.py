@@ -1,17 +1,35 @@
-import time
+import asyncio
 
 from bson import Decimal128
-from pymongo import MongoClient, UpdateOne
-from pymongo.database import Database
+from pymongo import AsyncMongoClient
+from pymongo.asynchronous.database import AsyncDatabase
 
-from server.const import Collection, Event, ZERO_ADDRESS, DEFAULT_DECIMALS, TIME_INTERVAL, ZERO_DECIMAL
+from server.const import (
+    Collection, Event, Transformer, ZERO_ADDRESS, DEFAULT_DECIMALS, TIME_INTERVAL, ZERO_DECIMAL, MONGO_MAX_POOL_SIZE,
+    POSITIONS_PREFETCH_SIZE,
+)
 from server.transform.lp_contest_updates import (
     insert_lp_leaderboard_snapshot, 
     process_position_for_lp_leaderboard_for_position_transformer, 
     insert_lp_leaderboard_snapshot_collect_event,
     update_lp_leaderboard_snapshot_decrease_liquidity_event,
 )
-from server.query_utils import get_token_record, get_position_record, get_teahouse_position_record
+from server.query_utils import get_token_metadata, get_position_record, get_teahouse_position_record
+from server.transform.block_times import create_block_times_index
+from server.transform.price_history import create_price_history_indexes
+from server.transform.fee_engine import create_fee_state_indexes, get_fee_checkpoint
+from server.transform.follow import follow_changes
+from server.transform.pipeline import prefetch, yield_record_batches
+from server.transform.position_valuation import value_positions
+from server.transform.progress import (
+    WATERMARK_SORT,
+    create_watermark_index,
+    get_after_watermark_query,
+    get_record_watermark,
+    get_up_to_watermark_query,
+    get_watermark,
+    save_watermark,
+)
 from server.utils import amount_after_decimals
 
 from structlog import get_logger
@@ -30,19 +48,21 @@ class EventTracker:
     teahouse_collect_count = 0
 
 
-async def update_position_record(db: Database, position_id: str, position_update_data: dict):
+async def update_position_record(db: AsyncDatabase, position_id: str, position_update_data: dict):
     position_query = {'positionId': position_id}
-    db[Collection.POSITIONS].update_one(position_query, position_update_data)
+    await db[Collection.POSITIONS].update_one(position_query, position_update_data)
+
+
+async def save_fee_checkpoint(db: AsyncDatabase, record: dict, fee_checkpoint: dict | None):
+    await db[Collection.POSITIONS_DATA].update_one({'_id': record['_id']}, {'$set': {'feeCheckpoint': fee_checkpoint}})
 
 
-async def yield_position_records(db: Database, collection: str) -> dict:
-    query = {
-        'ownerAddress': {'$ne': ZERO_ADDRESS},
-        '$or': [
-            {'processed': {'$exists': False}},
-            {'processed': False}
-        ]}
-    for record in db[collection].find(query):
+async def yield_position_records(db: AsyncDatabase, collection: str, watermark: dict | None,
+                                 up_to_watermark: dict | None = None) -> dict:
+    query = await get_after_watermark_query(watermark)
+    if up_to_watermark is not None:
+        query = {'$and': [query, await get_up_to_watermark_query(up_to_watermark)]}
+    async for record in db[collection].find(query).sort(WATERMARK_SORT):
         yield record
 
 
@@ -79,19 +99,28 @@ async def handle_increase_liquidity(*args, **kwargs):
     del record['event']
     logger.info("handle IncreaseLiquidity", **record)
 
-    token0 = await get_token_record(db, record['token0Address'], rpc_url)
-    token1 = await get_token_record(db, record['token1Address'], rpc_url)
+    token0, token1 = await asyncio.gather(
+        get_token_metadata(db, record['token0Address'], rpc_url),
+        get_token_metadata(db, record['token1Address'], rpc_url),
+    )
 
     amount0 = await amount_after_decimals(record['depositedToken0'], token0.get('decimals', DEFAULT_DECIMALS))
     amount1 = await amount_after_decimals(record['depositedToken1'], token1.get('decimals', DEFAULT_DECIMALS))
 
-    await insert_lp_leaderboard_snapshot(record, db, Event.INCREASE_LIQUIDITY)
+    position_record = await get_position_record(db, record['positionId'])
+    await insert_lp_leaderboard_snapshot(record, db, Event.INCREASE_LIQUIDITY, position_record)
+
+    fee_checkpoint = await get_fee_checkpoint(db, record, position_record, int(record['liquidity']))
+    await save_fee_checkpoint(db, record, fee_checkpoint)
 
     position_update_data = {
         '$inc': {
             'liquidity': Decimal128(record['liquidity']),
             'depositedToken0': Decimal128(amount0),
             'depositedToken1': Decimal128(amount1),
+        },
+        '$set': {
+            'feeCheckpoint': fee_checkpoint,
         }
     }
 
@@ -108,8 +137,10 @@ async def handle_decrease_liquidity(*args, **kwargs):
     del record['event']
     logger.info("handle DecreaseLiquidity", **record)
 
-    token0 = await get_token_record(db, record['token0Address'], rpc_url)
-    token1 = await get_token_record(db, record['token1Address'], rpc_url)
+    token0, token1 = await asyncio.gather(
+        get_token_metadata(db, record['token0Address'], rpc_url),
+        get_token_metadata(db, record['token1Address'], rpc_url),
+    )
 
     amount0 = await amount_after_decimals(record['withdrawnToken0'], token0.get('decimals', DEFAULT_DECIMALS))
     amount1 = await amount_after_decimals(record['withdrawnToken1'], token1.get('decimals', DEFAULT_DECIMALS))
@@ -123,11 +154,17 @@ async def handle_decrease_liquidity(*args, **kwargs):
         for pos_record in records_to_be_inserted:
             await insert_lp_leaderboard_snapshot(pos_record['event_data'], db, position_record=pos_record['position_record'])
 
+    fee_checkpoint = await get_fee_checkpoint(db, record, position_record, -int(record['liquidity']))
+    await save_fee_checkpoint(db, record, fee_checkpoint)
+
     position_update_data = {
         '$inc': {
             'liquidity': Decimal128(f"-{record['liquidity']}"),
             'withdrawnToken0': Decimal128(amount0),
             'withdrawnToken1': Decimal128(amount1),
+        },
+        '$set': {
+            'feeCheckpoint': fee_checkpoint,
         }
     }
 
@@ -144,8 +181,10 @@ async def handle_collect(*args, **kwargs):
     del record['event']
     logger.info("handle Collect", **record)
 
-    token0 = await get_token_record(db, record['token0Address'], rpc_url)
-    token1 = await get_token_record(db, record['token1Address'], rpc_url)
+    token0, token1 = await asyncio.gather(
+        get_token_metadata(db, record['token0Address'], rpc_url),
+        get_token_metadata(db, record['token1Address'], rpc_url),
+    )
     token0_decimals = token0.get('decimals', DEFAULT_DECIMALS)
     token1_decimals = token1.get('decimals', DEFAULT_DECIMALS)
 
@@ -154,21 +193,33 @@ async def handle_collect(*args, **kwargs):
 
     withdrawn_amount0 = ZERO_DECIMAL
     withdrawn_amount1 = ZERO_DECIMAL
-    if decrease_liquidity_record := db[Collection.POSITIONS_DATA].find_one({
+    withdrawn_token0 = 0
+    withdrawn_token1 = 0
+    if decrease_liquidity_record := await db[Collection.POSITIONS_DATA].find_one({
         'positionId': record['positionId'],
         'event': Event.DECREASE_LIQUIDITY,
         'timestamp': record['timestamp'],
     }):
+        withdrawn_token0 = int(decrease_liquidity_record['withdrawnToken0'])
+        withdrawn_token1 = int(decrease_liquidity_record['withdrawnToken1'])
         withdrawn_amount0 = await amount_after_decimals(decrease_liquidity_record['withdrawnToken0'], token0_decimals)
         withdrawn_amount1 = await amount_after_decimals(decrease_liquidity_record['withdrawnToken1'], token1_decimals)
 
     amount0 = collected_amount0 - withdrawn_amount0
     amount1 = collected_amount1 - withdrawn_amount1
 
+    # the withdrawn liquidity is collected with the fees, only the fees are taken out of the checkpoint
+    fee_checkpoint = await get_fee_checkpoint(db, record, await get_position_record(db, record['positionId']), 0, (
+        int(record['collectedFeesToken0']) - withdrawn_token0, int(record['collectedFeesToken1']) - withdrawn_token1))
+    await save_fee_checkpoint(db, record, fee_checkpoint)
+
     position_update_data = {
         '$inc': {
             'collectedFeesToken0': Decimal128(amount0),
             'collectedFeesToken1': Decimal128(amount1),
+        },
+        '$set': {
+            'feeCheckpoint': fee_checkpoint,
         }
     }
 
@@ -191,23 +242,23 @@ EVENT_TO_FUNCTION_MAP = {
 }
 
 
-async def process_positions(mongo_url: str, mongo_database: Database, rpc_url: str):
-    processed_records = []
-    with MongoClient(mongo_url) as mongo:
-        db_name = mongo_database.replace('-', '_')
-        db = mongo[db_name]
-        async for record in yield_position_records(db, Collection.POSITIONS_DATA):
+async def process_positions(db: AsyncDatabase, rpc_url: str):
+    watermark = await get_watermark(db, Transformer.POSITIONS, Collection.POSITIONS_DATA)
+    # the fee checkpoints read the fee state the events transformer stored, the records after its watermark wait
+    events_watermark = await get_watermark(db, Transformer.EVENTS, Collection.POOLS_DATA)
+    # the next records are read while the handlers run, the handlers read their own writes so they are not deferred
+    records = yield_record_batches(yield_position_records(db, Collection.POSITIONS_DATA, watermark, events_watermark),
+                                   POSITIONS_PREFETCH_SIZE)
+    async for batch_records in prefetch(records, 1):
+        for record in batch_records:
             event_func = EVENT_TO_FUNCTION_MAP.get(record['event'])
-            if event_func:
+            watermark = await get_record_watermark(record)
+            if event_func and record.get('ownerAddress') != ZERO_ADDRESS:
                 await event_func(
                     db=db, 
                     record=record,
                     rpc_url=rpc_url)
-                processed_records.append(
-                    UpdateOne({"_id": record['_id']}, {"$set": {"processed": True}})
-                )
-        if processed_records:
-            db[Collection.POSITIONS_DATA].bulk_write(processed_records)
+    await save_watermark(db, Transformer.POSITIONS, watermark)
 
     logger.info(f'Successfully processed {EventTracker.transfer_count} Transfer events')
     logger.info(f'Successfully processed {EventTracker.increase_liquidity_count} IncreaseLiquidity events')
@@ -219,11 +270,11 @@ async def process_positions(mongo_url: str, mongo_database: Database, rpc_url: s
     EventTracker.collect_count = 0
 
 
-async def update_teahouse_position_record(db: Database, pool_address: str, position_update_data: dict):
+async def update_teahouse_position_record(db: AsyncDatabase, pool_address: str, position_update_data: dict):
     position_query = {
         'poolAddress': pool_address,
     }
-    db[Collection.TEAHOUSE_VAULT].update_one(position_query, position_update_data)
+    await db[Collection.TEAHOUSE_VAULT].update_one(position_query, position_update_data)
 
 
 async def handle_teahouse_add_liquidity(*args, **kwargs):
@@ -236,8 +287,10 @@ async def handle_teahouse_add_liquidity(*args, **kwargs):
 
     position_record = await get_teahouse_position_record(db, record, rpc_url)
 
-    token0 = await get_token_record(db, position_record['token0Address'], rpc_url)
-    token1 = await get_token_record(db, position_record['token1Address'], rpc_url)
+    token0, token1 = await asyncio.gather(
+        get_token_metadata(db, position_record['token0Address'], rpc_url),
+        get_token_metadata(db, position_record['token1Address'], rpc_url),
+    )
 
     amount0 = await amount_after_decimals(record['depositedToken0'], token0.get('decimals', DEFAULT_DECIMALS))
     amount1 = await amount_after_decimals(record['depositedToken1'], token1.get('decimals', DEFAULT_DECIMALS))
@@ -273,8 +326,10 @@ async def handle_teahouse_remove_liquidity(*args, **kwargs):
 
     position_record = await get_teahouse_position_record(db, record, rpc_url)
 
-    token0 = await get_token_record(db, position_record['token0Address'], rpc_url)
-    token1 = await get_token_record(db, position_record['token1Address'], rpc_url)
+    token0, token1 = await asyncio.gather(
+        get_token_metadata(db, position_record['token0Address'], rpc_url),
+        get_token_metadata(db, position_record['token1Address'], rpc_url),
+    )
 
     amount0 = await amount_after_decimals(record['withdrawnToken0'], token0.get('decimals', DEFAULT_DECIMALS))
     amount1 = await amount_after_decimals(record['withdrawnToken1'], token1.get('decimals', DEFAULT_DECIMALS))
@@ -315,7 +370,7 @@ async def handle_teahouse_collect(*args, **kwargs):
     del record['event']
     logger.info("handle Teahouse Collect", **record)
 
-    if db[Collection.TEAHOUSE_VAULT_DATA].find_one({
+    if await db[Collection.TEAHOUSE_VAULT_DATA].find_one({
         'poolAddress': record['poolAddress'],
         'tx_sender': record['tx_sender'],
         'event': Event.REMOVE_LIQUIDITY,
@@ -329,8 +384,10 @@ async def handle_teahouse_collect(*args, **kwargs):
     
     position_record = await get_teahouse_position_record(db, record, rpc_url)
 
-    token0 = await get_token_record(db, position_record['token0Address'], rpc_url)
-    token1 = await get_token_record(db, position_record['token1Address'], rpc_url)
+    token0, token1 = await asyncio.gather(
+        get_token_metadata(db, position_record['token0Address'], rpc_url),
+        get_token_metadata(db, position_record['token1Address'], rpc_url),
+    )
 
     token0_decimals = token0.get('decimals', DEFAULT_DECIMALS)
     token1_decimals = token1.get('decimals', DEFAULT_DECIMALS)
@@ -361,23 +418,20 @@ TEAHOUSE_EVENT_TO_FUNCTION_MAP = {
 }
 
 
-async def process_teahouse_positions(mongo_url: str, mongo_database: Database, rpc_url: str):
-    processed_records = []
-    with MongoClient(mongo_url) as mongo:
-        db_name = mongo_database.replace('-', '_')
-        db = mongo[db_name]
-        async for record in yield_position_records(db, Collection.TEAHOUSE_VAULT_DATA):
+async def process_teahouse_positions(db: AsyncDatabase, rpc_url: str):
+    watermark = await get_watermark(db, Transformer.TEAHOUSE_POSITIONS, Collection.TEAHOUSE_VAULT_DATA)
+    # the next records are read while the handlers run, the handlers read their own writes so they are not deferred
+    records = yield_record_batches(yield_position_records(db, Collection.TEAHOUSE_VAULT_DATA, watermark), POSITIONS_PREFETCH_SIZE)
+    async for batch_records in prefetch(records, 1):
+        for record in batch_records:
             event_func = TEAHOUSE_EVENT_TO_FUNCTION_MAP.get(record['event'])
-            if event_func:
+            watermark = await get_record_watermark(record)
+            if event_func and record.get('ownerAddress') != ZERO_ADDRESS:
                 await event_func(
                     db=db, 
                     record=record,
                     rpc_url=rpc_url)
-                processed_records.append(
-                    UpdateOne({"_id": record['_id']}, {"$set": {"processed": True}})
-                )
-        if processed_records:
-            db[Collection.TEAHOUSE_VAULT_DATA].bulk_write(processed_records)
+    await save_watermark(db, Transformer.TEAHOUSE_POSITIONS, watermark)
 
     logger.info(f"Successfully processed {EventTracker.teahouse_add_liquidity_count} Teahouse's AddLiquidity events")
     logger.info(f"Successfully processed {EventTracker.teahouse_remove_liquidity_count} Teahouse's RemoveLiquidity events")
@@ -387,8 +441,24 @@ async def process_teahouse_positions(mongo_url: str, mongo_database: Database, r
     EventTracker.teahouse_collect_count = 0
 
 
-async def run_positions_transformer(mongo_url: str, mongo_database: Database, rpc_url: str):
-    while True:
-        await process_positions(mongo_url, mongo_database, rpc_url)
-        await process_teahouse_positions(mongo_url, mongo_database, rpc_url)
-        time.sleep(TIME_INTERVAL)
+async def run_positions_transformer(mongo_url: str, mongo_database: str, rpc_url: str, follow: bool = False):
+    async with AsyncMongoClient(mongo_url, maxPoolSize=MONGO_MAX_POOL_SIZE) as mongo:
+        db_name = mongo_database.replace('-', '_')
+        db = mongo[db_name]
+        await create_watermark_index(db, Collection.POSITIONS_DATA)
+        await create_watermark_index(db, Collection.TEAHOUSE_VAULT_DATA)
+        await create_fee_state_indexes(db)
+        await create_block_times_index(db)
+        await create_price_history_indexes(db)
+        if follow:
+            await follow_changes(db, Transformer.POSITIONS, {
+                Collection.POSITIONS_DATA: lambda: process_positions(db, rpc_url),
+                Collection.TEAHOUSE_VAULT_DATA: lambda: process_teahouse_positions(db, rpc_url),
+                # the positions are valued at the pools prices, which the events transformer updates
+                Collection.POOLS: lambda: value_positions(db),
+            }, updated_collections=(Collection.POOLS,))
+        while True:
+            await process_positions(db, rpc_url)
+            await process_teahouse_positions(db, rpc_url)
+            await value_positions(db)
+            await asyncio.sleep(TIME_INTERVAL)
@@ -0,0 +1,90 @@
+import asyncio
+import time
+from array import array
+from bisect import bisect_right
+from decimal import Decimal
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.asynchronous.database import AsyncDatabase
+
+from server.const import Collection, PRICE_HISTORY_REFRESH_INTERVAL
+
+
+PRICE_HISTORIES = dict()
+PRICE_HISTORY_PROJECTION = {'tokenAddress': 1, 'hourId': 1, 'priceUSD': 1}
+
+
+async def create_price_history_indexes(db: AsyncDatabase):
+    await db[Collection.TOKENS_HOUR_DATA].create_index([('tokenAddress', ASCENDING), ('hourId', DESCENDING)])
+    await db[Collection.TOKENS_HOUR_DATA].create_index([('hourId', ASCENDING)])
+
+
+# USD prices of the tokens hour buckets, kept per token as sorted hour ids and prices so the last known price at or
+# before an hour is found with a bisect. A token is read once when it is first asked for, the loaded tokens are
+# then refreshed every PRICE_HISTORY_REFRESH_INTERVAL seconds from the latest read hour, as only the buckets of the
+# latest hour are still updated by the events transformer
+class TokenPriceHistory:
+    def __init__(self, db: AsyncDatabase):
+        self.db = db
+        self._hour_ids = dict()
+        self._prices = dict()
+        self._last_hour_id = None
+        self._refreshed_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def _add_price(self, record: dict):
+        hour_ids = self._hour_ids[record['tokenAddress']]
+        prices = self._prices[record['tokenAddress']]
+        price = record['priceUSD'].to_decimal()
+        if hour_ids and hour_ids[-1] == record['hourId']:
+            # the bucket of the latest hour was updated, a price set to zero is not a known price anymore
+            if price == 0:
+                hour_ids.pop()
+                prices.pop()
+            else:
+                prices[-1] = price
+        elif price != 0 and (not hour_ids or hour_ids[-1] < record['hourId']):
+            hour_ids.append(record['hourId'])
+            prices.append(price)
+        if self._last_hour_id is None or record['hourId'] > self._last_hour_id:
+            self._last_hour_id = record['hourId']
+
+    async def _load(self, token_address: str):
+        self._hour_ids[token_address] = array('q')
+        self._prices[token_address] = []
+        query = {'tokenAddress': token_address, 'priceUSD': {'$ne': 0}}
+        async for record in self.db[Collection.TOKENS_HOUR_DATA].find(query, PRICE_HISTORY_PROJECTION,
+                                                                      sort=[('hourId', ASCENDING)]):
+            await self._add_price(record)
+
+    async def _refresh(self):
+        query = {'tokenAddress': {'$in': list(self._hour_ids)}}
+        if self._last_hour_id is not None:
+            query['hourId'] = {'$gte': self._last_hour_id}
+        async for record in self.db[Collection.TOKENS_HOUR_DATA].find(query, PRICE_HISTORY_PROJECTION,
+                                                                      sort=[('hourId', ASCENDING)]):
+            await self._add_price(record)
+        self._refreshed_at = time.monotonic()
+
+    async def get(self, token_address: str, hour_id: int) -> Decimal | None:
+        async with self._lock:
+            if token_address not in self._hour_ids:
+                await self._load(token_address)
+            elif time.monotonic() - self._refreshed_at >= PRICE_HISTORY_REFRESH_INTERVAL:
+                await self._refresh()
+        index = bisect_right(self._hour_ids[token_address], hour_id) - 1
+        if index < 0:
+            return None
+        return self._prices[token_address][index]
+
+
+async def get_price_history(db: AsyncDatabase) -> TokenPriceHistory:
+    key = (db.client, db.name)
+    if key not in PRICE_HISTORIES:
+        PRICE_HISTORIES[key] = TokenPriceHistory(db)
+    return PRICE_HISTORIES[key]
+
+
+async def get_token_price_usd(db: AsyncDatabase, token_address: str, hour_id: int) -> Decimal | None:
+    price_history = await get_price_history(db)
+    return await price_history.get(token_address, hour_id)
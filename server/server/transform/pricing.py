@@ -1,10 +1,8 @@
 from decimal import Decimal
 
-from pymongo.database import Database
-
-from server.const import ETH_USDC_ADDRESS, STABLECOINS, ETH, WHITELISTED_TOKENS, ZERO_DECIMAL
-from server.query_utils import get_pool_record, get_tokens_from_pool, get_all_token_pools
-from server.utils import exponent_to_decimal, safe_div
+from server.const import STABLECOINS, ETH, WHITELISTED_TOKENS, ZERO_DECIMAL
+from server.transform.state_store import StateStore
+from server.utils import POWERS_OF_TEN, exponent_to_decimal, safe_div
 
 from structlog import get_logger
 
@@ -12,33 +10,11 @@ logger = get_logger(__name__)
 
 
 Q192 = Decimal(2 ** 192)
+ONE_DECIMAL = Decimal(1)
 MINIMUM_ETH_LOCKED = Decimal(0)
 
 
-class EthPrice:
-    _ETH_PRICE = Decimal(0)
-
-    @classmethod
-    async def get(cls) -> Decimal:
-        return cls._ETH_PRICE
-
-    @classmethod
-    async def set(cls, db: Database):
-        cls._ETH_PRICE = await cls.get_eth_price(db)
-    
-    @staticmethod
-    async def get_eth_price(db: Database) -> Decimal:
-        pool = await get_pool_record(db, ETH_USDC_ADDRESS)
-        if pool and 'token0Price' in pool.keys() and pool['token0Price'].to_decimal() != Decimal(0) and 'token1Price' in pool.keys() and pool['token1Price'].to_decimal() != Decimal(0):
-            if (pool['token0'] == ETH):
-                return pool['token1Price'].to_decimal()
-            else:
-                return pool['token0Price'].to_decimal()
-        else:
-            return Decimal(2500)
-
-
-async def find_eth_per_token(db: Database, token_addr: str, rpc_url: str) -> Decimal:
+async def find_eth_per_token(store: StateStore, token_addr: str, block: int | None = None) -> Decimal:
     if token_addr == ETH:
         return Decimal(1)
       
@@ -46,34 +22,40 @@ async def find_eth_per_token(db: Database, token_addr: str, rpc_url: str) -> Dec
     price_so_far = ZERO_DECIMAL
 
     if token_addr in STABLECOINS:
-        eth_price = await EthPrice.get()
+        eth_price = await store.eth_price.get(block)
         price_so_far = await safe_div(Decimal(1), eth_price)
     else:
-        for pool in await get_all_token_pools(db, token_addr):
-            pool = await get_pool_record(db, pool['poolAddress'])
-            if pool.get('liquidity') and pool.get('liquidity').to_decimal() > 0:
-                token0, token1 = await get_tokens_from_pool(db, pool, rpc_url)
+        derived_eth, version = await store.get_derived_eth(token_addr)
+        if derived_eth is not None:
+            return derived_eth
+        source_token_addresses = set()
+        token_pools = await store.get_token_pools(token_addr)
+        for pool in token_pools:
+            if pool.get('liquidity') and pool.get('liquidity') > 0:
+                token0, token1 = await store.get_tokens_from_pool(pool)
                 if pool['token0'] == token_addr:
+                    source_token_addresses.add(token1['tokenAddress'])
                     if price_so_far == ZERO_DECIMAL:
-                        price_so_far = pool['token1Price'].to_decimal() * token1['derivedETH'].to_decimal()
+                        price_so_far = pool['token1Price'] * token1['derivedETH']
                     else:
-                        eth_locked = pool['totalValueLockedToken1'].to_decimal() * token1['derivedETH'].to_decimal()
+                        eth_locked = pool['totalValueLockedToken1'] * token1['derivedETH']
                         if eth_locked > largest_liquidity_eth and eth_locked > MINIMUM_ETH_LOCKED:
                             largest_liquidity_eth = eth_locked
-                            price_so_far = pool['token1Price'].to_decimal() * token1['derivedETH'].to_decimal()
+                            price_so_far = pool['token1Price'] * token1['derivedETH']
                 elif pool['token1'] == token_addr:
+                    source_token_addresses.add(token0['tokenAddress'])
                     if price_so_far == ZERO_DECIMAL:
-                        price_so_far = pool['token0Price'].to_decimal() * token0['derivedETH'].to_decimal()
+                        price_so_far = pool['token0Price'] * token0['derivedETH']
                     else:
-                        eth_locked = pool['totalValueLockedToken0'].to_decimal() * token0['derivedETH'].to_decimal()
+                        eth_locked = pool['totalValueLockedToken0'] * token0['derivedETH']
                         if eth_locked > largest_liquidity_eth and eth_locked > MINIMUM_ETH_LOCKED:
                             largest_liquidity_eth = eth_locked
-                            price_so_far = pool['token0Price'].to_decimal() * token0['derivedETH'].to_decimal()
+                            price_so_far = pool['token0Price'] * token0['derivedETH']
+        await store.set_derived_eth(token_addr, price_so_far, version, source_token_addresses)
     return price_so_far
 
 
-async def get_tracked_amount_usd(amount0_abs: Decimal, token0_address: str, token0_derivedETH: Decimal, amount1_abs: Decimal, token1_address: str, token1_derivedETH: Decimal) -> Decimal:
-    eth_price = await EthPrice.get()
+async def get_tracked_amount_usd(amount0_abs: Decimal, token0_address: str, token0_derivedETH: Decimal, amount1_abs: Decimal, token1_address: str, token1_derivedETH: Decimal, eth_price: Decimal) -> Decimal:
     price0_USD = token0_derivedETH * eth_price
     price1_USD = token1_derivedETH * eth_price
 
@@ -91,10 +73,15 @@ async def get_tracked_amount_usd(amount0_abs: Decimal, token0_address: str, toke
 
 async def sqrt_price_x96_to_token_prices(sqrt_price_x96: float, token0_decimals: int, token1_decimals: int
                                    ) -> tuple[Decimal, Decimal]:
-    num = Decimal(sqrt_price_x96) ** 2
-    token0_decimals_ = await exponent_to_decimal(token0_decimals)
-    token1_decimals_ = await exponent_to_decimal(token1_decimals)
-    price1 = num / Q192 * token0_decimals_ / token1_decimals_
-    price0 = await safe_div(Decimal('1'), price1)
+    # called for every Initialize and Swap: the scales are read from the precomputed powers of ten, the steps and
+    # their rounding are kept so the prices are the same as computing the scales
+    if 0 <= token0_decimals < len(POWERS_OF_TEN) and 0 <= token1_decimals < len(POWERS_OF_TEN):
+        token0_decimals_ = POWERS_OF_TEN[token0_decimals]
+        token1_decimals_ = POWERS_OF_TEN[token1_decimals]
+    else:
+        token0_decimals_ = await exponent_to_decimal(token0_decimals)
+        token1_decimals_ = await exponent_to_decimal(token1_decimals)
+    price1 = Decimal(sqrt_price_x96) ** 2 / Q192 * token0_decimals_ / token1_decimals_
+    price0 = ONE_DECIMAL / price1 if price1 else ZERO_DECIMAL
     return price0, price1
 
@@ -0,0 +1,93 @@
+from pymongo import ASCENDING
+from pymongo.asynchronous.client_session import AsyncClientSession
+from pymongo.asynchronous.database import AsyncDatabase
+
+from server.const import Collection
+
+
+# records are handled in chain order, (block, txIndex, eventIndex) of the last handled record is the watermark
+WATERMARK_SORT = [('block', ASCENDING), ('txIndex', ASCENDING), ('eventIndex', ASCENDING), ('_id', ASCENDING)]
+
+
+async def create_watermark_index(db: AsyncDatabase, collection: str):
+    await db[collection].create_index(WATERMARK_SORT)
+
+
+async def get_record_watermark(record: dict) -> dict:
+    return {
+        'block': record['block'],
+        'txIndex': record.get('txIndex'),
+        'eventIndex': record.get('eventIndex'),
+    }
+
+
+async def is_legacy_watermark(watermark: dict) -> bool:
+    # records indexed before txIndex/eventIndex were added can only be checkpointed at the end of a block
+    return watermark['txIndex'] is None or watermark['eventIndex'] is None
+
+
+async def get_watermark(db: AsyncDatabase, transformer: str, collection: str) -> dict | None:
+    progress_record = await db[Collection.TRANSFORMER_PROGRESS].find_one({'_id': transformer})
+    if progress_record and progress_record.get('watermark'):
+        return progress_record['watermark']
+
+    # bootstrap from the records flagged as processed before the watermark was introduced
+    last_processed_record = await db[collection].find_one({'processed': True}, {'block': 1, '_id': 0},
+                                                          sort={'block': -1})
+    if last_processed_record is None:
+        return None
+    return {
+        'block': last_processed_record['block'],
+        'txIndex': None,
+        'eventIndex': None,
+    }
+
+
+async def save_watermark(db: AsyncDatabase, transformer: str, watermark: dict | None,
+                         session: AsyncClientSession | None = None):
+    if watermark is None:
+        return
+    await db[Collection.TRANSFORMER_PROGRESS].update_one(
+        {'_id': transformer}, {'$set': {'watermark': watermark}}, upsert=True, session=session)
+
+
+async def get_after_watermark_query(watermark: dict | None) -> dict:
+    if watermark is None:
+        return {}
+    block = watermark['block']
+    if await is_legacy_watermark(watermark):
+        return {'block': {'$gt': block}}
+    return {
+        '$or': [
+            {'block': {'$gt': block}},
+            {'block': block, 'txIndex': {'$gt': watermark['txIndex']}},
+            {'block': block, 'txIndex': watermark['txIndex'], 'eventIndex': {'$gt': watermark['eventIndex']}},
+        ]
+    }
+
+
+async def get_up_to_watermark_query(watermark: dict | None) -> dict:
+    if watermark is None:
+        return {'processed': True}
+    block = watermark['block']
+    if await is_legacy_watermark(watermark):
+        return {'block': {'$lte': block}}
+    return {
+        '$or': [
+            {'block': {'$lt': block}},
+            {'block': block, 'txIndex': {'$lt': watermark['txIndex']}},
+            {'block': block, 'txIndex': watermark['txIndex'], 'eventIndex': {'$lte': watermark['eventIndex']}},
+        ]
+    }
+
+
+async def get_resume_token(db: AsyncDatabase, transformer: str) -> dict | None:
+    progress_record = await db[Collection.TRANSFORMER_PROGRESS].find_one({'_id': transformer})
+    if progress_record is None:
+        return None
+    return progress_record.get('resumeToken')
+
+
+async def save_resume_token(db: AsyncDatabase, transformer: str, resume_token: dict | None):
+    await db[Collection.TRANSFORMER_PROGRESS].update_one(
+        {'_id': transformer}, {'$set': {'resumeToken': resume_token}}, upsert=True)
@@ -0,0 +1,142 @@
+from pymongo.asynchronous.database import AsyncDatabase
+
+from server.const import Collection, REBUILD_CURSOR_BATCH_SIZE, ZERO_DECIMAL
+from server.query_utils import create_factory_record, filter_by_the_latest_value, get_token_record
+from server.transform.interval_updates import IntervalUpdates
+from server.transform.progress import WATERMARK_SORT
+from server.transform.state_store import StateStore
+from server.transform.ticks import PoolTicks
+from server.utils import decode_decimal128_fields, to_decimal128
+
+from structlog import get_logger
+
+
+logger = get_logger(__name__)
+
+
+REBUILD_COLLECTION_SUFFIX = '_rebuild'
+REBUILD_COLLECTIONS = [
+    Collection.FACTORIES,
+    Collection.POOLS,
+    Collection.TOKENS,
+    Collection.FACTORIES_DAY_DATA,
+    Collection.FACTORIES_HOUR_DATA,
+    Collection.POOLS_DAY_DATA,
+    Collection.POOLS_HOUR_DATA,
+    Collection.TOKENS_DAY_DATA,
+    Collection.TOKENS_HOUR_DATA,
+    Collection.TICKS,
+]
+REBUILD_COLLECTION_NAMES = {
+    collection: f'{collection}{REBUILD_COLLECTION_SUFFIX}' for collection in REBUILD_COLLECTIONS
+}
+
+# fields the events transformer sets on the pools and tokens records, the rest comes from the indexer/token registry
+POOL_STATE_FIELDS = {
+    'sqrtPriceX96', 'tick', 'liquidity', 'token0Price', 'token1Price', 'feeGrowthGlobal0X128', 'feeGrowthGlobal1X128',
+    'totalValueLockedETH', 'totalValueLockedUSD', 'totalValueLockedToken0', 'totalValueLockedToken1', 'txCount',
+    'volumeToken0', 'volumeToken1', 'volumeUSD', 'untrackedVolumeUSD', 'feesUSD',
+}
+TOKEN_STATE_FIELDS = {
+    'derivedETH', 'totalValueLocked', 'totalValueLockedUSD', 'txCount', 'volume', 'volumeUSD', 'untrackedVolumeUSD',
+    'feesUSD',
+}
+
+
+async def get_initial_pool_record(pool: dict) -> dict:
+    return {field: value for field, value in pool.items() if field not in POOL_STATE_FIELDS}
+
+
+async def get_initial_token_record(token: dict) -> dict:
+    token = await decode_decimal128_fields({field: value for field, value in token.items()
+                                            if field not in TOKEN_STATE_FIELDS})
+    token['derivedETH'] = ZERO_DECIMAL
+    token['totalValueLocked'] = ZERO_DECIMAL
+    token['totalValueLockedUSD'] = ZERO_DECIMAL
+    return token
+
+
+async def encode_record(record: dict) -> dict:
+    return {field: to_decimal128(value) for field, value in record.items()}
+
+
+# State store of a rebuild: the factory, pools and tokens records start from their state before any event
+# and are kept in memory for the whole replay, they are only written once to the rebuild collections
+class RebuildStateStore(StateStore):
+    async def load(self):
+        self._factory = await decode_decimal128_fields(await create_factory_record())
+        pools_query = dict()
+        await filter_by_the_latest_value(pools_query)
+        async for pool in self.db[Collection.POOLS].find(pools_query):
+            self._pools[pool['poolAddress']] = await decode_decimal128_fields(await get_initial_pool_record(pool))
+        async for token in self.db[Collection.TOKENS].find():
+            self._tokens[token['tokenAddress']] = await get_initial_token_record(token)
+
+    async def get_pool(self, pool_address: str) -> dict:
+        return self._pools.get(pool_address)
+
+    async def _load_pool_ticks(self, pool_address: str) -> PoolTicks:
+        return PoolTicks(pool_address)
+
+    async def get_token(self, token_address: str) -> dict:
+        token = self._tokens.get(token_address)
+        if token is None:
+            token = await get_token_record(self.db, token_address, self.rpc_url)
+            token = self._tokens.setdefault(token_address, await get_initial_token_record(token))
+        return token
+
+    async def insert_rebuild_records(self):
+        await self.db[REBUILD_COLLECTION_NAMES[Collection.FACTORIES]].insert_one(
+            await encode_record(self._factory))
+
+        # versions of the pools replaced by a reorg are copied as they are
+        pools_query = {'_cursor.to': {'$ne': None}}
+        pool_documents = [pool async for pool in self.db[Collection.POOLS].find(pools_query)]
+        pool_documents.extend([await encode_record(pool) for pool in self._pools.values()])
+        if pool_documents:
+            await self.db[REBUILD_COLLECTION_NAMES[Collection.POOLS]].insert_many(pool_documents, ordered=False)
+
+        token_documents = [await encode_record(token) for token in self._tokens.values()]
+        if token_documents:
+            await self.db[REBUILD_COLLECTION_NAMES[Collection.TOKENS]].insert_many(token_documents, ordered=False)
+
+        tick_documents = [await encode_record(await pool_ticks.get(tick))
+                          for pool_ticks in self._pool_ticks.values() for tick in pool_ticks.ticks]
+        if tick_documents:
+            await self.db[REBUILD_COLLECTION_NAMES[Collection.TICKS]].insert_many(tick_documents, ordered=False)
+        logger.info(f'Inserted {len(pool_documents)} pools, {len(token_documents)} tokens and {len(tick_documents)} '
+                    f'ticks records to rebuild')
+
+
+async def yield_rebuild_records(db: AsyncDatabase) -> dict:
+    async for record in db[Collection.POOLS_DATA].find({}, batch_size=REBUILD_CURSOR_BATCH_SIZE).sort(
+            WATERMARK_SORT):
+        yield record
+
+
+async def create_rebuild_collections(db: AsyncDatabase):
+    # leftovers of an interrupted rebuild are dropped
+    for collection in REBUILD_COLLECTIONS:
+        await db.drop_collection(REBUILD_COLLECTION_NAMES[collection])
+        await db.create_collection(REBUILD_COLLECTION_NAMES[collection])
+
+
+async def insert_interval_buckets(db: AsyncDatabase, interval_updates: IntervalUpdates, timestamp: str | None = None):
+    await interval_updates.insert(db, REBUILD_COLLECTION_NAMES, timestamp)
+
+
+async def copy_indexes(db: AsyncDatabase, collection: str, target_collection: str):
+    async for index in await db[collection].list_indexes():
+        if index['name'] == '_id_':
+            continue
+        index_options = {option: value for option, value in index.items() if option not in {'v', 'key', 'ns'}}
+        await db[target_collection].create_index(list(index['key'].items()), **index_options)
+
+
+async def swap_rebuild_collections(db: AsyncDatabase):
+    # every rename is atomic, readers see either the old or the rebuilt collection
+    for collection in REBUILD_COLLECTIONS:
+        rebuild_collection = REBUILD_COLLECTION_NAMES[collection]
+        await copy_indexes(db, collection, rebuild_collection)
+        await db[rebuild_collection].rename(collection, dropTarget=True)
+        logger.info(f'Swapped in rebuilt {collection} collection')
@@ -0,0 +1,219 @@
+import asyncio
+from decimal import Decimal
+
+from pymongo import DeleteOne, InsertOne, UpdateOne
+from pymongo.asynchronous.database import AsyncDatabase
+
+from server.const import Collection, ETH_USDC_ADDRESS, FACTORY_ADDRESS
+from server.transform.eth_price import EthPrice
+from server.transform.pipeline import bulk_write_operations
+from server.transform.ticks import PoolTicks
+from server.query_utils import (
+    get_all_token_pools,
+    get_factory_record,
+    get_pool_record,
+    get_token_record,
+    filter_by_the_latest_value,
+)
+from server.utils import DECIMAL128_CONTEXT, decode_decimal128_fields, to_decimal, to_decimal128
+
+from structlog import get_logger
+
+
+logger = get_logger(__name__)
+
+
+async def apply_update_data(record: dict, update_data: dict) -> set:
+    changed_fields = set()
+    for field, value in update_data.get('$inc', {}).items():
+        value = to_decimal(value)
+        current_value = record.get(field)
+        if current_value is None:
+            record[field] = value
+        elif isinstance(value, Decimal):
+            record[field] = DECIMAL128_CONTEXT.add(current_value, value)
+        else:
+            record[field] = current_value + value
+        changed_fields.add(field)
+    for field, value in update_data.get('$set', {}).items():
+        record[field] = to_decimal(value)
+        changed_fields.add(field)
+    return changed_fields
+
+
+# Write-back cache for the factory, pools and tokens records: each record is read once,
+# updates are applied in memory and the changed fields are written back on flush.
+# Decimal128 fields are held as Decimal and converted back to Decimal128 only on flush
+class StateStore:
+    def __init__(self, db: AsyncDatabase, rpc_url: str):
+        self.db = db
+        self.rpc_url = rpc_url
+        self._factory = None
+        self._pools = dict()
+        self._tokens = dict()
+        self.eth_price = EthPrice()
+        # pricing graph: token -> addresses of its pools, in the order of the pools query
+        self._token_pools = dict()
+        # derivedETH found from the current state of the pools, dropped once one of its inputs changes
+        self._derived_eth = dict()
+        self._derived_eth_versions = dict()
+        self._derived_eth_dependents = dict()
+        self._dirty = {
+            Collection.FACTORIES: dict(),
+            Collection.POOLS: dict(),
+            Collection.TOKENS: dict(),
+        }
+        # records inserted by the handlers, written with the updates of their batch
+        self._inserts = dict()
+        # initialized ticks of the pools, a tick whose liquidity is all removed is deleted on flush
+        self._pool_ticks = dict()
+        self._dirty_ticks = dict()
+        # updates of other records made by the handlers, e.g. the fee state stored on the events
+        self._record_updates = dict()
+
+    async def get_factory(self) -> dict:
+        if self._factory is None:
+            self._factory = await decode_decimal128_fields(await get_factory_record(self.db))
+        return self._factory
+
+    async def get_pool(self, pool_address: str) -> dict:
+        pool = self._pools.get(pool_address)
+        if pool is None:
+            pool = await decode_decimal128_fields(await get_pool_record(self.db, pool_address))
+            if pool is not None:
+                if pool_address not in self._pools:
+                    self._pools[pool_address] = pool
+                    await self._add_to_token_pools(pool)
+                pool = self._pools[pool_address]
+        return pool
+
+    async def _add_to_token_pools(self, pool: dict):
+        # pools created after the token pools were loaded are appended, as the pools query would return them last
+        for token_address in (pool['token0'], pool['token1']):
+            pool_addresses = self._token_pools.get(token_address)
+            if pool_addresses is not None and pool['poolAddress'] not in pool_addresses:
+                pool_addresses.append(pool['poolAddress'])
+                await self._invalidate_derived_eth(token_address)
+
+    async def get_token_pools(self, token_address: str) -> list[dict]:
+        pool_addresses = self._token_pools.get(token_address)
+        if pool_addresses is None:
+            token_pools = await get_all_token_pools(self.db, token_address)
+            pool_addresses = self._token_pools.setdefault(
+                token_address, [pool['poolAddress'] for pool in token_pools])
+        return await asyncio.gather(*[self.get_pool(pool_address) for pool_address in list(pool_addresses)])
+
+    async def get_derived_eth(self, token_address: str) -> tuple:
+        return self._derived_eth.get(token_address), self._derived_eth_versions.get(token_address, 0)
+
+    async def set_derived_eth(self, token_address: str, derived_eth, version: int, source_token_addresses: set):
+        # skipped when an input changed while derivedETH was being found
+        if self._derived_eth_versions.get(token_address, 0) != version:
+            return
+        self._derived_eth[token_address] = derived_eth
+        for source_token_address in source_token_addresses:
+            self._derived_eth_dependents.setdefault(source_token_address, set()).add(token_address)
+
+    async def _invalidate_derived_eth(self, token_address: str):
+        self._derived_eth.pop(token_address, None)
+        self._derived_eth_versions[token_address] = self._derived_eth_versions.get(token_address, 0) + 1
+
+    async def get_token(self, token_address: str) -> dict:
+        token = self._tokens.get(token_address)
+        if token is None:
+            token = await decode_decimal128_fields(await get_token_record(self.db, token_address, self.rpc_url))
+            token = self._tokens.setdefault(token_address, token)
+        return token
+
+    async def get_tokens_from_pool(self, pool: dict) -> tuple[dict, dict]:
+        token0, token1 = await asyncio.gather(self.get_token(pool['token0']), self.get_token(pool['token1']))
+        return token0, token1
+
+    async def _mark_dirty(self, collection: str, key: str, record_filter: dict, record: dict, fields: set):
+        _, _, dirty_fields = self._dirty[collection].setdefault(key, (record_filter, record, set()))
+        dirty_fields.update(fields)
+
+    async def update_factory(self, factory_update_data: dict):
+        factory = await self.get_factory()
+        fields = await apply_update_data(factory, factory_update_data)
+        await self._mark_dirty(Collection.FACTORIES, FACTORY_ADDRESS, {'address': FACTORY_ADDRESS}, factory, fields)
+
+    async def load_eth_price(self, block: int):
+        await self.eth_price.update(await self.get_pool(ETH_USDC_ADDRESS), block)
+
+    async def update_pool(self, pool: dict, pool_update_data: dict, block: int | None = None):
+        fields = await apply_update_data(pool, pool_update_data)
+        if pool['poolAddress'] == ETH_USDC_ADDRESS and block is not None and fields & {'token0Price', 'token1Price'}:
+            await self.eth_price.update(pool, block)
+        await self._invalidate_derived_eth(pool['token0'])
+        await self._invalidate_derived_eth(pool['token1'])
+        pool_query = {'_id': pool['_id']}
+        await filter_by_the_latest_value(pool_query)
+        await self._mark_dirty(Collection.POOLS, pool['poolAddress'], pool_query, pool, fields)
+
+    async def update_token(self, token: dict, token_update_data: dict):
+        fields = await apply_update_data(token, token_update_data)
+        if 'derivedETH' in fields:
+            for dependent_token_address in self._derived_eth_dependents.pop(token['tokenAddress'], set()):
+                await self._invalidate_derived_eth(dependent_token_address)
+        await self._mark_dirty(Collection.TOKENS, token['tokenAddress'], {'_id': token['_id']}, token, fields)
+
+    async def update_tokens(self, token0: dict, token1: dict, token0_update_data: dict, token1_update_data: dict):
+        await self.update_token(token0, token0_update_data)
+        await self.update_token(token1, token1_update_data)
+
+    async def _load_pool_ticks(self, pool_address: str) -> PoolTicks:
+        ticks_query = {'poolAddress': pool_address}
+        records = [await decode_decimal128_fields(record)
+                   async for record in self.db[Collection.TICKS].find(ticks_query, {'_id': 0})]
+        return PoolTicks(pool_address, records)
+
+    async def get_pool_ticks(self, pool_address: str) -> PoolTicks:
+        pool_ticks = self._pool_ticks.get(pool_address)
+        if pool_ticks is None:
+            pool_ticks = self._pool_ticks.setdefault(pool_address, await self._load_pool_ticks(pool_address))
+        return pool_ticks
+
+    async def update_ticks(self, tick_records: list[dict]):
+        for record in tick_records:
+            self._dirty_ticks[(record['poolAddress'], record['tickIdx'])] = record
+
+    async def update_record(self, collection: str, record_filter: dict, update_data: dict):
+        self._record_updates.setdefault(collection, []).append(UpdateOne(record_filter, update_data))
+
+    async def get_record_update_operations(self) -> dict[str, list[UpdateOne]]:
+        record_updates = self._record_updates
+        self._record_updates = dict()
+        return record_updates
+
+    async def insert_record(self, collection: str, record: dict):
+        self._inserts.setdefault(collection, []).append(record)
+
+    async def get_flush_operations(self) -> dict[str, list[DeleteOne | InsertOne | UpdateOne]]:
+        # the changed fields are copied, the records can be updated again while the operations are written
+        flush_operations = dict()
+        for collection, dirty_records in self._dirty.items():
+            flush_operations[collection] = [
+                UpdateOne(record_filter, {'$set': {field: to_decimal128(record[field]) for field in fields}})
+                for record_filter, record, fields in dirty_records.values()
+            ]
+            dirty_records.clear()
+        flush_operations[Collection.TICKS] = []
+        for record in self._dirty_ticks.values():
+            tick_filter = {'poolAddress': record['poolAddress'], 'tickIdx': record['tickIdx']}
+            if record['liquidityGross'] > 0:
+                flush_operations[Collection.TICKS].append(UpdateOne(
+                    tick_filter, {'$set': {field: to_decimal128(value) for field, value in record.items()}},
+                    upsert=True))
+            else:
+                flush_operations[Collection.TICKS].append(DeleteOne(tick_filter))
+        self._dirty_ticks.clear()
+        for collection, records in self._inserts.items():
+            flush_operations.setdefault(collection, []).extend(InsertOne(record) for record in records)
+        self._inserts = dict()
+        for collection, operations in (await self.get_record_update_operations()).items():
+            flush_operations.setdefault(collection, []).extend(operations)
+        return flush_operations
+
+    async def flush(self):
+        await bulk_write_operations(self.db, await self.get_flush_operations())
@@ -0,0 +1,98 @@
+from bisect import bisect_left, insort
+from decimal import Decimal
+
+from pymongo import ASCENDING
+from pymongo.asynchronous.database import AsyncDatabase
+
+from server.const import Collection, Transformer, ZERO_DECIMAL
+from server.transform.progress import get_watermark
+from server.utils import DECIMAL128_CONTEXT, UINT256_MODULUS
+
+from structlog import get_logger
+
+
+logger = get_logger(__name__)
+
+
+TICK_INDEX = [('poolAddress', ASCENDING), ('tickIdx', ASCENDING)]
+FEE_GROWTH_OUTSIDE_FIELDS = {
+    'feeGrowthOutside0X128': 'feeGrowthGlobal0X128',
+    'feeGrowthOutside1X128': 'feeGrowthGlobal1X128',
+}
+
+
+async def create_ticks_index(db: AsyncDatabase):
+    await db[Collection.TICKS].create_index(TICK_INDEX, unique=True)
+
+
+async def save_ticks_complete(db: AsyncDatabase):
+    await db[Collection.TRANSFORMER_PROGRESS].update_one(
+        {'_id': Transformer.EVENTS}, {'$set': {'ticksComplete': True}}, upsert=True)
+
+
+async def check_ticks_complete(db: AsyncDatabase):
+    # the ticks are folded from the events, they are complete when the events transformer started from the first
+    # event or after a rebuild. On a database whose events were handled before, the burns of the older positions
+    # would be applied to ticks missing from the collection
+    progress_record = await db[Collection.TRANSFORMER_PROGRESS].find_one({'_id': Transformer.EVENTS})
+    if progress_record and progress_record.get('ticksComplete'):
+        return
+    if await get_watermark(db, Transformer.EVENTS, Collection.POOLS_DATA) is None:
+        await save_ticks_complete(db)
+        return
+    raise ValueError('The ticks collection was not built from the first event, '
+                     'run the events transformer with --rebuild once')
+
+
+async def get_tick_record(pool_address: str, tick: int) -> dict:
+    return {
+        'poolAddress': pool_address,
+        'tickIdx': tick,
+        'liquidityGross': ZERO_DECIMAL,
+        'liquidityNet': ZERO_DECIMAL,
+        'feeGrowthOutside0X128': '0x0',
+        'feeGrowthOutside1X128': '0x0',
+    }
+
+
+# Initialized ticks of a pool kept sorted, so the ticks crossed by a swap are found with a bisect.
+# Like in the pool contract a tick holds the liquidity added when the price crosses it upwards (liquidityNet),
+# the liquidity of the positions using it (liquidityGross) and the fee growth on its other side from the current tick
+class PoolTicks:
+    def __init__(self, pool_address: str, records: list[dict] | None = None):
+        self.pool_address = pool_address
+        self._records = {record['tickIdx']: record for record in records or []}
+        self.ticks = sorted(self._records)
+
+    async def get(self, tick: int) -> dict | None:
+        return self._records.get(tick)
+
+    async def update(self, pool: dict, tick: int, liquidity_delta: Decimal, upper: bool) -> dict:
+        record = self._records.get(tick)
+        if record is None:
+            record = self._records[tick] = await get_tick_record(self.pool_address, tick)
+            insort(self.ticks, tick)
+            # the fee growth before a tick is initialized is counted below it
+            if pool.get('tick') is not None and tick <= pool['tick']:
+                for outside_field, global_field in FEE_GROWTH_OUTSIDE_FIELDS.items():
+                    record[outside_field] = pool.get(global_field, '0x0')
+        record['liquidityGross'] = DECIMAL128_CONTEXT.add(record['liquidityGross'], liquidity_delta)
+        record['liquidityNet'] = DECIMAL128_CONTEXT.add(record['liquidityNet'],
+                                                        -liquidity_delta if upper else liquidity_delta)
+        if record['liquidityGross'] < ZERO_DECIMAL:
+            logger.error(f'Tick {tick} of pool {self.pool_address} has a negative liquidityGross, '
+                         f'the ticks collection is out of sync with the events, run a --rebuild',
+                         liquidityGross=str(record['liquidityGross']))
+        if record['liquidityGross'] <= ZERO_DECIMAL:
+            del self._records[tick]
+            del self.ticks[bisect_left(self.ticks, tick)]
+        return record
+
+    async def cross(self, tick: int, fee_growth: dict) -> dict:
+        # a swap crossed the tick, its outside fee growth flips to the other side, taken against the fee growth
+        # at the crossing
+        record = self._records[tick]
+        for outside_field, global_field in FEE_GROWTH_OUTSIDE_FIELDS.items():
+            record[outside_field] = hex(
+                (int(fee_growth[global_field], 16) - int(record[outside_field], 16)) % UINT256_MODULUS)
+        return record
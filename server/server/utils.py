@@ -1,9 +1,19 @@
 from decimal import Decimal
 
 from bson import Decimal128
+from bson.decimal128 import create_decimal128_context
 from datetime import datetime
 
 
+# Mongo applies $inc on Decimal128 fields with the IEEE 754 decimal128 rules
+DECIMAL128_CONTEXT = create_decimal128_context()
+
+# token decimals are an uint8, the scale of every amount is looked up instead of raising 10 to a Decimal power
+POWERS_OF_TEN = tuple(Decimal(10) ** Decimal(decimals) for decimals in range(256))
+
+UINT256_MODULUS = 2 ** 256
+
+
 async def safe_div(amount0: Decimal, amount1: Decimal) -> Decimal:
     if amount1 == Decimal(0):
         return Decimal(0)
@@ -17,9 +27,41 @@ async def amount_after_decimals(amount: int | Decimal, decimals: int) -> Decimal
 
 
 async def exponent_to_decimal(decimals: int) -> Decimal:
+    if isinstance(decimals, int) and 0 <= decimals < len(POWERS_OF_TEN):
+        return POWERS_OF_TEN[decimals]
     return Decimal(10) ** Decimal(decimals)
 
 
+# Numbers are kept as Decimal in memory and only converted from/to Decimal128 when read from/written to Mongo,
+# a Decimal is rounded the way Mongo would store it so in-memory state matches the persisted one
+def to_decimal(value):
+    if isinstance(value, Decimal128):
+        return value.to_decimal()
+    if isinstance(value, Decimal):
+        return DECIMAL128_CONTEXT.create_decimal(value)
+    return value
+
+
+def to_decimal128(value):
+    if isinstance(value, Decimal):
+        return Decimal128(DECIMAL128_CONTEXT.create_decimal(value))
+    return value
+
+
+async def decode_decimal128_fields(record: dict | None) -> dict | None:
+    if record is not None:
+        for field, value in record.items():
+            if isinstance(value, Decimal128):
+                record[field] = value.to_decimal()
+    return record
+
+
+async def decode_u256(felts: list[int]) -> int:
+    # Cairo serializes an u256 as its low and high 128 bits felts
+    low, high = felts
+    return low + (high << 128)
+
+
 def format_address(address: str) -> str:
     return hex(int(address, 16))
 
@@ -0,0 +1,7 @@
+from dotenv import load_dotenv
+
+from server.cli import ENV_FILE
+
+
+# server.const reads the network config when it is imported
+load_dotenv(ENV_FILE)
@@ -0,0 +1,255 @@
+import asyncio
+
+from bson import Decimal128
+
+from server.const import Collection, Event
+from server.transform.fee_engine import (
+    find_position_fee_growth_inside,
+    get_fee_checkpoint,
+    get_fee_growth_inside,
+    get_fees_owed,
+    get_position_uncollected_fees,
+)
+from server.utils import UINT256_MODULUS
+
+
+ETH = '0x49d36570d4e46f48e99674bd3fcc84644ddd6b96f7c741b1562b82f9e004dc7'
+USDC = '0x53c91253bc9682c04929ca02ed00b3e423f6710d2ee7e0d5ebb06f3ecf368a8'
+POSITION_RECORD = {'positionId': '0x7', 'token0Address': ETH, 'token1Address': USDC, 'poolFee': 3000}
+Q128 = 2 ** 128
+# a 0.06% swap of 1e18 to the sqrt(1.01) price on 2e18 of liquidity (SwapMath tests of the pool contract) pays a fee
+# of 5988667735148, the fee growth it adds and the fees owed to the only position in range
+SWAP_FEE_GROWTH = 5988667735148 * Q128 // (2 * 10 ** 18)
+SWAP_LIQUIDITY = 2 * 10 ** 18
+SWAP_FEES_OWED = 5988667735147
+
+
+async def get_field(document: dict, field: str):
+    for key in field.split('.'):
+        if isinstance(document, list):
+            # a path through an array matches any of its elements
+            document = [element[key] for element in document if isinstance(element, dict) and key in element]
+            continue
+        if not isinstance(document, dict) or key not in document:
+            return None, False
+        document = document[key]
+    return document, True
+
+
+async def matches(document: dict, query: dict) -> bool:
+    for field, condition in query.items():
+        value, exists = await get_field(document, field)
+        if not isinstance(condition, dict):
+            if value != condition and not (isinstance(value, list) and condition in value):
+                return False
+        elif '$exists' in condition:
+            if exists != condition['$exists']:
+                return False
+        elif '$in' in condition:
+            if value not in condition['$in']:
+                return False
+        elif '$lt' in condition:
+            if not exists or value >= condition['$lt']:
+                return False
+        elif '$lte' in condition:
+            if not exists or value > condition['$lte']:
+                return False
+    return True
+
+
+# In-memory collection answering the find_one queries of the fee engine
+class MemoryCollection:
+    def __init__(self, documents: list[dict]):
+        self.documents = documents
+
+    async def find_one(self, query: dict, projection: dict | None = None, sort: list | None = None) -> dict | None:
+        found = [document for document in self.documents if await matches(document, query)]
+        for field, direction in reversed(sort or []):
+            found.sort(key=lambda document: document.get(field, 0), reverse=direction < 0)
+        return found[0] if found else None
+
+
+async def get_mint_record(pool_address: str, event_index: int, fee_growth_inside: int) -> dict:
+    return {
+        'poolAddress': pool_address,
+        'event': Event.MINT,
+        'block': 100,
+        'txIndex': 2,
+        'eventIndex': event_index,
+        'tickLower': -600,
+        'tickUpper': 600,
+        'feeState': {
+            'feeGrowthInside0X128': hex(fee_growth_inside),
+            'feeGrowthInside1X128': hex(fee_growth_inside + 1),
+        },
+    }
+
+
+def test_multicall_position_takes_the_fee_growth_of_its_pool():
+    async def run():
+        # one multicall mints positions with the same ticks in the 0.3% pool and then in the 1% pool
+        db = {
+            Collection.POOLS: MemoryCollection([
+                {'poolAddress': '0x30', 'token0': ETH, 'token1': USDC, 'fee': 3000, '_cursor': {'to': None}},
+                {'poolAddress': '0x100', 'token0': ETH, 'token1': USDC, 'fee': 10000, '_cursor': {'to': None}},
+            ]),
+            Collection.POOLS_DATA: MemoryCollection([
+                await get_mint_record('0x30', 1, 30),
+                await get_mint_record('0x100', 4, 100),
+            ]),
+        }
+        record = {'positionId': '0x7', 'block': 100, 'txIndex': 2, 'eventIndex': 6, 'tickLower': -600,
+                  'tickUpper': 600, 'token0Address': ETH, 'token1Address': USDC, 'poolFee': 3000}
+        assert await find_position_fee_growth_inside(db, record, POSITION_RECORD) == ('0x30', (30, 31))
+
+        record['poolFee'] = 10000
+        assert await find_position_fee_growth_inside(db, record, POSITION_RECORD) == ('0x100', (100, 101))
+
+        # the event without its pool details falls back to the position record
+        del record['token0Address'], record['token1Address'], record['poolFee']
+        assert await find_position_fee_growth_inside(db, record, POSITION_RECORD) == ('0x30', (30, 31))
+
+    asyncio.run(run())
+
+
+def test_position_without_a_known_pool_has_no_fee_growth():
+    async def run():
+        db = {
+            Collection.POOLS: MemoryCollection([]),
+            Collection.POOLS_DATA: MemoryCollection([await get_mint_record('0x30', 1, 30)]),
+        }
+        record = {'positionId': '0x7', 'block': 100, 'txIndex': 2, 'eventIndex': 6, 'tickLower': -600,
+                  'tickUpper': 600}
+        assert await find_position_fee_growth_inside(db, record, POSITION_RECORD) is None
+
+    asyncio.run(run())
+
+
+async def get_fee_state(tick: int, fee_growth_global0: int, fee_growth_global1: int, ticks: list[dict]) -> dict:
+    return {
+        'feeGrowthGlobal0X128': hex(fee_growth_global0),
+        'feeGrowthGlobal1X128': hex(fee_growth_global1),
+        'tick': tick,
+        'ticks': ticks,
+    }
+
+
+async def get_tick(tick: int, fee_growth_outside0: int, fee_growth_outside1: int) -> dict:
+    return {
+        'tickIdx': tick,
+        'feeGrowthOutside0X128': hex(fee_growth_outside0),
+        'feeGrowthOutside1X128': hex(fee_growth_outside1),
+    }
+
+
+def test_fee_growth_inside_matches_the_contract():
+    async def run():
+        # getFeeGrowthInside cases of the Tick tests of the pool contract
+        assert await get_fee_growth_inside(await get_fee_state(0, 15, 15, []), -2, 2, None, None) == (15, 15)
+        assert await get_fee_growth_inside(await get_fee_state(4, 15, 15, []), -2, 2, None, None) == (0, 0)
+        assert await get_fee_growth_inside(await get_fee_state(-4, 15, 15, []), -2, 2, None, None) == (0, 0)
+        assert await get_fee_growth_inside(
+            await get_fee_state(0, 15, 15, []), -2, 2, None, await get_tick(2, 2, 3)) == (13, 12)
+        assert await get_fee_growth_inside(
+            await get_fee_state(0, 15, 15, []), -2, 2, await get_tick(-2, 2, 3), None) == (13, 12)
+        assert await get_fee_growth_inside(
+            await get_fee_state(0, 15, 15, []), -2, 2, await get_tick(-2, 2, 3), await get_tick(2, 4, 1)) == (9, 11)
+        # overflow on the inside tick
+        assert await get_fee_growth_inside(
+            await get_fee_state(0, 15, 15, []), -2, 2,
+            await get_tick(-2, UINT256_MODULUS - 4, UINT256_MODULUS - 3), await get_tick(2, 3, 5)) == (16, 13)
+
+    asyncio.run(run())
+
+
+def test_fees_owed_match_the_contract():
+    async def run():
+        assert await get_fees_owed(SWAP_LIQUIDITY, (SWAP_FEE_GROWTH, 0), (0, 0)) == (SWAP_FEES_OWED, 0)
+        # the fee growth inside wraps around like the uint256 of the contract
+        assert await get_fees_owed(Q128, (16, 13), (UINT256_MODULUS - 4, 13)) == (20, 0)
+        # a decreasing fee growth inside leaves the fees owed unknown, without liquidity nothing is owed anyway
+        assert await get_fees_owed(SWAP_LIQUIDITY, (SWAP_FEE_GROWTH - 1, 0), (SWAP_FEE_GROWTH, 0)) is None
+        assert await get_fees_owed(0, (SWAP_FEE_GROWTH - 1, 0), (SWAP_FEE_GROWTH, 0)) == (0, 0)
+
+    asyncio.run(run())
+
+
+async def get_checkpoint(liquidity: int, fee_growth_inside: int, fees_owed: int) -> dict:
+    return {
+        'poolAddress': '0x30',
+        'tickLower': -600,
+        'tickUpper': 600,
+        'liquidity': str(liquidity),
+        'feeGrowthInside0LastX128': hex(fee_growth_inside),
+        'feeGrowthInside1LastX128': hex(fee_growth_inside),
+        'feesOwed0': hex(fees_owed),
+        'feesOwed1': hex(0),
+    }
+
+
+def test_fee_checkpoint_adds_the_fees_earned_since_the_previous_one():
+    async def run():
+        # the position deposited at a fee growth inside of 0, the swap fee is earned before the next Mint
+        mint_record = await get_mint_record('0x30', 1, SWAP_FEE_GROWTH)
+        mint_record['feeState']['feeGrowthInside1X128'] = hex(0)
+        db = {
+            Collection.POOLS: MemoryCollection([
+                {'poolAddress': '0x30', 'token0': ETH, 'token1': USDC, 'fee': 3000, '_cursor': {'to': None}},
+            ]),
+            Collection.POOLS_DATA: MemoryCollection([mint_record]),
+        }
+        position_record = dict(POSITION_RECORD, liquidity=Decimal128(str(SWAP_LIQUIDITY)),
+                               feeCheckpoint=await get_checkpoint(SWAP_LIQUIDITY, 0, 5))
+        record = {'positionId': '0x7', 'block': 100, 'txIndex': 2, 'eventIndex': 6, 'tickLower': -600,
+                  'tickUpper': 600}
+        checkpoint = await get_fee_checkpoint(db, record, position_record, 10 ** 18, (5, 0))
+        assert checkpoint == {
+            'poolAddress': '0x30',
+            'tickLower': -600,
+            'tickUpper': 600,
+            'liquidity': str(3 * 10 ** 18),
+            'feeGrowthInside0LastX128': hex(SWAP_FEE_GROWTH),
+            'feeGrowthInside1LastX128': hex(0),
+            'feesOwed0': hex(SWAP_FEES_OWED),
+            'feesOwed1': hex(0),
+        }
+
+        # a fee growth inside below the previous checkpoint breaks the chain
+        position_record['feeCheckpoint'] = await get_checkpoint(SWAP_LIQUIDITY, SWAP_FEE_GROWTH + 2, 5)
+        assert await get_fee_checkpoint(db, record, position_record, 10 ** 18) is None
+
+    asyncio.run(run())
+
+
+def test_position_uncollected_fees_as_of_a_block():
+    async def run():
+        ticks = [await get_tick(-600, 0, 0), await get_tick(600, 0, 0)]
+        pools_data = MemoryCollection([
+            {'poolAddress': '0x30', 'block': 100, 'txIndex': 2, 'eventIndex': 1,
+             'feeState': await get_fee_state(0, 0, 0, ticks)},
+            {'poolAddress': '0x30', 'block': 110, 'txIndex': 0, 'eventIndex': 0,
+             'feeState': await get_fee_state(0, SWAP_FEE_GROWTH, SWAP_FEE_GROWTH, [])},
+        ])
+        positions_data = MemoryCollection([
+            {'positionId': '0x7', 'block': 100, 'txIndex': 2, 'eventIndex': 6,
+             'feeCheckpoint': await get_checkpoint(SWAP_LIQUIDITY, 0, 5)},
+        ])
+        db = {Collection.POOLS_DATA: pools_data, Collection.POSITIONS_DATA: positions_data}
+        assert await get_position_uncollected_fees(db, POSITION_RECORD, 99) is None
+        assert await get_position_uncollected_fees(db, POSITION_RECORD, 105) == (5, 0)
+        assert await get_position_uncollected_fees(db, POSITION_RECORD, 110) == (5 + SWAP_FEES_OWED, SWAP_FEES_OWED)
+
+        # a fee state moved backwards from the checkpoint falls back to the collect simulation
+        pools_data.documents.append({'poolAddress': '0x30', 'block': 120, 'txIndex': 0, 'eventIndex': 0,
+                                     'feeState': await get_fee_state(0, SWAP_FEE_GROWTH - 1, SWAP_FEE_GROWTH, [])})
+        positions_data.documents.append({'positionId': '0x7', 'block': 115, 'txIndex': 0, 'eventIndex': 0,
+                                         'feeCheckpoint': await get_checkpoint(SWAP_LIQUIDITY, SWAP_FEE_GROWTH, 9)})
+        assert await get_position_uncollected_fees(db, POSITION_RECORD, 115) == (9, 0)
+        assert await get_position_uncollected_fees(db, POSITION_RECORD, 120) is None
+
+        # without liquidity the fees owed of the checkpoint are all there is
+        positions_data.documents.append({'positionId': '0x7', 'block': 116, 'txIndex': 0, 'eventIndex': 0,
+                                         'feeCheckpoint': await get_checkpoint(0, SWAP_FEE_GROWTH, 9)})
+        assert await get_position_uncollected_fees(db, POSITION_RECORD, 120) == (9, 0)
+
+    asyncio.run(run())
@@ -0,0 +1,264 @@
+import asyncio
+from decimal import Decimal
+
+from structlog.testing import capture_logs
+
+import server.transform.fee_growth
+from server.transform.fee_growth import (
+    FEE_DENOMINATOR,
+    MAX_TICK,
+    MIN_TICK,
+    Q96,
+    Q128,
+    ceil_div,
+    get_amount_in,
+    get_sqrt_ratio_at_tick,
+    get_swap_fee_growth,
+    reconcile_pool_fee_growth,
+)
+from server.transform.ticks import PoolTicks
+from server.utils import UINT256_MODULUS
+
+
+# sqrt(1.01) * 2**96, the price target of the SwapMath tests of the pool contract
+SQRT_PRICE_101_100 = 79623317895830914510639640423
+
+
+async def get_tick_at_sqrt_ratio(sqrt_price: int) -> int:
+    low, high = MIN_TICK, MAX_TICK
+    while low < high:
+        middle = (low + high + 1) // 2
+        if await get_sqrt_ratio_at_tick(middle) <= sqrt_price:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+async def get_next_initialized_tick_within_one_word(bitmap: dict[int, int], tick: int, tick_spacing: int,
+                                                   lte: bool) -> tuple[int, bool]:
+    # TickBitmap of the pool contract
+    compressed = tick // tick_spacing
+    if lte:
+        bit_pos = compressed % 256
+        masked = bitmap.get(compressed >> 8, 0) & ((1 << bit_pos) - 1 + (1 << bit_pos))
+        if masked:
+            return (compressed - (bit_pos - (masked.bit_length() - 1))) * tick_spacing, True
+        return (compressed - bit_pos) * tick_spacing, False
+    bit_pos = (compressed + 1) % 256
+    masked = bitmap.get((compressed + 1) >> 8, 0) & ~((1 << bit_pos) - 1)
+    if masked:
+        return (compressed + 1 + ((masked & -masked).bit_length() - 1 - bit_pos)) * tick_spacing, True
+    return (compressed + 1 + (255 - bit_pos)) * tick_spacing, False
+
+
+async def get_next_sqrt_price_from_input(sqrt_price: int, liquidity: int, amount_in: int, zero_for_one: bool) -> int:
+    if zero_for_one:
+        numerator = liquidity << 96
+        return await ceil_div(numerator * sqrt_price, numerator + amount_in * sqrt_price)
+    return sqrt_price + (amount_in << 96) // liquidity
+
+
+async def compute_swap_step(sqrt_price: int, sqrt_price_target: int, liquidity: int, amount_remaining: int,
+                            fee: int) -> tuple[int, int, int]:
+    # exact input step of the SwapMath of the pool contract
+    zero_for_one = sqrt_price >= sqrt_price_target
+    amount_remaining_less_fee = amount_remaining * (FEE_DENOMINATOR - fee) // FEE_DENOMINATOR
+    amount_in = await get_amount_in(sqrt_price, sqrt_price_target, liquidity, zero_for_one)
+    if amount_remaining_less_fee >= amount_in:
+        return sqrt_price_target, amount_in, await ceil_div(amount_in * fee, FEE_DENOMINATOR - fee)
+    sqrt_price_next = await get_next_sqrt_price_from_input(sqrt_price, liquidity, amount_remaining_less_fee,
+                                                           zero_for_one)
+    amount_in = await get_amount_in(sqrt_price, sqrt_price_next, liquidity, zero_for_one)
+    return sqrt_price_next, amount_in, amount_remaining - amount_in
+
+
+# Exact input swap of the pool contract, walked step by step from the amount: returns the Swap event and the fee
+# growth of every crossed tick at its crossing
+async def simulate_swap(pool: dict, ticks: dict[int, int], amount_specified: int, zero_for_one: bool,
+                        sqrt_price_limit: int) -> tuple[dict, dict, dict[int, int]]:
+    field = 'feeGrowthGlobal0X128' if zero_for_one else 'feeGrowthGlobal1X128'
+    fee_growth_global = int(pool[field], 16)
+    sqrt_price, tick, liquidity = int(pool['sqrtPriceX96']), pool['tick'], int(pool['liquidity'])
+    amount_remaining = amount_specified
+    crossings = {}
+    bitmap = {}
+    for initialized_tick in ticks:
+        compressed = initialized_tick // pool['tickSpacing']
+        bitmap[compressed >> 8] = bitmap.get(compressed >> 8, 0) | 1 << compressed % 256
+    while amount_remaining != 0 and sqrt_price != sqrt_price_limit:
+        tick_next, initialized = await get_next_initialized_tick_within_one_word(bitmap, tick, pool['tickSpacing'],
+                                                                                 zero_for_one)
+        tick_next = min(max(tick_next, MIN_TICK), MAX_TICK)
+        sqrt_price_next = await get_sqrt_ratio_at_tick(tick_next)
+        if zero_for_one:
+            sqrt_price_target = max(sqrt_price_next, sqrt_price_limit)
+        else:
+            sqrt_price_target = min(sqrt_price_next, sqrt_price_limit)
+        sqrt_price_start = sqrt_price
+        sqrt_price, amount_in, fee_amount = await compute_swap_step(sqrt_price, sqrt_price_target, liquidity,
+                                                                    amount_remaining, pool['fee'])
+        amount_remaining -= amount_in + fee_amount
+        if pool.get('feeProtocol', 0) > 0:
+            fee_amount -= fee_amount // pool['feeProtocol']
+        if liquidity > 0:
+            fee_growth_global = (fee_growth_global + fee_amount * Q128 // liquidity) % UINT256_MODULUS
+        if sqrt_price == sqrt_price_next:
+            if initialized:
+                crossings[tick_next] = fee_growth_global
+                liquidity += -ticks[tick_next] if zero_for_one else ticks[tick_next]
+            tick = tick_next - 1 if zero_for_one else tick_next
+        elif sqrt_price != sqrt_price_start:
+            tick = await get_tick_at_sqrt_ratio(sqrt_price)
+    amount_in = amount_specified - amount_remaining
+    record = {
+        'block': 1,
+        'amount0': str(amount_in if zero_for_one else -1),
+        'amount1': str(-1 if zero_for_one else amount_in),
+        'sqrtPriceX96': str(sqrt_price),
+        'tick': tick,
+        'liquidity': str(liquidity),
+    }
+    return record, {field: hex(fee_growth_global)}, crossings
+
+
+async def get_pool_ticks(pool: dict, positions: list[tuple[int, int, int]]) -> tuple[PoolTicks, dict[int, int]]:
+    pool_ticks = PoolTicks(pool['poolAddress'])
+    ticks = {}
+    for tick_lower, tick_upper, liquidity in positions:
+        await pool_ticks.update(pool, tick_lower, Decimal(liquidity), upper=False)
+        await pool_ticks.update(pool, tick_upper, Decimal(liquidity), upper=True)
+        ticks[tick_lower] = ticks.get(tick_lower, 0) + liquidity
+        ticks[tick_upper] = ticks.get(tick_upper, 0) - liquidity
+    return pool_ticks, ticks
+
+
+async def get_pool(tick: int, liquidity: int, fee_protocol: int = 0) -> dict:
+    return {
+        'poolAddress': '0x1',
+        'fee': 3000,
+        'tickSpacing': 60,
+        'feeProtocol': fee_protocol,
+        'tick': tick,
+        'sqrtPriceX96': str(await get_sqrt_ratio_at_tick(tick)),
+        'liquidity': Decimal(liquidity),
+        'feeGrowthGlobal0X128': hex(5 * Q128),
+        'feeGrowthGlobal1X128': hex(7 * Q128),
+    }
+
+
+def test_sqrt_ratio_at_tick():
+    async def run():
+        assert await get_sqrt_ratio_at_tick(0) == Q96
+        # MIN_SQRT_RATIO and MAX_SQRT_RATIO of the TickMath of the pool contract
+        assert await get_sqrt_ratio_at_tick(MIN_TICK) == 4295128739
+        assert await get_sqrt_ratio_at_tick(MAX_TICK) == 1461446703485210103287273052203988822378723970342
+
+    asyncio.run(run())
+
+
+def test_swap_steps_match_the_contract():
+    async def run():
+        # SwapMath tests of the pool contract: 1e18 of token1 in at a fee of 600 over a liquidity of 2e18
+        liquidity = 2 * 10 ** 18
+        assert await compute_swap_step(Q96, SQRT_PRICE_101_100, liquidity, 10 ** 18, 600) == (
+            SQRT_PRICE_101_100, 9975124224178055, 5988667735148)
+        sqrt_price_next, amount_in, fee_amount = await compute_swap_step(Q96, 10 * Q96 // 3, liquidity, 10 ** 18, 600)
+        assert (amount_in, fee_amount) == (999400000000000000, 600000000000000)
+
+        # the same steps walked from their Swap events
+        for sqrt_price_end, amount1 in ((SQRT_PRICE_101_100, 9975124224178055 + 5988667735148),
+                                        (sqrt_price_next, 10 ** 18)):
+            # a tick spacing wide enough for the steps to stay within one bitmap word
+            pool = {'poolAddress': '0x1', 'fee': 600, 'tickSpacing': 200, 'tick': 0, 'sqrtPriceX96': str(Q96),
+                    'liquidity': Decimal(liquidity)}
+            record = {'block': 1, 'amount0': '-1', 'amount1': str(amount1), 'sqrtPriceX96': str(sqrt_price_end),
+                      'liquidity': str(liquidity)}
+            fee_amount = amount1 - await get_amount_in(Q96, sqrt_price_end, liquidity, False)
+            fee_growth, crossed_tick_records = await get_swap_fee_growth(pool, PoolTicks('0x1'), record)
+            assert fee_growth == {'feeGrowthGlobal0X128': '0x0',
+                                  'feeGrowthGlobal1X128': hex(fee_amount * Q128 // liquidity)}
+            assert crossed_tick_records == []
+        assert fee_amount == 600000000000000
+
+    asyncio.run(run())
+
+
+def test_swap_fee_growth_walks_the_crossed_ticks():
+    async def run():
+        # the swaps down from tick 180 also step at the bitmap word boundaries of ticks 0 and -15360
+        positions = [(-30000, 30000, 10 ** 20), (-12000, -6000, 3 * 10 ** 19), (-600, 600, 5 * 10 ** 19),
+                     (-17940, 240, 7 * 10 ** 18)]
+        for zero_for_one, amount, fee_protocol, crossed_ticks in ((True, 3 * 10 ** 19, 0, 1),
+                                                                  (False, 2 * 10 ** 19, 0, 2),
+                                                                  (True, 10 ** 21, 6, 4),
+                                                                  (True, 10 ** 15, 4, 0)):
+            pool = await get_pool(180, 10 ** 20 + 5 * 10 ** 19 + 7 * 10 ** 18, fee_protocol)
+            pool_ticks, ticks = await get_pool_ticks(pool, positions)
+            sqrt_price_limit = await get_sqrt_ratio_at_tick(-29000 if zero_for_one else 29000)
+            record, expected_fee_growth, crossings = await simulate_swap(pool, ticks, amount, zero_for_one,
+                                                                         sqrt_price_limit)
+            field = next(iter(expected_fee_growth))
+            other_field = 'feeGrowthGlobal1X128' if zero_for_one else 'feeGrowthGlobal0X128'
+
+            with capture_logs() as logs:
+                fee_growth, crossed_tick_records = await get_swap_fee_growth(pool, pool_ticks, record)
+            assert logs == []
+            assert fee_growth[field] == expected_fee_growth[field]
+            assert fee_growth[other_field] == pool[other_field]
+            # every crossed tick flipped its outside fee growth against the fee growth at its crossing
+            assert len(crossings) == crossed_ticks
+            assert [tick_record['tickIdx'] for tick_record in crossed_tick_records] == list(crossings)
+            outside_field = field.replace('Global', 'Outside')
+            for tick_record in crossed_tick_records:
+                outside = 0 if tick_record['tickIdx'] > 180 else int(pool[field], 16)
+                assert tick_record[outside_field] == hex(crossings[tick_record['tickIdx']] - outside)
+
+    asyncio.run(run())
+
+
+def test_swap_fee_growth_without_liquidity():
+    async def run():
+        pool = await get_pool(0, 0)
+        record = {'block': 1, 'amount0': '1000', 'amount1': '0',
+                  'sqrtPriceX96': str(await get_sqrt_ratio_at_tick(-100)), 'liquidity': '0'}
+        fee_growth, crossed_tick_records = await get_swap_fee_growth(pool, PoolTicks('0x1'), record)
+        assert fee_growth == {'feeGrowthGlobal0X128': pool['feeGrowthGlobal0X128'],
+                              'feeGrowthGlobal1X128': pool['feeGrowthGlobal1X128']}
+        assert crossed_tick_records == []
+
+    asyncio.run(run())
+
+
+class MemoryStore:
+    def __init__(self, pool: dict):
+        self.pool = pool
+
+    async def get_pool(self, pool_address: str) -> dict:
+        return self.pool
+
+    async def update_pool(self, pool: dict, pool_update_data: dict):
+        pool.update(pool_update_data['$set'])
+
+
+def test_reconciliation_never_moves_the_fee_growth_backwards(monkeypatch):
+    async def get_pool_fee_growth_global(pool_address: str, rpc_url: str, block: int) -> tuple[int, int]:
+        return 4 * Q128, 9 * Q128
+
+    async def get_pool_fee_protocol(pool_address: str, rpc_url: str, block: int) -> int:
+        return 5
+
+    monkeypatch.setattr(server.transform.fee_growth, 'get_pool_fee_growth_global', get_pool_fee_growth_global)
+    monkeypatch.setattr(server.transform.fee_growth, 'get_pool_fee_protocol', get_pool_fee_protocol)
+
+    async def run():
+        pool = await get_pool(0, 10 ** 18)
+        with capture_logs() as logs:
+            assert await reconcile_pool_fee_growth(MemoryStore(pool), '0x1', 'rpc', 100)
+        # the token0 fee growth ahead of the contract is kept, the token1 one behind it moves forward
+        assert pool['feeGrowthGlobal0X128'] == hex(5 * Q128)
+        assert pool['feeGrowthGlobal1X128'] == hex(9 * Q128)
+        assert pool['feeProtocol'] == 5
+        assert sorted(log['log_level'] for log in logs) == ['error', 'warning', 'warning']
+
+    asyncio.run(run())
@@ -0,0 +1,49 @@
+import asyncio
+
+import server.transform.position_valuation
+from server.transform.position_valuation import PositionValuation, value_positions
+
+
+def test_trigger_within_the_interval_runs_once_after_it(monkeypatch):
+    async def run():
+        runs = []
+
+        async def get_positions_by_pool(db):
+            runs.append(asyncio.get_running_loop().time())
+            return {}
+
+        async def get_empty(*args):
+            return {}
+
+        async def get_pool_eth_price(pool):
+            return 0
+
+        async def bulk_write_operations(db, operations):
+            pass
+
+        monkeypatch.setattr(server.transform.position_valuation, 'POSITIONS_VALUATION_INTERVAL', 0.2)
+        monkeypatch.setattr(PositionValuation, 'valued_at', None)
+        monkeypatch.setattr(PositionValuation, 'trailing_run', None)
+        for name, func in (('get_pools_by_key', get_empty), ('get_tokens', get_empty),
+                           ('get_pool_record', get_empty), ('get_pool_eth_price', get_pool_eth_price),
+                           ('get_positions_by_pool', get_positions_by_pool),
+                           ('bulk_write_operations', bulk_write_operations)):
+            monkeypatch.setattr(server.transform.position_valuation, name, func)
+
+        await value_positions(None)
+        assert len(runs) == 1
+
+        # the triggers within the interval are not dropped, they make a single run once the interval is over
+        await value_positions(None)
+        await asyncio.sleep(0.05)
+        await value_positions(None)
+        assert len(runs) == 1
+        await asyncio.sleep(0.3)
+        assert len(runs) == 2
+        assert runs[1] - runs[0] >= 0.2
+
+        # without a trigger nothing runs after the trailing run
+        await asyncio.sleep(0.3)
+        assert len(runs) == 2
+
+    asyncio.run(run())
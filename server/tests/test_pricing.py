@@ -0,0 +1,73 @@
+import asyncio
+import random
+from decimal import Decimal
+
+from server.const import ETH, ETH_USDC_ADDRESS, STABLECOINS
+from server.transform.pricing import find_eth_per_token, sqrt_price_x96_to_token_prices
+from server.transform.state_store import StateStore
+from server.utils import amount_after_decimals
+
+
+MIN_SQRT_RATIO = 4295128739
+MAX_SQRT_RATIO = 1461446703485210103287273052203988822378723970342
+
+
+# the amounts and prices as computed before the powers of ten and Q192 were precomputed
+async def reference_amount_after_decimals(amount: int | Decimal, decimals: int) -> Decimal:
+    return Decimal(amount) / Decimal(10) ** Decimal(decimals)
+
+
+async def reference_token_prices(sqrt_price_x96: int | str, token0_decimals: int,
+                                 token1_decimals: int) -> tuple[Decimal, Decimal]:
+    num = Decimal(sqrt_price_x96) ** 2
+    price1 = num / Decimal(2 ** 192) * Decimal(10) ** Decimal(token0_decimals) / Decimal(10) ** Decimal(token1_decimals)
+    price0 = Decimal(0) if price1 == Decimal(0) else Decimal('1') / price1
+    return price0, price1
+
+
+def get_sqrt_prices(rnd: random.Random) -> list[int | str]:
+    sqrt_prices = [0, 1, MIN_SQRT_RATIO, MAX_SQRT_RATIO, 2 ** 96, str(2 ** 96)]
+    for _ in range(5000):
+        sqrt_price = rnd.choice([rnd.randint(MIN_SQRT_RATIO, MAX_SQRT_RATIO), rnd.randint(2 ** 90, 2 ** 100)])
+        sqrt_prices.append(str(sqrt_price) if rnd.random() < 0.5 else sqrt_price)
+    return sqrt_prices
+
+
+def test_token_prices_match_the_decimal_reference():
+    async def run():
+        rnd = random.Random(1)
+        for sqrt_price in get_sqrt_prices(rnd):
+            token0_decimals, token1_decimals = rnd.choice([(18, 6), (6, 18), (18, 18), (8, 18)])
+            if rnd.random() < 0.2:
+                token0_decimals, token1_decimals = rnd.randint(0, 300), rnd.randint(0, 300)
+            prices = await sqrt_price_x96_to_token_prices(sqrt_price, token0_decimals, token1_decimals)
+            reference_prices = await reference_token_prices(sqrt_price, token0_decimals, token1_decimals)
+            # compared as strings, the exponents are stored in Decimal128 too
+            assert [str(price) for price in prices] == [str(price) for price in reference_prices]
+
+    asyncio.run(run())
+
+
+def test_amounts_match_the_decimal_reference():
+    async def run():
+        rnd = random.Random(2)
+        for _ in range(5000):
+            amount = rnd.choice([rnd.randint(-10 ** 30, 10 ** 30), rnd.randint(0, 10 ** 6), 0])
+            decimals = rnd.choice([0, 6, 8, 18, rnd.randint(0, 300)])
+            assert str(await amount_after_decimals(amount, decimals)) == str(
+                await reference_amount_after_decimals(amount, decimals))
+
+    asyncio.run(run())
+
+
+def test_stablecoin_is_priced_as_of_the_block():
+    async def run():
+        store = StateStore(None, None)
+        for block, eth_price in ((100, Decimal(2000)), (200, Decimal(4000))):
+            pool = {'poolAddress': ETH_USDC_ADDRESS, 'token0': ETH, 'token0Price': 1 / eth_price,
+                    'token1Price': eth_price}
+            await store.eth_price.update(pool, block)
+        assert await find_eth_per_token(store, STABLECOINS[0], 150) == Decimal(1) / Decimal(2000)
+        assert await find_eth_per_token(store, STABLECOINS[0], 200) == Decimal(1) / Decimal(4000)
+
+    asyncio.run(run())
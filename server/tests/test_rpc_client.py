@@ -0,0 +1,162 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from starknet_py.net.client_errors import ClientError
+from starknet_py.net.client_models import Call
+
+import server.rpc_client
+from server.rpc_client import RpcClient, RpcClients
+
+
+CALL = Call(to_addr=0x123, selector=0x456, calldata=[1, 2])
+
+
+# Local JSON-RPC node answering starknet_call with the handler result, a handler returning a web.Response
+# answers with it instead
+class MockRpcServer:
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.peers = set()
+        self._runner = None
+        self.url = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.peers.add(request.transport.get_extra_info('peername'))
+        try:
+            result = await self.handler(self, body)
+        finally:
+            self.in_flight -= 1
+        if isinstance(result, web.Response):
+            return result
+        return web.json_response({'jsonrpc': '2.0', 'id': body['id'], 'result': result})
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_post('/', self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f'http://127.0.0.1:{port}/'
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await RpcClients.close()
+        await self._runner.cleanup()
+
+
+async def answer_calldata(server: MockRpcServer, body: dict) -> list[str]:
+    return body['params']['request']['calldata']
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(server.rpc_client, 'RPC_RETRY_BACKOFF', 0.01)
+
+
+def test_call_contract():
+    async def run():
+        async with MockRpcServer(answer_calldata) as rpc_server:
+            rpc_client = await RpcClients.get(rpc_server.url)
+            assert await rpc_client.call_contract(CALL, 100) == [1, 2]
+
+    asyncio.run(run())
+
+
+def test_concurrency_limit(monkeypatch):
+    monkeypatch.setattr(server.rpc_client, 'RPC_MAX_CONCURRENCY', 3)
+
+    async def slow_answer(server: MockRpcServer, body: dict) -> list[str]:
+        await asyncio.sleep(0.05)
+        return await answer_calldata(server, body)
+
+    async def run():
+        async with MockRpcServer(slow_answer) as rpc_server:
+            rpc_client = RpcClient(rpc_server.url)
+            try:
+                results = await asyncio.gather(*[rpc_client.call_contract(CALL, block) for block in range(20)])
+            finally:
+                await rpc_client.close()
+            assert results == [[1, 2]] * 20
+            assert rpc_server.requests == 20
+            assert rpc_server.max_in_flight == 3
+
+    asyncio.run(run())
+
+
+def test_retry_with_backoff():
+    async def unavailable_twice(server: MockRpcServer, body: dict):
+        if server.requests <= 2:
+            return web.Response(status=503, text='unavailable')
+        return await answer_calldata(server, body)
+
+    async def run():
+        async with MockRpcServer(unavailable_twice) as rpc_server:
+            rpc_client = await RpcClients.get(rpc_server.url)
+            started = asyncio.get_running_loop().time()
+            assert await rpc_client.call_contract(CALL, 100) == [1, 2]
+            # backoff of 0.01s then 0.02s
+            assert asyncio.get_running_loop().time() - started >= 0.03
+            assert rpc_server.requests == 3
+            stats = (await rpc_client.get_stats())['call']
+            assert stats['calls'] == 3
+            assert stats['errors'] == 2
+            assert stats['retries'] == 2
+
+    asyncio.run(run())
+
+
+def test_retries_are_bounded(monkeypatch):
+    monkeypatch.setattr(server.rpc_client, 'RPC_MAX_RETRIES', 2)
+
+    async def always_unavailable(server: MockRpcServer, body: dict) -> web.Response:
+        return web.Response(status=503, text='unavailable')
+
+    async def run():
+        async with MockRpcServer(always_unavailable) as rpc_server:
+            rpc_client = await RpcClients.get(rpc_server.url)
+            with pytest.raises(ClientError):
+                await rpc_client.call_contract(CALL, 100)
+            assert rpc_server.requests == 3
+
+    asyncio.run(run())
+
+
+def test_contract_errors_are_not_retried():
+    async def contract_error(server: MockRpcServer, body: dict) -> web.Response:
+        return web.json_response({'jsonrpc': '2.0', 'id': body['id'],
+                                  'error': {'code': 21, 'message': 'Invalid message selector'}})
+
+    async def run():
+        async with MockRpcServer(contract_error) as rpc_server:
+            rpc_client = await RpcClients.get(rpc_server.url)
+            with pytest.raises(ClientError):
+                await rpc_client.call_contract(CALL, 100)
+            assert rpc_server.requests == 1
+
+    asyncio.run(run())
+
+
+def test_client_is_shared_per_url():
+    async def run():
+        async with MockRpcServer(answer_calldata) as rpc_server, MockRpcServer(answer_calldata) as other_server:
+            rpc_client = await RpcClients.get(rpc_server.url)
+            assert await RpcClients.get(rpc_server.url) is rpc_client
+            assert await RpcClients.get(other_server.url) is not rpc_client
+
+            for block in range(5):
+                await (await RpcClients.get(rpc_server.url)).call_contract(CALL, block)
+            # the requests go through one kept-alive connection of the shared session
+            assert rpc_server.requests == 5
+            assert len(rpc_server.peers) == 1
+
+    asyncio.run(run())
@@ -0,0 +1,57 @@
+import asyncio
+from decimal import Decimal
+
+from structlog.testing import capture_logs
+
+from server.transform.ticks import PoolTicks
+
+
+POOL = {'poolAddress': '0x1', 'tick': 0, 'feeGrowthGlobal0X128': hex(100), 'feeGrowthGlobal1X128': hex(200)}
+
+
+def test_ticks_follow_mints_and_burns():
+    async def run():
+        pool_ticks = PoolTicks('0x1')
+        lower = await pool_ticks.update(POOL, -10, Decimal(5), upper=False)
+        upper = await pool_ticks.update(POOL, 10, Decimal(5), upper=True)
+        assert (lower['liquidityGross'], lower['liquidityNet']) == (Decimal(5), Decimal(5))
+        assert (upper['liquidityGross'], upper['liquidityNet']) == (Decimal(5), Decimal(-5))
+        # the fee growth before a tick is initialized is counted below it
+        assert lower['feeGrowthOutside0X128'] == hex(100)
+        assert upper['feeGrowthOutside0X128'] == '0x0'
+        assert pool_ticks.ticks == [-10, 10]
+
+        await pool_ticks.update(POOL, -10, Decimal(-5), upper=False)
+        assert pool_ticks.ticks == [10]
+        assert await pool_ticks.get(-10) is None
+
+    asyncio.run(run())
+
+
+def test_swap_crosses_ticks():
+    async def run():
+        pool_ticks = PoolTicks('0x1')
+        await pool_ticks.update(POOL, -10, Decimal(5), upper=False)
+        await pool_ticks.update(POOL, 10, Decimal(5), upper=True)
+        fee_growth = {'feeGrowthGlobal0X128': hex(300), 'feeGrowthGlobal1X128': hex(400)}
+        crossed = await pool_ticks.cross(10, fee_growth)
+        assert crossed['tickIdx'] == 10
+        assert crossed['feeGrowthOutside0X128'] == hex(300)
+        assert crossed['feeGrowthOutside1X128'] == hex(400)
+        # crossed back, the outside fee growth flips to the side below the tick again
+        crossed = await pool_ticks.cross(10, {'feeGrowthGlobal0X128': hex(500), 'feeGrowthGlobal1X128': hex(600)})
+        assert crossed['feeGrowthOutside0X128'] == hex(200)
+        assert crossed['feeGrowthOutside1X128'] == hex(200)
+
+    asyncio.run(run())
+
+
+def test_burn_of_a_missing_tick_is_logged():
+    async def run():
+        pool_ticks = PoolTicks('0x1')
+        with capture_logs() as logs:
+            await pool_ticks.update(POOL, -10, Decimal(-5), upper=False)
+        assert [log['log_level'] for log in logs] == ['error']
+        assert pool_ticks.ticks == []
+
+    asyncio.run(run())